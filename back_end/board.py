@@ -1,32 +1,113 @@
 import numpy as np
-import pandas as pd
 
-from common.config import STARTING_PIECES, PIECE_SYMBOLS
+from common.config import (
+    STARTING_PIECES,
+    COLORS,
+    PIECE_TYPES,
+    WHITE,
+    BLACK,
+    PAWN,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+    COLOR_INDEX,
+    PIECE_TYPE_INDEX,
+    BITBOARD_INDEX,
+    EMPTY,
+    PIECE_CODE_COSTS,
+    PIECE_CODE_SYMBOLS,
+    CASTLING_RIGHTS,
+    CASTLING_RIGHTS_KEPT,
+    FEN_SYMBOLS,
+    MOVE_PROMOTION,
+    MOVE_EN_PASSANT,
+    MOVE_CASTLING,
+    PROMOTION_TYPES,
+)
+from back_end.evaluation import PIECE_SQUARE_SCORE_LISTS
+from back_end.fen import (
+    FEN_CODE_SYMBOLS,
+    expand_placement,
+    format_fen,
+    format_operations,
+    parse_castling,
+    parse_turn,
+    split_fen,
+)
+from back_end.moves import get_attackers, get_piece_attacks
+from back_end.utils import (
+    bitboard_to_array,
+    bitboard_to_positions,
+    load_between_bitboards,
+    load_bitboard_tables,
+    lookup_slider_attacks,
+    square_to_position,
+)
+
+# Random keys of the Zobrist hash, seeded so that hashes agree across processes
+_zobrist_keys = (
+    np.random.default_rng(1997)
+    .integers(0, 2**64, size=len(BITBOARD_INDEX) * 64 + 1 + 16 + 8, dtype=np.uint64)
+    .tolist()
+)
+ZOBRIST_PIECES = [
+    _zobrist_keys[i * 64 : (i + 1) * 64] for i in range(len(BITBOARD_INDEX))
+]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_keys[len(BITBOARD_INDEX) * 64]
+ZOBRIST_CASTLING = _zobrist_keys[len(BITBOARD_INDEX) * 64 + 1 :][:16]
+ZOBRIST_EN_PASSANT_FILE = _zobrist_keys[-8:]
+# Indices of the bitboards of the bishops, rooks and queens of both colors
+SLIDER_INDICES = [
+    color * len(PIECE_TYPES) + piece_type
+    for color in [WHITE, BLACK]
+    for piece_type in [BISHOP, ROOK, QUEEN]
+]
 
 
 class Piece:
-    def __init__(self, color, piece_type, position=None):
+    __slots__ = ("color", "piece_type", "position", "is_moved")
+
+    def __init__(self, color, piece_type, position=None, is_moved=False):
         """
-        Initialize a piece with its color and type.
+        Initialize a piece with its color and type. The board stores piece codes, see
+        Board.board, and creates Piece views of them on demand.
 
-        :param color: 'white' or 'black'
-        :param piece_type: 'pawn', 'rook', 'knight', 'bishop', 'queen', or 'king'
+        :param color: 'white' or 'black', or WHITE or BLACK
+        :param piece_type: 'pawn', 'rook', 'knight', 'bishop', 'queen', or 'king', or
+            PAWN, ROOK, KNIGHT, BISHOP, QUEEN or KING
         """
-        self.color = color
-        self.piece_type = piece_type
-        self.is_moved = False  # Useful for specific rules like castling or en passant.
+        self.color = COLOR_INDEX[color]
+        self.piece_type = PIECE_TYPE_INDEX[piece_type]
+        self.is_moved = is_moved  # Useful for specific rules like castling.
         self.position = position
-        self.cost = {
-            "pawn": 1,
-            "knight": 3,
-            "bishop": 3,
-            "rook": 5,
-            "queen": 9,
-            "king": 10000,
-        }.get(piece_type)
+
+    @property
+    def code(self):
+        """Code of the piece in the Board.board mailbox."""
+        return self.color * len(PIECE_TYPES) + self.piece_type + 1
+
+    @property
+    def cost(self):
+        return PIECE_CODE_COSTS[self.code]
 
     def __repr__(self):
-        return f"{PIECE_SYMBOLS[self.color + '_' + self.piece_type]}"
+        return PIECE_CODE_SYMBOLS[self.code]
+
+
+class PieceView:
+    """Read-only sequence of the Piece (or None) on each position of a board."""
+
+    __slots__ = ("board",)
+
+    def __init__(self, board):
+        self.board = board
+
+    def __getitem__(self, position):
+        return self.board.get_piece(position)
+
+    def __len__(self):
+        return 64
 
 
 class Board:
@@ -35,24 +116,370 @@ class Board:
         Initialize a chess game.
         """
         self.player_color = kwargs.get("player_color", "white")
-        self.board = np.empty((8, 8), dtype=object)
-        self.piece_positions = np.empty(64, dtype=Piece)
-        self.all_pieces = {
-            "white": np.zeros(64, dtype=bool),
-            "black": np.zeros(64, dtype=bool),
-        }
-        self.pawns = {
-            "white": np.array([], dtype=int),
-            "black": np.array([], dtype=int),
-        }
-        self.costs = np.zeros(64, dtype=int)
-        self.initialize_board()
+        self.clear()
+        fen = kwargs.get("fen")
+        snapshot = kwargs.get("snapshot")
+        if fen is not None:
+            self.set_fen(fen)
+        elif snapshot is not None:
+            self.set_snapshot(snapshot)
+        else:
+            self.initialize_board()
+
+    @classmethod
+    def from_fen(cls, fen, **kwargs):
+        """Create a board from a FEN or EPD string."""
+        return cls(fen=fen, **kwargs)
+
+    def clear(self):
+        """Remove all the pieces and reset the game state."""
+        # Piece code of each position, see PIECE_CODE_SYMBOLS; the bytearray is faster
+        # to index from Python, Board.board is an int8 numpy view of it
+        self.mailbox = bytearray(64)
+        self.board = np.frombuffer(self.mailbox, dtype=np.int8)
+        self.piece_positions = PieceView(self)
+        # One bitboard per (color, piece_type), indexed by BITBOARD_INDEX, they double
+        # as the piece lists of each color and type
+        self.bitboards = [0] * len(BITBOARD_INDEX)
+        self.occupancy = [0, 0]  # Bitboard of each color
+        self.turn = WHITE
+        self.castling_rights = 0  # Bits of CASTLING_RIGHTS
+        self.en_passant = None  # Square behind a pawn that just made a double step
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.history = []  # Undo stack of make_move
+        self.hash = 0  # Zobrist key, updated incrementally
+        self.score = 0  # Material and piece-square score, white positive
+        # Squares attacked by the piece on each position, updated incrementally by
+        # make_move; the attack maps and check masks derived from them are cached
+        self.move_data = load_bitboard_tables()
+        self.square_attacks = [0] * 64
+        self._attack_maps = None
+        self._check_masks = None
 
     def __repr__(self):
-        board = self.board.reshape((8, 8))
-        board = np.where(board == None, ".", board)
+        board = np.array(PIECE_CODE_SYMBOLS)[self.board].reshape((8, 8))
         return self.print_board_layout(board, "Chess Board")
 
+    @property
+    def all_pieces(self):
+        """Boolean view of the squares occupied by each color."""
+        return {
+            color: bitboard_to_array(self.occupancy[i])
+            for i, color in enumerate(COLORS)
+        }
+
+    @property
+    def pawns(self):
+        """Positions of the pawns of each color."""
+        return {
+            color: np.array(self.get_piece_list(color, PAWN), dtype=int)
+            for color in COLORS
+        }
+
+    @property
+    def occupied(self):
+        """Bitboard of all occupied squares."""
+        return self.occupancy[WHITE] | self.occupancy[BLACK]
+
+    @property
+    def costs(self):
+        """Cost of the piece on each position, 0 for the empty squares."""
+        return np.array(PIECE_CODE_COSTS)[self.board]
+
+    def get_bitboard(self, color, piece_type):
+        """Get the bitboard of the pieces of a color and type."""
+        return self.bitboards[
+            COLOR_INDEX[color] * len(PIECE_TYPES) + PIECE_TYPE_INDEX[piece_type]
+        ]
+
+    def get_piece_list(self, color, piece_type):
+        """Get the positions of the pieces of a color and type."""
+        return bitboard_to_positions(self.get_bitboard(color, piece_type))
+
+    def compute_hash(self):
+        """Compute the Zobrist key from scratch, Board.hash is kept up to date instead."""
+        key = 0
+        for index, bitboard in enumerate(self.bitboards):
+            for position in bitboard_to_positions(bitboard):
+                key ^= ZOBRIST_PIECES[index][position]
+        if self.turn == BLACK:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT_FILE[self.en_passant % 8]
+        return key
+
+    def get_piece(self, position):
+        """Get a view of the piece at a position, None for an empty square."""
+        code = self.mailbox[position]
+        if not code:
+            return None
+        color, piece_type = divmod(code - 1, len(PIECE_TYPES))
+        if piece_type == PAWN:
+            is_moved = position // 8 != (1 if color == WHITE else 6)
+        elif piece_type in [KING, ROOK]:
+            # Only the castling rights tell whether a king or a rook moved
+            is_moved = not any(
+                self.castling_rights >> bit & 1 and position in [king, rook]
+                for bit, (_, king, rook) in enumerate(CASTLING_RIGHTS)
+            )
+        else:
+            is_moved = False
+        return Piece(color, piece_type, position, is_moved)
+
+    def place_code(self, code, position):
+        """
+        Place the piece of a code on an empty square.
+
+        The attacks are not updated, call compute_attacks after editing a board by hand.
+        """
+        index = code - 1
+        self.mailbox[position] = code
+        self.bitboards[index] |= 1 << position
+        self.hash ^= ZOBRIST_PIECES[index][position]
+        self.score += PIECE_SQUARE_SCORE_LISTS[index][position]
+        self.occupancy[index // 6] |= 1 << position
+
+    def remove_code(self, position):
+        """Remove the piece on a square and return its code."""
+        code = self.mailbox[position]
+        index = code - 1
+        self.mailbox[position] = EMPTY
+        self.bitboards[index] ^= 1 << position
+        self.hash ^= ZOBRIST_PIECES[index][position]
+        self.score -= PIECE_SQUARE_SCORE_LISTS[index][position]
+        self.occupancy[index // 6] ^= 1 << position
+        return code
+
+    def place_piece(self, piece, position):
+        """Place a piece on an empty square."""
+        piece.position = position
+        self.place_code(piece.code, position)
+
+    def remove_piece(self, position):
+        """Remove the piece on a square and return it."""
+        piece = self.get_piece(position)
+        self.remove_code(position)
+        return piece
+
+    def move_piece(self, from_position, to_position):
+        """Move a piece to an empty square."""
+        self.place_code(self.remove_code(from_position), to_position)
+
+    def compute_attacks(self):
+        """Compute the attacks of all the pieces from scratch, see update_attacks."""
+        occupied = self.occupied
+        self.square_attacks = [
+            code and get_piece_attacks(self.move_data, code, position, occupied)
+            for position, code in enumerate(self.mailbox)
+        ]
+        self._attack_maps = None
+        self._check_masks = None
+
+    def update_attacks(self, changed):
+        """
+        Update the attacks after the pieces on some squares changed: the pieces on
+        these squares and the sliders whose rays reach one of them are recomputed.
+
+        :param changed: bitboard of the squares whose piece changed
+        """
+        attacks = self.square_attacks[:]  # The undo record keeps the old list
+        mailbox = self.mailbox
+        occupied = self.occupancy[0] | self.occupancy[1]
+        for position in bitboard_to_positions(changed):
+            code = mailbox[position]
+            attacks[position] = code and get_piece_attacks(
+                self.move_data, code, position, occupied
+            )
+        bitboards = self.bitboards
+        sliders = 0
+        for index in SLIDER_INDICES:
+            sliders |= bitboards[index]
+        # A ray ends on its first piece, so it crosses a changed square iff it reaches it
+        for position in bitboard_to_positions(sliders & ~changed):
+            if attacks[position] & changed:
+                attacks[position] = get_piece_attacks(
+                    self.move_data, mailbox[position], position, occupied
+                )
+        self.square_attacks = attacks
+        self._attack_maps = None
+        self._check_masks = None
+
+    def get_attack_maps(self):
+        """
+        Get the squares attacked by each color, squares of its own pieces included.
+
+        :return: [white attack bitboard, black attack bitboard]
+        """
+        if self._attack_maps is None:
+            attack_maps = []
+            for occupancy in self.occupancy:
+                attacked = 0
+                for position in bitboard_to_positions(occupancy):
+                    attacked |= self.square_attacks[position]
+                attack_maps.append(attacked)
+            self._attack_maps = attack_maps
+        return self._attack_maps
+
+    def get_check_masks(self):
+        """
+        Get the pieces checking the king of the side to move and its pinned pieces.
+
+        :return: (bitboard of the checkers, {pinned position: bitboard of the squares
+            between the king and the pinner, the pinner included})
+        """
+        if self._check_masks is not None:
+            return self._check_masks
+        color = self.turn
+        opposite_color = color ^ 1
+        king = self.bitboards[color * 6 + KING]
+        checkers, pins = 0, {}
+        if king:
+            position = king.bit_length() - 1
+            if self.get_attack_maps()[opposite_color] >> position & 1:
+                checkers = get_attackers(self, position, opposite_color, self.move_data)
+            between = load_between_bitboards()[position]
+            occupied = self.occupied
+            rook, bishop = self.move_data["queen"]
+            queens = self.bitboards[opposite_color * 6 + QUEEN]
+            rooks = self.bitboards[opposite_color * 6 + ROOK] | queens
+            bishops = self.bitboards[opposite_color * 6 + BISHOP] | queens
+            # Sliders that would attack the king through the pieces of its own color
+            own_pieces = self.occupancy[color]
+            snipers = 0
+            if rooks:
+                snipers |= rooks & lookup_slider_attacks(
+                    rook, position, occupied ^ own_pieces
+                )
+            if bishops:
+                snipers |= bishops & lookup_slider_attacks(
+                    bishop, position, occupied ^ own_pieces
+                )
+            for sniper in bitboard_to_positions(snipers & ~checkers):
+                blockers = between[sniper] & occupied
+                if blockers & (blockers - 1) == 0 and blockers & own_pieces:
+                    pins[blockers.bit_length() - 1] = between[sniper] | 1 << sniper
+        self._check_masks = checkers, pins
+        return self._check_masks
+
+    def make_move(self, move):
+        """
+        Apply a packed move (see encode_move) in place and push its undo record.
+        """
+        from_position = move & 63
+        to_position = move >> 6 & 63
+        flag = move >> 14
+        code = self.mailbox[from_position]
+        color = (code - 1) // 6
+
+        captured_position = to_position
+        if flag == MOVE_EN_PASSANT:
+            captured_position += -8 if color == WHITE else 8
+        captured = self.mailbox[captured_position]
+
+        self.history.append(
+            (
+                move,
+                code,
+                captured,
+                self.castling_rights,
+                self.en_passant,
+                self.halfmove_clock,
+                self.square_attacks,
+                self._attack_maps,
+                self._check_masks,
+                self.hash,
+            )
+        )
+        if self.en_passant is not None:
+            self.hash ^= ZOBRIST_EN_PASSANT_FILE[self.en_passant % 8]
+
+        changed = 1 << from_position | 1 << to_position
+        if captured:
+            self.remove_code(captured_position)
+            changed |= 1 << captured_position
+        self.remove_code(from_position)
+        if flag == MOVE_PROMOTION:
+            promotion = PROMOTION_TYPES[move >> 12 & 3]
+            self.place_code(color * 6 + promotion + 1, to_position)
+        else:
+            self.place_code(code, to_position)
+        if flag == MOVE_CASTLING:
+            if to_position > from_position:
+                rook_from, rook_to = to_position + 1, to_position - 1
+            else:
+                rook_from, rook_to = to_position - 2, to_position + 1
+            self.move_piece(rook_from, rook_to)
+            changed |= 1 << rook_from | 1 << rook_to
+        self.update_attacks(changed)
+        castling_rights = (
+            self.castling_rights
+            & CASTLING_RIGHTS_KEPT[from_position]
+            & CASTLING_RIGHTS_KEPT[to_position]
+        )
+        if castling_rights != self.castling_rights:
+            self.hash ^= ZOBRIST_CASTLING[self.castling_rights]
+            self.hash ^= ZOBRIST_CASTLING[castling_rights]
+            self.castling_rights = castling_rights
+
+        is_pawn = (code - 1) % 6 == PAWN
+        if is_pawn and abs(to_position - from_position) == 16:
+            self.en_passant = (from_position + to_position) // 2
+            self.hash ^= ZOBRIST_EN_PASSANT_FILE[from_position % 8]
+        else:
+            self.en_passant = None
+        if is_pawn or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color == BLACK:
+            self.fullmove_number += 1
+        self.turn = color ^ 1
+        self.hash ^= ZOBRIST_BLACK_TO_MOVE
+
+    def unmake_move(self):
+        """
+        Take back the last move applied by make_move.
+        """
+        (
+            move,
+            code,
+            captured,
+            castling_rights,
+            en_passant,
+            halfmove_clock,
+            self.square_attacks,
+            self._attack_maps,
+            self._check_masks,
+            key,
+        ) = self.history.pop()
+        from_position = move & 63
+        to_position = move >> 6 & 63
+        flag = move >> 14
+        color = (code - 1) // 6
+
+        if flag == MOVE_CASTLING:
+            if to_position > from_position:
+                rook_from, rook_to = to_position + 1, to_position - 1
+            else:
+                rook_from, rook_to = to_position - 2, to_position + 1
+            self.move_piece(rook_to, rook_from)
+        self.remove_code(to_position)
+        self.place_code(code, from_position)
+        if captured:
+            if flag == MOVE_EN_PASSANT:
+                to_position += -8 if color == WHITE else 8
+            self.place_code(captured, to_position)
+
+        self.castling_rights = castling_rights
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.hash = key
+        if color == BLACK:
+            self.fullmove_number -= 1
+        self.turn = color
+
     def initialize_board(self):
         """Set the pieces to their starting positions."""
         colors = ["black", "white"]
@@ -61,33 +488,139 @@ class Board:
             row = 1 if color == "white" else 6
             for col in range(8):
                 position = row * 8 + col
-                self.board[row, col] = Piece(color, "pawn", position)
-                self.piece_positions[position] = self.board[row, col]
-                self.all_pieces[color][position] = True
-                self.pawns[color] = np.append(self.pawns[color], position)
-                self.costs[position] = self.board[row, col].cost
+                self.place_piece(Piece(color, "pawn"), position)
 
             row = 0 if color == "white" else 7
             for col, piece_type in enumerate(STARTING_PIECES):
                 position = row * 8 + col
-                self.board[row, col] = Piece(color, piece_type, position)
-                self.piece_positions[position] = self.board[row, col]
-                self.all_pieces[color][position] = True
-                self.costs[position] = self.board[row, col].cost
-        r, c = 2, 4
-        self.board[r, c] = Piece("white", "queen", r * 8 + c)
-        self.piece_positions[r * 8 + c] = self.board[r, c]
-        self.all_pieces["white"][r * 8 + c] = True
-        self.costs[r * 8 + c] = self.board[r, c].cost
-        self.board = self.board.reshape(-1)  # Convert board to 1D array
+                self.place_piece(Piece(color, piece_type), position)
+        self.set_castling_rights(15)
+        self.hash = self.compute_hash()
+        self.compute_attacks()
 
-    def get_piece(self, position):
-        """Get the piece at a position."""
+    def set_fen(self, fen):
+        """
+        Set up the position of a FEN string, e.g. the starting position is
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1".
+
+        EPD strings are accepted too, see Board.set_epd.
+        """
+        self.set_epd(fen)
+
+    def set_epd(self, epd):
+        """
+        Set up the position of an EPD string, e.g. 'r1bqkbnr/... w KQkq - bm Nf3;'.
+
+        :return: the operations of the EPD, e.g. {"bm": "Nf3"}
+        """
+        placement, turn, castling, en_passant, halfmove, fullmove, operations = (
+            split_fen(epd)
+        )
+        squares = expand_placement(placement)
+        self.clear()
+        for position, symbol in enumerate(squares):
+            if symbol != ".":
+                if symbol not in FEN_SYMBOLS:
+                    raise ValueError(f"Invalid FEN placement: {placement}")
+                self.place_code(FEN_CODE_SYMBOLS.index(symbol), position)
+        self.set_castling_rights(parse_castling(castling))
+        self.turn = parse_turn(turn)
+        self.en_passant = None if en_passant == "-" else square_to_position(en_passant)
+        self.halfmove_clock = halfmove
+        self.fullmove_number = fullmove
+        self.hash = self.compute_hash()
+        self.compute_attacks()
+        return operations
+
+    def to_fen(self):
+        """Get the FEN string of the position."""
+        return format_fen(
+            "".join(FEN_CODE_SYMBOLS[code] for code in self.mailbox),
+            self.turn,
+            self.castling_rights,
+            self.en_passant,
+            self.halfmove_clock,
+            self.fullmove_number,
+        )
+
+    def to_epd(self, operations=None):
+        """
+        Get the EPD string of the position, the clocks become the hmvc and fmvn operations.
+
+        :param operations: further operations, e.g. {"bm": "Nf3", "id": "test 1"}
+        """
+        fields = self.to_fen().split()
+        operations = {
+            "hmvc": self.halfmove_clock,
+            "fmvn": self.fullmove_number,
+            **(operations or {}),
+        }
+        return f"{' '.join(fields[:4])} {format_operations(operations)}"
+
+    def set_castling_rights(self, castling_rights):
+        """Set the castling rights, keeping those whose king and rook are in place."""
+        self.castling_rights = 0
+        for bit, (color, king_position, rook_position) in enumerate(CASTLING_RIGHTS):
+            king_code = color * len(PIECE_TYPES) + KING + 1
+            rook_code = color * len(PIECE_TYPES) + ROOK + 1
+            if (
+                castling_rights >> bit & 1
+                and self.mailbox[king_position] == king_code
+                and self.mailbox[rook_position] == rook_code
+            ):
+                self.castling_rights |= 1 << bit
+
+    def snapshot(self):
+        """
+        Get a compact copy of the position: the 12 bitboards, the side to move, the
+        castling rights, the en passant square and the clocks.
+        """
+        return (
+            tuple(self.bitboards),
+            self.turn,
+            self.castling_rights,
+            self.en_passant,
+            self.halfmove_clock,
+            self.fullmove_number,
+        )
 
-        return self.piece_positions[position]
+    def set_snapshot(self, snapshot):
+        """Set up the position of a snapshot, see Board.snapshot."""
+        bitboards, turn, castling_rights, en_passant, halfmove, fullmove = snapshot
+        self.clear()
+        for index, bitboard in enumerate(bitboards):
+            for position in bitboard_to_positions(bitboard):
+                self.place_code(index + 1, position)
+        self.set_castling_rights(castling_rights)
+        self.turn = turn
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove
+        self.fullmove_number = fullmove
+        self.hash = self.compute_hash()
+        self.compute_attacks()
+
+    def is_repetition(self, count=2):
+        """
+        Check whether the position occurred count times, this one included, since the
+        last irreversible move. The search scores the first repeat as a draw, a game is
+        only drawn by the third occurrence.
+        """
+        if self.halfmove_clock < 4 * (count - 1):
+            return False
+        # The undo records hold the keys before each move, same side to move every 2nd
+        records = self.history[-self.halfmove_clock :]
+        repeats = count - 1
+        for record in records[-4::-2]:
+            if record[-1] == self.hash:
+                repeats -= 1
+                if not repeats:
+                    return True
+        return False
 
     def print_board_layout(self, layout, title="", header=True, *kwargs):
         """Prints a given board layout with an optional title."""
+        import pandas as pd  # Only needed for printing, slow to import
+
         if layout.size == 64:  # If the layout is a 1D array
             layout = layout.reshape((8, 8))
 
@@ -103,15 +636,19 @@ class Board:
         layout_str = f"{title}\n{layout_df.to_string(header=header, index=True)}"
         return layout_str
 
+    def format_bool(self, layout):
+        """Formats a boolean board."""
+        pieces_layout = np.where(layout.reshape((8, 8)), "X", ".")
+        return self.print_board_layout(pieces_layout, "Boolean Board")
+
     def print_bool(self, layout, *kwargs):
         """Prints the boolean board."""
-        pieces_layout = np.where(layout.reshape((8, 8)), "X", ".")
-        layout = self.print_board_layout(pieces_layout, "Boolean Board")
-        return print(layout)
+        return print(self.format_bool(layout))
 
     def print_pieces(self, color, *kwargs):
         """Prints the pieces for the given color."""
-        assert color in ["white", "black"], "Color must be 'white' or 'black'"
+        assert color in COLOR_INDEX, "Color must be 'white' or 'black'"
+        color = COLORS[COLOR_INDEX[color]]
         pieces_layout = np.where(self.all_pieces[color].reshape((8, 8)), "X", ".")
         layout = self.print_board_layout(pieces_layout, f"{color.title()} Pieces")
         return print(layout)
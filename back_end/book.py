@@ -0,0 +1,116 @@
+"""
+Opening book built from PGN games, see scripts/make_opening_book.py.
+
+The book is a file written with save_arrays of three columns sorted by key: the
+Zobrist key of each position, a packed move played from it and the weight of the
+move. It is memory-mapped and binary-searched, so opening it costs no parsing.
+"""
+
+import os
+import random
+from collections import Counter
+
+import numpy as np
+
+from back_end.pgn import iter_games, replay_game
+from back_end.utils import open_arrays, save_arrays
+
+BOOK_PATH = os.path.join(os.path.dirname(__file__), "lookup_tables", "BOOK.bin")
+BOOK_MAGIC = b"CHESSBOK"
+BOOK_VERSION = 1
+# Weight of a move for (white, black) per game result: 2 for a win and 1 for a draw
+RESULT_WEIGHTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1), "*": (1, 1)}
+
+
+def build_book(lines, max_ply=20, min_weight=1, skip_invalid=True):
+    """
+    Replay the games of PGN lines and sum the weights of the moves played in their
+    first plies, by the results of the games.
+
+    :param max_ply: moves of each game to include
+    :param min_weight: drop the moves with a lower total weight
+    :param skip_invalid: skip the rest of a game at an illegal move instead of raising
+    :return: {"keys": uint64, "moves": uint16, "weights": uint32} sorted by key, then
+        by decreasing weight
+    """
+    from back_end.game import ChessGame
+
+    game = ChessGame()
+    weights = Counter()
+    for headers, sans in iter_games(lines):
+        result_weights = RESULT_WEIGHTS.get(headers.get("Result"), (1, 1))
+        key = None
+        try:
+            for _, move in replay_game(game, headers, sans[:max_ply]):
+                if move is not None:
+                    weights[key, move] += result_weights[game.board.turn ^ 1]
+                key = game.board.hash
+        except ValueError:
+            if not skip_invalid:
+                raise
+
+    rows = [(key, move, weight) for (key, move), weight in weights.items()]
+    rows = [row for row in rows if row[2] >= min_weight]
+    keys, moves, book_weights = zip(*rows) if rows else ([], [], [])
+    keys = np.array(keys, dtype=np.uint64)
+    moves = np.array(moves, dtype=np.uint16)
+    book_weights = np.array(book_weights, dtype=np.uint32)
+    order = np.lexsort((-book_weights.astype(np.int64), keys))
+    return {
+        "keys": keys[order],
+        "moves": moves[order],
+        "weights": book_weights[order],
+    }
+
+
+def save_book(book, path=BOOK_PATH):
+    """Write a book of build_book, see save_arrays."""
+    save_arrays(path, book, BOOK_MAGIC, BOOK_VERSION)
+
+
+class OpeningBook:
+    def __init__(self, path=BOOK_PATH, seed=None):
+        """
+        Memory-map a book written by save_book.
+
+        :param seed: seed of the weighted random choice of the book moves
+        """
+        arrays = open_arrays(path, BOOK_MAGIC, BOOK_VERSION)
+        self.keys = arrays["keys"]
+        self.moves = arrays["moves"]
+        self.weights = arrays["weights"]
+        self.rng = random.Random(seed)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_moves(self, key):
+        """
+        Binary-search the moves of a position.
+
+        :param key: Zobrist key of the position, see Board.hash
+        :return: list of (packed move, weight), heaviest first
+        """
+        key = np.uint64(key)
+        start = np.searchsorted(self.keys, key, side="left")
+        end = np.searchsorted(self.keys, key, side="right")
+        return list(
+            zip(self.moves[start:end].tolist(), self.weights[start:end].tolist())
+        )
+
+    def choose_move(self, key, legal_moves=None):
+        """
+        Pick a book move at random in proportion to its weight.
+
+        :param legal_moves: only pick among these moves, to guard against key collisions
+        :return: packed move, None when the book has no move for the position
+        """
+        entries = [
+            (move, weight)
+            for move, weight in self.get_moves(key)
+            if weight and (legal_moves is None or move in legal_moves)
+        ]
+        if not entries:
+            return None
+        moves, weights = zip(*entries)
+        return self.rng.choices(moves, weights)[0]
@@ -0,0 +1,68 @@
+import sys
+from collections import OrderedDict
+
+# Approximate bytes an OrderedDict entry costs besides its key and value
+ENTRY_OVERHEAD = 100
+
+
+class MoveCache:
+    def __init__(self, max_bytes=1 << 20):
+        """
+        Least recently used cache of move generation results, bounded by memory.
+
+        :param max_bytes: approximate memory budget of the keys and values
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """Get a cached value and mark it as the most recently used."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used ones beyond the budget."""
+        size = sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(item) for item in value)
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self.entries:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all the entries, the counters are kept."""
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Get the size and the hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,259 @@
+import numpy as np
+
+from common.config import (
+    BITBOARD_INDEX,
+    PIECE_COSTS,
+    PIECE_CODE_COSTS,
+    PIECE_TYPES,
+    WHITE,
+    BLACK,
+    PAWN,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+)
+from back_end.utils import (
+    bitboard_to_positions,
+    gather_slider_attacks,
+    load_attack_arrays,
+    popcount_array,
+)
+
+# Piece-square tables in centipawns from white's point of view, written as seen by
+# white (rank 8 on top) and flipped below so that they are indexed by position.
+PIECE_SQUARE_TABLES = {
+    "pawn": np.array(
+        [
+            [0, 0, 0, 0, 0, 0, 0, 0],
+            [50, 50, 50, 50, 50, 50, 50, 50],
+            [10, 10, 20, 30, 30, 20, 10, 10],
+            [5, 5, 10, 25, 25, 10, 5, 5],
+            [0, 0, 0, 20, 20, 0, 0, 0],
+            [5, -5, -10, 0, 0, -10, -5, 5],
+            [5, 10, 10, -20, -20, 10, 10, 5],
+            [0, 0, 0, 0, 0, 0, 0, 0],
+        ]
+    ),
+    "knight": np.array(
+        [
+            [-50, -40, -30, -30, -30, -30, -40, -50],
+            [-40, -20, 0, 0, 0, 0, -20, -40],
+            [-30, 0, 10, 15, 15, 10, 0, -30],
+            [-30, 5, 15, 20, 20, 15, 5, -30],
+            [-30, 0, 15, 20, 20, 15, 0, -30],
+            [-30, 5, 10, 15, 15, 10, 5, -30],
+            [-40, -20, 0, 5, 5, 0, -20, -40],
+            [-50, -40, -30, -30, -30, -30, -40, -50],
+        ]
+    ),
+    "bishop": np.array(
+        [
+            [-20, -10, -10, -10, -10, -10, -10, -20],
+            [-10, 0, 0, 0, 0, 0, 0, -10],
+            [-10, 0, 5, 10, 10, 5, 0, -10],
+            [-10, 5, 5, 10, 10, 5, 5, -10],
+            [-10, 0, 10, 10, 10, 10, 0, -10],
+            [-10, 10, 10, 10, 10, 10, 10, -10],
+            [-10, 5, 0, 0, 0, 0, 5, -10],
+            [-20, -10, -10, -10, -10, -10, -10, -20],
+        ]
+    ),
+    "rook": np.array(
+        [
+            [0, 0, 0, 0, 0, 0, 0, 0],
+            [5, 10, 10, 10, 10, 10, 10, 5],
+            [-5, 0, 0, 0, 0, 0, 0, -5],
+            [-5, 0, 0, 0, 0, 0, 0, -5],
+            [-5, 0, 0, 0, 0, 0, 0, -5],
+            [-5, 0, 0, 0, 0, 0, 0, -5],
+            [-5, 0, 0, 0, 0, 0, 0, -5],
+            [0, 0, 0, 5, 5, 0, 0, 0],
+        ]
+    ),
+    "queen": np.array(
+        [
+            [-20, -10, -10, -5, -5, -10, -10, -20],
+            [-10, 0, 0, 0, 0, 0, 0, -10],
+            [-10, 0, 5, 5, 5, 5, 0, -10],
+            [-5, 0, 5, 5, 5, 5, 0, -5],
+            [0, 0, 5, 5, 5, 5, 0, -5],
+            [-10, 5, 5, 5, 5, 5, 0, -10],
+            [-10, 0, 5, 0, 0, 0, 0, -10],
+            [-20, -10, -10, -5, -5, -10, -10, -20],
+        ]
+    ),
+    "king": np.array(
+        [
+            [-30, -40, -40, -50, -50, -40, -40, -30],
+            [-30, -40, -40, -50, -50, -40, -40, -30],
+            [-30, -40, -40, -50, -50, -40, -40, -30],
+            [-30, -40, -40, -50, -50, -40, -40, -30],
+            [-20, -30, -30, -40, -40, -30, -30, -20],
+            [-10, -20, -20, -20, -20, -20, -20, -10],
+            [20, 20, 0, 0, 0, 0, 20, 20],
+            [20, 30, 10, 0, 0, 10, 30, 20],
+        ]
+    ),
+}
+PIECE_SQUARE_TABLES = {
+    piece_type: table[::-1].reshape(-1)
+    for piece_type, table in PIECE_SQUARE_TABLES.items()
+}
+
+
+def get_piece_square_scores():
+    """
+    Combine the material (Piece.cost in centipawns) and the piece-square tables into
+    the signed score of each (color, piece_type) on each position, white positive.
+
+    :return: (12, 64) array indexed by BITBOARD_INDEX and position
+    """
+    scores = np.zeros((len(BITBOARD_INDEX), 64), dtype=np.int64)
+    for (color, piece_type), index in BITBOARD_INDEX.items():
+        table = 100 * PIECE_COSTS[piece_type] + PIECE_SQUARE_TABLES[piece_type]
+        # Black's tables are white's mirrored vertically
+        scores[index] = (
+            table if color == "white" else -table.reshape(8, 8)[::-1].reshape(-1)
+        )
+    return scores
+
+
+PIECE_SQUARE_SCORES = get_piece_square_scores()
+# Nested lists are faster than numpy for the per-move updates of Board.score
+PIECE_SQUARE_SCORE_LISTS = PIECE_SQUARE_SCORES.tolist()
+
+
+def compute_score(bitboards):
+    """Compute the score of a position from scratch, Board.score is kept up to date instead."""
+    score = 0
+    for index, bitboard in enumerate(bitboards):
+        positions = bitboard_to_positions(bitboard)
+        score += int(PIECE_SQUARE_SCORES[index, positions].sum())
+    return score
+
+
+def evaluate(board):
+    """Evaluate a position in centipawns from the point of view of the side to move."""
+    return board.score if board.turn == WHITE else -board.score
+
+
+def positions_to_codes(positions):
+    """
+    Convert positions into the piece codes of their mailboxes, see Board.board.
+
+    :param positions: (N, 12) uint64 bitboards indexed by BITBOARD_INDEX, (N, 64) int8
+        mailboxes, or records with a bitboards field such as SNAPSHOT_DTYPE
+    :return: (N, 64) int8 array
+    """
+    positions = np.asarray(positions)
+    if positions.dtype.names is not None and "bitboards" in positions.dtype.names:
+        positions = positions["bitboards"]
+    if (
+        positions.ndim == 2
+        and positions.dtype.itemsize == 1
+        and positions.shape[1] == 64
+    ):
+        return positions.astype(np.int8, copy=False)
+    if positions.ndim == 2 and positions.dtype.itemsize == 8:
+        if positions.shape[1] == len(BITBOARD_INDEX):
+            bits = np.unpackbits(
+                positions.astype("<u8")
+                .view(np.uint8)
+                .reshape(len(positions), len(BITBOARD_INDEX), 8),
+                axis=2,
+                bitorder="little",
+            )
+            codes = np.arange(1, len(BITBOARD_INDEX) + 1, dtype=np.int8)
+            return (bits * codes[:, None]).sum(axis=1, dtype=np.int8)
+    raise ValueError(
+        f"Positions must be (N, 12) uint64 bitboards or (N, 64) int8 mailboxes, "
+        f"got {positions.dtype} {positions.shape}"
+    )
+
+
+def evaluate_batch(positions, chunk_size=1 << 14):
+    """
+    Evaluate many positions at once, in chunks of chunk_size positions.
+
+    :param positions: see positions_to_codes
+    :return: dict of arrays:
+        score: (N,) material and piece-square score in centipawns, white positive,
+            like Board.score
+        material: (N, 2) sum of the Piece.cost of each color, kings excluded
+        mobility: (N, 2) squares the knights, bishops, rooks, queens and king of each
+            color attack and could move to, summed over the pieces
+        attacked_squares: (N, 2) squares attacked by each color, its own excluded,
+            like ChessGame.get_attacked_squares
+        attacked_pieces: (N, 2) pieces of the other color attacked by each color
+    """
+    codes = positions_to_codes(positions)
+    chunks = [
+        evaluate_codes(codes[start : start + chunk_size])
+        for start in range(0, len(codes), chunk_size)
+    ] or [evaluate_codes(codes)]
+    return {
+        name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]
+    }
+
+
+def evaluate_codes(codes):
+    """Evaluate (N, 64) piece codes, see evaluate_batch."""
+    attack_arrays = load_attack_arrays()
+    squares = np.arange(64)
+    square_bits = np.left_shift(np.uint64(1), squares.astype(np.uint64))
+    pieces = codes > 0
+    index = np.maximum(codes.astype(np.intp) - 1, 0)  # Bitboard index of each piece
+    piece_types = index % len(PIECE_TYPES)
+    colors = [pieces & (index < len(PIECE_TYPES)), codes > len(PIECE_TYPES)]
+    occupancy = np.stack(
+        [
+            np.bitwise_or.reduce(np.where(color, square_bits, 0), axis=1)
+            for color in colors
+        ],
+        axis=1,
+    ).astype(np.uint64)
+    occupied = (occupancy[:, WHITE] | occupancy[:, BLACK])[:, None]
+
+    # Attack set of the piece on each square
+    attacks = np.zeros(codes.shape, dtype=np.uint64)
+    for color in [WHITE, BLACK]:
+        pawns = codes == color * len(PIECE_TYPES) + PAWN + 1
+        attacks[pawns] = np.broadcast_to(attack_arrays["pawn"][color], codes.shape)[
+            pawns
+        ]
+    for piece_type in ["knight", "king"]:
+        is_type = pieces & (piece_types == PIECE_TYPES.index(piece_type))
+        table = np.broadcast_to(attack_arrays[piece_type], codes.shape)
+        attacks[is_type] = table[is_type]
+    orthogonal = pieces & ((piece_types == ROOK) | (piece_types == QUEEN))
+    diagonal = pieces & ((piece_types == BISHOP) | (piece_types == QUEEN))
+    if orthogonal.any():
+        rook = gather_slider_attacks(attack_arrays["rook"], squares, occupied)
+        attacks[orthogonal] = rook[orthogonal]
+    if diagonal.any():
+        bishop = gather_slider_attacks(attack_arrays["bishop"], squares, occupied)
+        attacks[diagonal] |= bishop[diagonal]
+
+    costs = np.array(PIECE_CODE_COSTS)[codes]
+    costs[piece_types == KING] = 0
+    results = {
+        "score": np.where(pieces, PIECE_SQUARE_SCORES[index, squares], 0).sum(axis=1),
+        "material": np.zeros((len(codes), 2), dtype=np.int64),
+        "mobility": np.zeros((len(codes), 2), dtype=np.int64),
+        "attacked_squares": np.zeros((len(codes), 2), dtype=np.int64),
+        "attacked_pieces": np.zeros((len(codes), 2), dtype=np.int64),
+    }
+    for color, is_color in enumerate(colors):
+        own = occupancy[:, color]
+        moves = popcount_array(attacks & ~own[:, None])
+        results["material"][:, color] = (costs * is_color).sum(axis=1)
+        results["mobility"][:, color] = (
+            moves * (is_color & (piece_types != PAWN))
+        ).sum(axis=1)
+        attacked = np.bitwise_or.reduce(np.where(is_color, attacks, 0), axis=1) & ~own
+        results["attacked_squares"][:, color] = popcount_array(attacked)
+        results["attacked_pieces"][:, color] = popcount_array(
+            attacked & occupancy[:, 1 - color]
+        )
+    return results
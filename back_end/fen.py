@@ -0,0 +1,235 @@
+import numpy as np
+
+from common.config import BITBOARD_INDEX, CASTLING_SYMBOLS, COLORS, FEN_SYMBOLS
+from back_end.utils import position_to_square, square_to_position
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# FEN symbol of each piece code of Board.board, see PIECE_CODE_SYMBOLS
+FEN_CODE_SYMBOLS = "." + "".join(
+    sorted(FEN_SYMBOLS, key=lambda symbol: BITBOARD_INDEX[FEN_SYMBOLS[symbol]])
+)
+# Expands the digits of a FEN placement into empty squares and drops the rank separators
+FEN_EXPANSION = str.maketrans({str(n): "." * n for n in range(1, 9)} | {"/": None})
+
+# Record of a position loaded in bulk, the fields of a Board.snapshot
+SNAPSHOT_DTYPE = np.dtype(
+    [
+        ("bitboards", "<u8", (len(BITBOARD_INDEX),)),
+        ("turn", "u1"),
+        ("castling_rights", "u1"),
+        ("en_passant", "i1"),  # -1 for none
+        ("halfmove_clock", "<u2"),
+        ("fullmove_number", "<u2"),
+    ]
+)
+
+
+def expand_placement(placement):
+    """
+    Expand the placement field of a FEN into the symbol of each position, from A1 to
+    H8 with "." for the empty squares.
+    """
+    squares = "".join(reversed(placement.split("/"))).translate(FEN_EXPANSION)
+    if len(squares) != 64 or placement.count("/") != 7:
+        raise ValueError(f"Invalid FEN placement: {placement}")
+    return squares
+
+
+def split_fen(line):
+    """
+    Split a FEN or EPD line into its fields.
+
+    A FEN ends with the halfmove clock and the fullmove number, an EPD with operations
+    such as 'bm e4; id "test 1";' instead, whose hmvc and fmvn set the clocks.
+
+    :return: (placement, turn, castling, en_passant, halfmove, fullmove, operations)
+    """
+    fields = line.split(maxsplit=4)
+    if len(fields) < 4:
+        raise ValueError(f"FEN must have at least 4 fields: {line}")
+    placement, turn, castling, en_passant = fields[:4]
+    rest = fields[4] if len(fields) == 5 else ""
+    clocks = rest.split()
+    if len(clocks) == 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        return placement, turn, castling, en_passant, int(clocks[0]), int(clocks[1]), {}
+
+    operations = parse_operations(rest)
+    halfmove = int(operations.get("hmvc", 0))
+    fullmove = int(operations.get("fmvn", 1))
+    return placement, turn, castling, en_passant, halfmove, fullmove, operations
+
+
+def parse_operations(text):
+    """Parse the operations of an EPD, e.g. 'bm e4; id "a";' -> {"bm": "e4", "id": "a"}."""
+    operations = {}
+    for operation in text.split(";"):
+        opcode, _, operand = operation.strip().partition(" ")
+        if opcode:
+            operations[opcode] = operand.strip().strip('"')
+    return operations
+
+
+def format_operations(operations):
+    """Format the operations of an EPD, see parse_operations."""
+    formatted = []
+    for opcode, operand in operations.items():
+        if isinstance(operand, str) and (not operand or " " in operand):
+            operand = f'"{operand}"'
+        formatted.append(f"{opcode} {operand};")
+    return " ".join(formatted)
+
+
+def parse_castling(castling):
+    """Convert the castling field of a FEN into bits of CASTLING_RIGHTS."""
+    castling_rights = 0
+    for symbol in castling.replace("-", ""):
+        if symbol not in CASTLING_SYMBOLS:
+            raise ValueError(f"Invalid FEN castling rights: {castling}")
+        castling_rights |= 1 << CASTLING_SYMBOLS.index(symbol)
+    return castling_rights
+
+
+def parse_turn(turn):
+    if turn not in ["w", "b"]:
+        raise ValueError(f"Invalid FEN side to move: {turn}")
+    return 0 if turn == "w" else 1
+
+
+def format_fen(squares, turn, castling_rights, en_passant, halfmove, fullmove):
+    """
+    Format the fields of a position into a FEN.
+
+    :param squares: FEN symbol of each position from A1 to H8, "." for the empty squares
+    """
+    ranks = []
+    for row in range(7, -1, -1):
+        rank = squares[row * 8 : row * 8 + 8]
+        for n in range(8, 0, -1):
+            rank = rank.replace("." * n, str(n))
+        ranks.append(rank)
+    castling = "".join(
+        symbol
+        for bit, symbol in enumerate(CASTLING_SYMBOLS)
+        if castling_rights >> bit & 1
+    )
+    en_passant = "-" if en_passant is None else position_to_square(en_passant)
+    return (
+        f"{'/'.join(ranks)} {COLORS[turn][0]} {castling or '-'} {en_passant} "
+        f"{halfmove} {fullmove}"
+    )
+
+
+def fen_to_snapshot(line):
+    """
+    Parse a FEN or EPD line into a Board.snapshot, without setting up a Board.
+
+    :return: (snapshot, EPD operations)
+    """
+    placement, turn, castling, en_passant, halfmove, fullmove, operations = split_fen(
+        line
+    )
+    bitboards = [0] * len(BITBOARD_INDEX)
+    squares = expand_placement(placement)
+    for symbol in set(squares) - {"."}:
+        if symbol not in FEN_SYMBOLS:
+            raise ValueError(f"Invalid FEN placement: {placement}")
+        bitboard, position = 0, squares.find(symbol)
+        while position >= 0:
+            bitboard |= 1 << position
+            position = squares.find(symbol, position + 1)
+        bitboards[BITBOARD_INDEX[FEN_SYMBOLS[symbol]]] = bitboard
+    snapshot = (
+        tuple(bitboards),
+        parse_turn(turn),
+        parse_castling(castling),
+        None if en_passant == "-" else square_to_position(en_passant),
+        halfmove,
+        fullmove,
+    )
+    return snapshot, operations
+
+
+def iter_snapshots(lines):
+    """
+    Stream the positions of FEN or EPD lines, e.g. an open file, skipping the blank
+    lines and the comments starting with #.
+
+    :return: generator of (snapshot, EPD operations), see fen_to_snapshot
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield fen_to_snapshot(line)
+        except ValueError as error:
+            raise ValueError(f"Line {line_number}: {error}") from None
+
+
+def iter_snapshot_arrays(lines, chunk_size=1 << 16):
+    """
+    Stream the positions of FEN or EPD lines in chunks of SNAPSHOT_DTYPE records. The
+    placements of a chunk are converted into bitboards with a few numpy operations,
+    the EPD operations are dropped.
+
+    :return: generator of arrays of up to chunk_size records
+    """
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield snapshot_array(chunk)
+                chunk = []
+    if chunk:
+        yield snapshot_array(chunk)
+
+
+def snapshot_array(lines):
+    """Convert FEN or EPD lines into an array of SNAPSHOT_DTYPE records."""
+    records = np.zeros(len(lines), dtype=SNAPSHOT_DTYPE)
+    placements, columns = [], []
+    for line in lines:
+        placement, turn, castling, en_passant, halfmove, fullmove, _ = split_fen(line)
+        placements.append(expand_placement(placement))
+        columns.append(
+            (
+                parse_turn(turn),
+                parse_castling(castling),
+                -1 if en_passant == "-" else square_to_position(en_passant),
+                halfmove,
+                fullmove,
+            )
+        )
+    for name, column in zip(SNAPSHOT_DTYPE.names[1:], zip(*columns)):
+        records[name] = column
+
+    squares = np.frombuffer(
+        "".join(placements).encode("ascii", "replace"), dtype=np.uint8
+    )
+    squares = squares.reshape(len(lines), 64)
+    known = squares == ord(".")
+    for symbol, pair in FEN_SYMBOLS.items():
+        is_symbol = squares == ord(symbol)
+        known |= is_symbol
+        packed = np.packbits(is_symbol, axis=1, bitorder="little").view("<u8")
+        records["bitboards"][:, BITBOARD_INDEX[pair]] = packed[:, 0]
+    if not known.all():
+        line = int(np.flatnonzero(~known.all(axis=1))[0])
+        raise ValueError(f"Invalid FEN placement: {lines[line]}")
+    return records
+
+
+def record_to_snapshot(record):
+    """Convert a SNAPSHOT_DTYPE record into a Board.snapshot."""
+    en_passant = int(record["en_passant"])
+    return (
+        tuple(record["bitboards"].tolist()),
+        int(record["turn"]),
+        int(record["castling_rights"]),
+        None if en_passant < 0 else en_passant,
+        int(record["halfmove_clock"]),
+        int(record["fullmove_number"]),
+    )
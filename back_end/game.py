@@ -1,8 +1,32 @@
+from array import array
+
 from back_end.board import Board
-from back_end.moves import Moves
-from back_end.utils import load_chess_move_tables
+from back_end.cache import MoveCache
+from back_end.moves import MAX_MOVES, Moves
+from back_end.search import MATE_SCORE, Search
+from back_end.tablebase import best_tablebase_move
 import numpy as np
 
+from back_end.utils import (
+    load_chess_move_tables,
+    load_bitboard_tables,
+    load_attack_arrays,
+    gather_slider_attacks,
+    bitboard_to_array,
+    bitboard_to_positions,
+    load_between_bitboards,
+    move_to_uci,
+)
+from common.config import (
+    BITBOARD_MASK,
+    FILE_A,
+    FILE_H,
+    WHITE,
+    KING,
+    COLOR_INDEX,
+    MOVE_EN_PASSANT,
+)
+
 
 class ChessGame:
     def __init__(self, **kwargs):
@@ -11,68 +35,283 @@ class ChessGame:
         """
         self.player_color = kwargs.get("player_color", "white")
         self.board = Board(**kwargs)
+        # The tables are loaded on the first game of the process, then shared
         self.move_tables = load_chess_move_tables()
+        self.bitboard_tables = load_bitboard_tables()
+        self.attack_arrays = load_attack_arrays()
+        # Opt-in cache of move lists keyed by (Board.hash, position), so that making
+        # a move changes the key and the entries of the old position are not hit
+        move_cache_bytes = kwargs.get("move_cache_bytes")
+        self.move_cache = None
+        if move_cache_bytes is not None:
+            self.move_cache = MoveCache(move_cache_bytes)
+        # Move rows of each ply for the search and its move ordering, allocated by the
+        # first Search of the game so that games that never search do not pay for it
+        self.move_buffer = None
+        self.move_row = None  # See get_move_row
+        self.search = None  # Created on the first best_move, then kept for its tables
+        # Opt-in OpeningBook and endgame probe, e.g. a TablebaseProbe, consulted by
+        # best_move before it searches
+        self.opening_book = kwargs.get("opening_book")
+        self.endgame_probe = kwargs.get("endgame_probe")
+
+    def best_move(self, time_ms=None, **kwargs):
+        """
+        Search the best move of the side to move, see Search.best_move. A move of the
+        opening book or of the endgame probe is played without searching.
+
+        :return: (best packed move or None, info dict with the source of the move:
+            "book", "tablebase" or "search")
+        """
+        info = {"depth": 0, "score": 0, "nodes": 0, "time": 0.0, "iterations": []}
+        if self.opening_book is not None:
+            move = self.opening_book.choose_move(
+                self.board.hash, self.generate_legal_moves()
+            )
+            if move is not None:
+                return move, {**info, "pv": [move], "source": "book"}
+        if self.endgame_probe is not None:
+            probed = best_tablebase_move(self, self.endgame_probe)
+            if probed is not None:
+                move, (wdl, dtm) = probed
+                score = wdl * (MATE_SCORE - dtm) if wdl else 0
+                return move, {
+                    **info,
+                    "score": score,
+                    "pv": [move],
+                    "source": "tablebase",
+                }
+
+        if self.search is None:
+            self.search = Search(self)
+        move, info = self.search.best_move(time_ms=time_ms, **kwargs)
+        info["source"] = "search"
+        return move, info
 
     def get_valid_moves(self, position):
         """
         Get the valid moves for a position.
         """
         piece = self.board.get_piece(position)
-        moves = Moves(piece, self.board, self.move_tables)
-        valid_moves = moves.get_valid_moves()
+        if self.move_cache is None or piece is None:
+            moves = Moves(piece, self.board, self.bitboard_tables)
+            return moves.get_valid_moves()
+
+        key = (self.board.hash, position)
+        valid_moves = self.move_cache.get(key)
+        if valid_moves is None:
+            moves = Moves(piece, self.board, self.bitboard_tables)
+            valid_moves = moves.get_valid_bitboard()
+            self.move_cache.put(key, valid_moves)
+
+        return bitboard_to_array(valid_moves)
+
+    def generate_legal_moves(self):
+        """
+        Generate the legal moves of the side to move as a list of packed moves.
+        """
+        if self.move_cache is None:
+            return self._generate_legal_moves()
+
+        key = (self.board.hash, None)
+        legal_moves = self.move_cache.get(key)
+        if legal_moves is None:
+            legal_moves = self._generate_legal_moves()
+            self.move_cache.put(key, legal_moves)
+
+        return list(legal_moves)
+
+    def generate_legal_captures(self):
+        """
+        Generate the legal captures and promotions of the side to move as a list of
+        packed moves, for the quiescence search.
+        """
+        return self._generate_legal_moves(captures_only=True)
+
+    def _generate_legal_moves(self, captures_only=False):
+        moves = array("H", bytes(2 * MAX_MOVES))
+        return moves[: self.generate_moves_into(moves, captures_only)].tolist()
+
+    def get_move_row(self):
+        """
+        Get the row of moves of the game outside of a search, e.g. for PGN replay,
+        allocated on first use and then reused.
+
+        :return: memoryview of MAX_MOVES uint16, see generate_moves_into
+        """
+        if self.move_row is None:
+            self.move_row = memoryview(array("H", bytes(2 * MAX_MOVES)))
+        return self.move_row
+
+    def generate_moves_into(self, out, captures_only=False):
+        """
+        Write the legal moves of the side to move into a buffer, without building any
+        list, see MoveBuffer.
+
+        :param out: writable uint16 buffer of MAX_MOVES, e.g. a row of MoveBuffer.rows
+        :param captures_only: only the captures and promotions, for the quiescence search
+        :return: the number of moves written
+        """
+        board = self.board
+        color = board.turn
+        king = board.bitboards[color * 6 + KING]
+        checkers, pins = board.get_check_masks()
+        positions = board.occupancy[color]
+        if checkers & (checkers - 1):
+            # Only the king can get out of a double check
+            positions = king
+        count = 0
+        while positions:
+            lowest_bit = positions & -positions
+            piece = board.get_piece(lowest_bit.bit_length() - 1)
+            moves = Moves(piece, board, self.bitboard_tables)
+            count = moves.write_moves(out, count, captures_only)
+            positions ^= lowest_bit
+        if not king or not (checkers or pins or board.en_passant is not None):
+            return count
 
-        return valid_moves
+        # King moves are already filtered by King; the other moves must capture or
+        # block the checker, and pinned pieces must stay on the line of their pin.
+        # The legal moves are moved to the front of the buffer in place
+        king_position = king.bit_length() - 1
+        targets = BITBOARD_MASK
+        if checkers:
+            between = load_between_bitboards()[king_position]
+            targets = checkers | between[checkers.bit_length() - 1]
+        legal_count = 0
+        for i in range(count):
+            move = out[i]
+            from_position = move & 63
+            if from_position == king_position:
+                is_legal = True
+            elif move >> 14 == MOVE_EN_PASSANT:
+                # Both pawns leave the rank, which may expose the king, play it out
+                board.make_move(move)
+                is_legal = not self.is_in_check(color)
+                board.unmake_move()
+            else:
+                is_legal = targets >> (move >> 6 & 63) & 1 and (
+                    from_position not in pins
+                    or pins[from_position] >> (move >> 6 & 63) & 1
+                )
+            if is_legal:
+                out[legal_count] = move
+                legal_count += 1
+
+        return legal_count
+
+    def perft(self, depth):
+        """
+        Count the leaf nodes of the legal move tree, e.g. 20 at depth 1 from the start.
+        """
+        if depth == 0:
+            return 1
+        moves = self.generate_legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.board.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.board.unmake_move()
+        return nodes
+
+    def divide(self, depth):
+        """
+        Count the perft nodes below each legal move, keyed by its UCI notation.
+        """
+        nodes = {}
+        for move in self.generate_legal_moves():
+            self.board.make_move(move)
+            nodes[move_to_uci(move)] = self.perft(depth - 1)
+            self.board.unmake_move()
+        return nodes
+
+    def is_in_check(self, color=None):
+        """
+        Check whether the king of a color (the side to move by default) is attacked.
+        """
+        color = self.board.turn if color is None else COLOR_INDEX[color]
+        king = self.board.bitboards[color * 6 + KING]
+        return self.board.get_attack_maps()[color ^ 1] & king != 0
 
     def get_attacked_squares(self, color):
         """
         Get all squares attacked by a color.
         """
-        opposite_color = "black" if color == "white" else "white"
-        piece_types = ["knight", "bishop", "rook", "queen", "king"]
-        attacked_squares = np.zeros(64, dtype=bool)
-        attacked_squares |= self.get_attacked_pawn_squares(color)
-        piece_positions = set(self.board.all_pieces[color].nonzero()[0])
-        piece_positions = piece_positions - set(self.board.pawns[color])
-        for position in piece_positions:
-            piece = self.board.get_piece(position)
-            moves = Moves(piece, self.board, self.move_tables)
-            valid_moves = moves.get_valid_moves()
-            attacked_squares = attacked_squares | valid_moves
+        attacked_squares, attacked_pieces = self.get_attacked_bitboards(color)
+
+        return bitboard_to_array(attacked_squares), bitboard_to_array(attacked_pieces)
+
+    def get_attacked_bitboards(self, color):
+        """
+        Get the bitboards of the squares and the pieces attacked by a color.
+        """
+        color = COLOR_INDEX[color]
+        attacked_squares = self.board.get_attack_maps()[color]
+        attacked_squares &= ~self.board.occupancy[color]
 
-        attacked_pieces = self.board.all_pieces[opposite_color] & attacked_squares
+        attacked_pieces = self.board.occupancy[color ^ 1] & attacked_squares
 
         return attacked_squares, attacked_pieces
 
+    def get_attack_maps(self, color):
+        """
+        Get the attack maps of all the knights, bishops, rooks, queens and kings of a color.
+
+        All the pieces are looked up in one gather per table, squares defended by the
+        color itself are included.
+
+        :return: (positions, uint64 attack bitboard per position, combined attack bitboard)
+        """
+        groups = [
+            bitboard_to_positions(self.board.get_bitboard(color, piece_type))
+            for piece_type in ["knight", "king", "rook", "bishop", "queen"]
+        ]
+        knights, kings, rooks, bishops, _ = groups
+        positions = np.array(sum(groups, []), dtype=np.intp)
+        attacks = np.zeros(len(positions), dtype=np.uint64)
+        if len(positions) == 0:
+            return positions, attacks, 0
+
+        occupied = self.board.occupied
+        leapers = len(knights) + len(kings)
+        first_bishop = leapers + len(rooks)
+        first_queen = first_bishop + len(bishops)
+        attacks[: len(knights)] = self.attack_arrays["knight"][
+            positions[: len(knights)]
+        ]
+        attacks[len(knights) : leapers] = self.attack_arrays["king"][
+            positions[len(knights) : leapers]
+        ]
+        orthogonal = np.r_[leapers:first_bishop, first_queen : len(positions)]
+        attacks[orthogonal] = gather_slider_attacks(
+            self.attack_arrays["rook"], positions[orthogonal], occupied
+        )
+        diagonal = np.arange(first_bishop, len(positions))
+        attacks[diagonal] |= gather_slider_attacks(
+            self.attack_arrays["bishop"], positions[diagonal], occupied
+        )
+
+        return positions, attacks, int(np.bitwise_or.reduce(attacks))
+
     def get_attacked_pawn_squares(self, color="black"):
         """
         Get all squares attacked by the pawns of a color.
         """
-        bool_mask = np.zeros(64, dtype=bool)
-        pawns = self.board.pawns[color]
-
-        if len(pawns) == 0:
-            return bool_mask
-
-        if color == "white":
-            pawns_attack_left = pawns + 7
-            pawns_attack_left = pawns_attack_left[
-                (pawns_attack_left % 8 != 7) & (pawns_attack_left < 64)
-            ]
-            pawns_attack_right = pawns + 9
-            pawns_attack_right = pawns_attack_right[
-                (pawns_attack_right % 8 != 0) & (pawns_attack_right < 64)
-            ]
+        return bitboard_to_array(self.get_attacked_pawn_bitboard(color))
+
+    def get_attacked_pawn_bitboard(self, color="black"):
+        """
+        Get the bitboard of the squares attacked by the pawns of a color.
+        """
+        pawns = self.board.get_bitboard(color, "pawn")
+
+        if COLOR_INDEX[color] == WHITE:
+            pawns_attack_left = (pawns & ~FILE_A) << 7
+            pawns_attack_right = (pawns & ~FILE_H) << 9
         else:
-            pawns_attack_right = pawns - 9
-            pawns_attack_right = pawns_attack_right[
-                (pawns_attack_right % 8 != 7) & (pawns_attack_right >= 0)
-            ]
-            pawns_attack_left = pawns - 7
-            pawns_attack_left = pawns_attack_left[
-                (pawns_attack_left % 8 != 0) & (pawns_attack_left >= 0)
-            ]
-
-        bool_mask[pawns_attack_left] = True
-        bool_mask[pawns_attack_right] = True
-
-        return bool_mask
+            pawns_attack_right = (pawns & ~FILE_A) >> 9
+            pawns_attack_left = (pawns & ~FILE_H) >> 7
+
+        return (pawns_attack_left | pawns_attack_right) & BITBOARD_MASK
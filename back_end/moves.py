@@ -1,12 +1,193 @@
+import logging
+from array import array
+
 import numpy as np
 
 from back_end.utils import (
-    binary_array_to_int,
-    int_to_binary_array,
-    reverse_binary_array_int,
-    compute_line_attacks,
+    bitboard_to_array,
+    bitboard_to_positions,
+    lookup_slider_attacks,
+)
+from common.config import (
+    COLORS,
+    PIECE_TYPES,
+    WHITE,
+    PAWN,
+    KNIGHT,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+    COLOR_INDEX,
+    CASTLING_RIGHTS,
+    MOVE_PROMOTION,
+    MOVE_EN_PASSANT,
+    MOVE_CASTLING,
+    PIECE_CODE_COSTS,
+    PROMOTION_TYPES,
 )
 
+logger = logging.getLogger(__name__)
+
+# Keys of the pawn tables of each color
+PAWN_MOVES = COLORS
+PAWN_ATTACKS = [f"{color}_attack" for color in COLORS]
+# Most legal moves of a position (218 are known) and of a piece (a queen, or a pawn
+# with 3 targets of 4 promotions each)
+MAX_MOVES = 256
+MAX_PIECE_MOVES = 32
+
+
+class MoveBuffer:
+    def __init__(self, plies, size=MAX_MOVES):
+        """
+        Preallocated rows of packed moves, one per ply of a search, that the move
+        generators write into instead of building lists, see Moves.write_moves.
+
+        The moves are uint16: the flags of encode_move reach 3 << 14, beyond int16.
+        rows and score_rows are memoryviews of the numpy arrays, their items read and
+        write as Python ints without creating numpy scalars.
+
+        :param plies: number of rows
+        :param size: moves per row
+        """
+        self.moves = np.zeros((plies, size), dtype=np.uint16)
+        self.scores = np.zeros((plies, size), dtype=np.int64)  # Ordering keys
+        self.rows = [memoryview(row) for row in self.moves]
+        self.score_rows = [memoryview(row) for row in self.scores]
+
+    def load(self, ply, moves):
+        """Copy a list of packed moves into the row of a ply, return their count."""
+        self.moves[ply, : len(moves)] = moves
+        return len(moves)
+
+    def sort(self, ply, count):
+        """Sort the first moves of a row and their scores by decreasing score, stably."""
+        order = np.argsort(-self.scores[ply, :count], kind="stable")
+        self.moves[ply, :count] = self.moves[ply, :count][order]
+        self.scores[ply, :count] = self.scores[ply, :count][order]
+
+
+def get_attackers(board, position, color, move_data, occupied=None):
+    """
+    Get the bitboard of the pieces of a color that attack a position.
+
+    :param occupied: occupied squares the sliders are blocked by, defaults to the board's
+    """
+    if occupied is None:
+        occupied = board.occupied
+    color = COLOR_INDEX[color]
+    bitboards = board.bitboards[color * 6 : color * 6 + 6]
+    rook, bishop = move_data["queen"]
+    queens = bitboards[QUEEN]
+    # A pawn of the color attacks the position iff an opposite pawn there attacks it
+    attackers = (
+        move_data["pawn"][PAWN_ATTACKS[color ^ 1]][position] & bitboards[PAWN]
+        | move_data["knight"][position] & bitboards[KNIGHT]
+        | move_data["king"][position] & bitboards[KING]
+    )
+    orthogonal = bitboards[ROOK] | queens
+    if orthogonal:
+        attackers |= lookup_slider_attacks(rook, position, occupied) & orthogonal
+    diagonal = bitboards[BISHOP] | queens
+    if diagonal:
+        attackers |= lookup_slider_attacks(bishop, position, occupied) & diagonal
+    return attackers
+
+
+def get_piece_attacks(move_data, code, position, occupied):
+    """
+    Get the bitboard of the squares attacked by the piece of a code on a position,
+    squares of its own pieces included.
+
+    :param code: piece code, see Board.board
+    :param occupied: occupied squares the sliders are blocked by
+    """
+    color, piece_type = divmod(code - 1, len(PIECE_TYPES))
+    if piece_type == PAWN:
+        return move_data["pawn"][PAWN_ATTACKS[color]][position]
+    if piece_type == KNIGHT or piece_type == KING:
+        return move_data[PIECE_TYPES[piece_type]][position]
+    attacks = 0
+    for magic_table in move_data[PIECE_TYPES[piece_type]]:
+        attacks |= lookup_slider_attacks(magic_table, position, occupied)
+    return attacks
+
+
+def static_exchange_evaluation(board, move, move_data):
+    """
+    Get the material won by a capture once the captures on its square are resolved,
+    each side recapturing with its least valuable attacker or standing pat. Sliders
+    behind the pieces that capture join in as x-rays. Pins are ignored.
+
+    :param move: packed move, see encode_move
+    :return: gain of the side to move in PIECE_CODE_COSTS, e.g. -2 for a rook taking a
+        pawn defended by a pawn
+    """
+    mailbox = board.mailbox
+    from_position, to_position = move & 63, move >> 6 & 63
+    flag = move >> 14
+    code = mailbox[from_position]
+    gains = [PIECE_CODE_COSTS[mailbox[to_position]]]
+    occupied = board.occupied & ~(1 << from_position)
+    if flag == MOVE_EN_PASSANT:
+        gains[0] = PIECE_CODE_COSTS[PAWN + 1]
+        occupied &= ~(1 << (to_position ^ 8))
+    elif flag == MOVE_PROMOTION:
+        # The pawn arrives as the promotion piece
+        code += PROMOTION_TYPES[move >> 12 & 3] - PAWN
+        gains[0] += PIECE_CODE_COSTS[code] - PIECE_CODE_COSTS[PAWN + 1]
+
+    bitboards = board.bitboards
+    rook, bishop = move_data["queen"]
+    diagonal = orthogonal = 0
+    for offset in [0, len(PIECE_TYPES)]:
+        diagonal |= bitboards[offset + BISHOP] | bitboards[offset + QUEEN]
+        orthogonal |= bitboards[offset + ROOK] | bitboards[offset + QUEEN]
+    attackers = (
+        get_attackers(board, to_position, 0, move_data, occupied)
+        | get_attackers(board, to_position, 1, move_data, occupied)
+    ) & occupied
+
+    color = (code - 1) // len(PIECE_TYPES) ^ 1
+    while True:
+        # The least valuable attacker of the side to recapture
+        own_attackers = attackers & board.occupancy[color]
+        if not own_attackers:
+            break
+        for piece_type in range(len(PIECE_TYPES)):
+            candidates = (
+                own_attackers & bitboards[color * len(PIECE_TYPES) + piece_type]
+            )
+            if candidates:
+                break
+        if piece_type == KING and attackers & board.occupancy[color ^ 1]:
+            break  # The king may not recapture into an attack
+        # The recapture wins the piece standing on the square
+        gains.append(PIECE_CODE_COSTS[code] - gains[-1])
+        code = color * len(PIECE_TYPES) + piece_type + 1
+        if piece_type == PAWN and (to_position < 8 or to_position >= 56):
+            gains[-1] += PIECE_CODE_COSTS[code + QUEEN] - PIECE_CODE_COSTS[code]
+            code += QUEEN
+        from_position = (candidates & -candidates).bit_length() - 1
+        occupied &= ~(1 << from_position)
+        attackers &= occupied
+        # Only the sliders behind a piece on a line to the square get uncovered
+        if piece_type in (PAWN, BISHOP, QUEEN, KING):
+            attackers |= lookup_slider_attacks(bishop, to_position, occupied) & (
+                diagonal & occupied
+            )
+        if piece_type in (ROOK, QUEEN, KING):
+            attackers |= lookup_slider_attacks(rook, to_position, occupied) & (
+                orthogonal & occupied
+            )
+        color ^= 1
+
+    # Each side stands pat rather than make a losing recapture
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
 
 class MovesMeta(type):
     def __call__(cls, piece, board, move_data):
@@ -14,7 +195,7 @@ class MovesMeta(type):
         if piece is None:
             piece_type = "default"
         else:
-            piece_type = piece.piece_type.lower()
+            piece_type = PIECE_TYPES[piece.piece_type]
         piece_type = {"queen": "slider", "rook": "slider", "bishop": "slider"}.get(
             piece_type, piece_type
         )
@@ -22,7 +203,7 @@ class MovesMeta(type):
         if subclass:
             return super(MovesMeta, subclass).__call__(piece, board, move_data)
         else:
-            raise ValueError(f"No movement logic defined for {piece.name}")
+            raise ValueError(f"No movement logic defined for {piece}")
 
 
 class Moves(metaclass=MovesMeta):
@@ -37,91 +218,246 @@ class Moves(metaclass=MovesMeta):
         self.board = board
         self.move_data = move_data
         self.color = piece.color
-        self.opposite_color = "black" if piece.color == "white" else "white"
+        self.opposite_color = piece.color ^ 1
         self.position = piece.position
-        self.opposite_color_pieces = board.all_pieces[self.opposite_color]
-        self.occupied = self.board.all_pieces["white"] | self.board.all_pieces["black"]
-        self.occupied[self.position] = False
-        self.position_array = np.zeros(64, dtype=bool)
-        self.position_array[self.position] = True
-        self.valid_moves = np.zeros(64, dtype=bool)
-        self.moves = self.move_data[piece.piece_type]
+        self.own_pieces = board.occupancy[self.color]
+        self.opposite_color_pieces = board.occupancy[self.opposite_color]
+        self.occupied = self.own_pieces | self.opposite_color_pieces
+        self.valid_moves = 0
+        self.moves = self.move_data[PIECE_TYPES[piece.piece_type]]
 
     def get_valid_moves(self):
+        """Get the valid moves as a 64-element boolean mask."""
+        return bitboard_to_array(self.get_valid_bitboard())
+
+    def get_valid_bitboard(self):
         raise NotImplementedError("Should be implemented in subclasses")
 
+    def get_move_list(self):
+        """Get the valid moves as a list of packed moves, see encode_move."""
+        moves = array("H", bytes(2 * MAX_PIECE_MOVES))
+        return moves[: self.write_moves(moves, 0)].tolist()
+
+    def get_capture_bitboard(self):
+        """Get the valid captures as a bitboard, for the quiescence search."""
+        return self.get_valid_bitboard() & self.opposite_color_pieces
+
+    def get_capture_list(self):
+        """Get the valid captures and promotions as a list of packed moves."""
+        moves = array("H", bytes(2 * MAX_PIECE_MOVES))
+        return moves[: self.write_moves(moves, 0, captures_only=True)].tolist()
+
+    def write_moves(self, out, count, captures_only=False):
+        """
+        Write the valid moves as packed moves into a buffer, see MoveBuffer.
+
+        :param out: writable uint16 buffer, e.g. a row of MoveBuffer.rows
+        :param count: index of the first move to write
+        :param captures_only: only the captures and promotions
+        :return: count plus the number of moves written
+        """
+        if captures_only:
+            bitboard = self.get_capture_bitboard()
+        else:
+            bitboard = self.get_valid_bitboard()
+        position = self.position
+        while bitboard:
+            lowest_bit = bitboard & -bitboard
+            out[count] = position | (lowest_bit.bit_length() - 1) << 6
+            count += 1
+            bitboard ^= lowest_bit
+        return count
+
 
 class Default(Moves):
+    def __init__(self, piece, board, move_data):
+        self.piece = piece
+        self.board = board
+        self.move_data = move_data
+        self.valid_moves = 0
+
     def get_valid_moves(self):
         return []
 
+    def get_valid_bitboard(self):
+        return self.valid_moves
+
+    def get_move_list(self):
+        return []
+
+    def get_capture_bitboard(self):
+        return 0
+
+    def get_capture_list(self):
+        return []
+
+    def write_moves(self, out, count, captures_only=False):
+        return count
+
 
 class Slider(Moves):
     def get_valid_moves(self):
         """Logic for queen movement."""
 
-        directions = self.moves[:, self.position]
-        for direction in directions:
-            o = self.occupied[direction]
-            if not any(o):
-                self.valid_moves[direction] = True
-                continue
+        valid_moves = super().get_valid_moves()
 
-            s = self.position_array[direction]
-            o = self.occupied[direction]
+        # Rendering the boards is slow, only do it when the debug output is wanted
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s\n%s", self.board.format_bool(valid_moves), self.board)
 
-            line_attacks = compute_line_attacks(o=o, s=s)
+        return valid_moves
 
-            self.valid_moves[direction] = line_attacks
+    def get_valid_bitboard(self):
+        """Look up the attacks of each direction pair in its magic table."""
 
-        self.valid_moves = self.valid_moves & ~self.board.all_pieces[self.color]
+        for magic_table in self.moves:
+            self.valid_moves |= lookup_slider_attacks(
+                magic_table, self.position, self.occupied
+            )
 
-        self.board.print_bool(self.valid_moves)
-        print(self.board)
+        self.valid_moves &= ~self.own_pieces
 
         return self.valid_moves
 
+    def get_capture_bitboard(self):
+        attacks = 0
+        for magic_table in self.moves:
+            attacks |= lookup_slider_attacks(magic_table, self.position, self.occupied)
+        return attacks & self.opposite_color_pieces
+
 
 class Knight(Moves):
-    def get_valid_moves(self):
+    def get_valid_bitboard(self):
         """Logic for knight movement."""
 
-        moves = self.moves[:, self.position]
-        self.valid_moves = moves & ~self.board.all_pieces[self.color]
+        moves = self.moves[self.position]
+        self.valid_moves = moves & ~self.own_pieces
 
         return self.valid_moves
 
+    def get_capture_bitboard(self):
+        return self.moves[self.position] & self.opposite_color_pieces
+
 
 class King(Moves):
-    def get_valid_moves(self):
-        """Logic for king movement."""
+    def get_valid_bitboard(self):
+        """Logic for king movement, the king may not move to a square attacked by the opposite color."""
+
+        moves = self.moves[self.position]
+        moves &= ~self.own_pieces
+
+        attacked = self.board.get_attack_maps()[self.opposite_color]
+        if attacked >> self.position & 1:
+            # The king does not block the attacks along the lines it moves away on
+            occupied = self.occupied & ~(1 << self.position)
+            attackers = get_attackers(
+                self.board, self.position, self.opposite_color, self.move_data
+            )
+            for attacker in bitboard_to_positions(attackers):
+                attacked |= get_piece_attacks(
+                    self.move_data, self.board.mailbox[attacker], attacker, occupied
+                )
+
+        self.valid_moves = moves & ~attacked | self.get_castling_bitboard(attacked)
 
-        moves = self.moves[:, self.position]
-        self.valid_moves = moves & ~self.board.all_pieces[self.color]
+        return self.valid_moves
 
-        # TODO: Logic for filtering out attacked squares
-        # TODO: Logic for castling
+    def get_castling_bitboard(self, attacked=None):
+        """
+        Logic for castling, the king may not leave, cross or land on an attacked square.
 
-        return self.valid_moves
+        :param attacked: squares attacked by the opposite color, see Board.get_attack_maps
+        """
+
+        if attacked is None:
+            attacked = self.board.get_attack_maps()[self.opposite_color]
+        castling = 0
+        castling_rights = self.board.castling_rights
+        for bit, (color, king_position, rook_position) in enumerate(CASTLING_RIGHTS):
+            if color != self.color or not castling_rights >> bit & 1:
+                continue
+            step = 1 if rook_position > king_position else -1
+            between = range(king_position + step, rook_position, step)
+            if any(self.occupied >> position & 1 for position in between):
+                continue
+            king_path = 7 << min(king_position, king_position + 2 * step)
+            if attacked & king_path:
+                continue
+            castling |= 1 << (king_position + 2 * step)
+
+        return castling
+
+    def write_moves(self, out, count, captures_only=False):
+        """Write the valid moves as packed moves, flagging the castling moves."""
+        if captures_only:
+            return super().write_moves(out, count, captures_only)
+        bitboard = self.get_valid_bitboard()
+        position = self.position
+        while bitboard:
+            lowest_bit = bitboard & -bitboard
+            to_position = lowest_bit.bit_length() - 1
+            move = position | to_position << 6
+            if abs(to_position - position) == 2:
+                move |= MOVE_CASTLING << 14
+            out[count] = move
+            count += 1
+            bitboard ^= lowest_bit
+        return count
 
 
 class Pawn(Moves):
-    def get_valid_moves(self):
+    def get_valid_bitboard(self):
         """Logic for pawn movement."""
         # Select the correct move and attack patterns based on color
-        if self.color == "white":
-            moves = self.moves["white"][self.position]
-            attacks = self.moves["white_attack"][self.position]
-        elif self.color == "black":
-            moves = self.moves["black"][self.position]
-            attacks = self.moves["black_attack"][self.position]
-
-        attacks = attacks & self.opposite_color_pieces
-        moves = (
-            moves & ~self.board.all_pieces["white"] & ~self.board.all_pieces["black"]
-        )
-        valid_moves = moves | attacks
+        moves = self.moves[PAWN_MOVES[self.color]][self.position]
+        attacks = self.moves[PAWN_ATTACKS[self.color]][self.position]
+
+        targets = self.opposite_color_pieces
+        if self.board.en_passant is not None and self.board.turn == self.color:
+            targets |= 1 << self.board.en_passant
+        attacks = attacks & targets
+        moves = moves & ~self.occupied
+        step = 8 if self.color == WHITE else -8
+        if moves and not (moves >> (self.position + step)) & 1:
+            # The double step is blocked by the piece in front of the pawn
+            moves = 0
+        self.valid_moves = moves | attacks
 
-        # TODO: Logic for en passant
+        return self.valid_moves
 
-        return valid_moves
+    def get_capture_bitboard(self):
+        """Captures, en passant included, and pushes to the last rank."""
+        attacks = self.moves[PAWN_ATTACKS[self.color]][self.position]
+        targets = self.opposite_color_pieces
+        if self.board.en_passant is not None and self.board.turn == self.color:
+            targets |= 1 << self.board.en_passant
+        captures = attacks & targets
+        if self.position >> 3 == (6 if self.color == WHITE else 1):
+            push = self.position + (8 if self.color == WHITE else -8)
+            captures |= 1 << push & ~self.occupied
+        return captures
+
+    def write_moves(self, out, count, captures_only=False):
+        """Write the valid moves as packed moves, with one move per promotion piece."""
+        if captures_only:
+            bitboard = self.get_capture_bitboard()
+        else:
+            bitboard = self.get_valid_bitboard()
+        position = self.position
+        en_passant = self.board.en_passant
+        while bitboard:
+            lowest_bit = bitboard & -bitboard
+            to_position = lowest_bit.bit_length() - 1
+            move = position | to_position << 6
+            if to_position < 8 or to_position >= 56:
+                # Promote to a queen first, it is almost always the best choice
+                for promotion in [3, 0, 2, 1]:
+                    out[count] = move | promotion << 12 | MOVE_PROMOTION << 14
+                    count += 1
+            else:
+                if to_position == en_passant and (to_position - position) % 8:
+                    move |= MOVE_EN_PASSANT << 14
+                out[count] = move
+                count += 1
+            bitboard ^= lowest_bit
+        return count
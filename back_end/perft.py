@@ -0,0 +1,52 @@
+from back_end.game import ChessGame
+
+# Reference positions with their known perft node counts per depth
+REFERENCE_POSITIONS = {
+    "startpos": (
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609},
+    ),
+    "kiwipete": (
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603},
+    ),
+    "endgame": (
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624},
+    ),
+    "promotions": (
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        {1: 6, 2: 264, 3: 9467, 4: 422333},
+    ),
+    "discovered_checks": (
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487},
+    ),
+    "middlegame": (
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594},
+    ),
+}
+
+# Depths that take a few seconds each, used by default by the benchmark
+DEFAULT_DEPTHS = {
+    "startpos": 4,
+    "kiwipete": 3,
+    "endgame": 4,
+    "promotions": 3,
+    "discovered_checks": 3,
+    "middlegame": 3,
+}
+
+
+def run_reference_perft(name, depth=None, divide=False):
+    """
+    Run perft on a reference position.
+
+    :return: (nodes or divide dict, expected nodes or None if unknown at that depth)
+    """
+    fen, expected = REFERENCE_POSITIONS[name]
+    depth = DEFAULT_DEPTHS[name] if depth is None else depth
+    game = ChessGame(fen=fen)
+    nodes = game.divide(depth) if divide else game.perft(depth)
+    return nodes, expected.get(depth)
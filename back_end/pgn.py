@@ -0,0 +1,284 @@
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from back_end.fen import STARTING_FEN
+from common.config import MOVE_CASTLING, MOVE_PROMOTION, PROMOTION_TYPES
+from back_end.utils import square_to_position
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+# Piece letter, disambiguation file and rank, destination and promotion, e.g. Nbxd7
+SAN_PATTERN = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?")
+SAN_PIECE_TYPES = "PNBRQK"  # Letter of each piece type, indexed like PIECE_TYPES
+COMMENT_PATTERN = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION_PATTERN = re.compile(r"\([^()]*\)")
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def iter_games(lines):
+    """
+    Stream the games of PGN lines, e.g. an open file, one game in memory at a time.
+
+    :return: generator of (headers dict, list of SAN moves)
+    """
+    headers, movetext, in_tags = {}, [], False
+    for line in lines:
+        line = line.strip()
+        is_tag = line.startswith("[")
+        if is_tag:
+            # A tag line after a line that is not a tag starts the next game
+            if not in_tags and (headers or movetext):
+                yield headers, parse_movetext(" ".join(movetext))
+                headers, movetext = {}, []
+            match = TAG_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+        in_tags = is_tag
+    if headers or movetext:
+        yield headers, parse_movetext(" ".join(movetext))
+
+
+def parse_movetext(movetext):
+    """
+    Extract the SAN moves of the main line, dropping the move numbers, comments,
+    variations, annotations and the result, e.g. "1. e4 {best} e5 (1... c5) 2. Nf3 1-0"
+    -> ["e4", "e5", "Nf3"].
+    """
+    movetext = COMMENT_PATTERN.sub(" ", movetext)
+    while "(" in movetext:
+        movetext, count = VARIATION_PATTERN.subn(" ", movetext)
+        if not count:
+            raise ValueError(f"Unbalanced variation in: {movetext}")
+    moves = []
+    for token in movetext.split():
+        token = MOVE_NUMBER_PATTERN.sub("", token)
+        if token and token not in RESULTS and not token.startswith("$"):
+            moves.append(token)
+    return moves
+
+
+def parse_san(game, san):
+    """
+    Find the legal move of the side to move written in SAN, e.g. "Nf3", "exd6",
+    "O-O-O" or "e8=Q+".
+
+    :return: packed move, see encode_move
+    """
+    stripped = san.rstrip("+#!?")
+    row = game.get_move_row()
+    moves = row[: game.generate_moves_into(row)]
+    if stripped in ["O-O", "0-0", "O-O-O", "0-0-0"]:
+        queenside = len(stripped) == 5
+        for move in moves:
+            if (
+                move >> 14 == MOVE_CASTLING
+                and (move >> 6 & 63 < move & 63) == queenside
+            ):
+                return move
+        raise ValueError(f"Illegal move {san} in {game.board.to_fen()}")
+
+    match = SAN_PATTERN.fullmatch(stripped)
+    if match is None:
+        raise ValueError(f"Invalid SAN move {san}")
+    piece, file, rank, to_square, promotion = match.groups()
+    piece_type = SAN_PIECE_TYPES.index(piece or "P")
+    to_position = square_to_position(to_square)
+    promotion = None if promotion is None else SAN_PIECE_TYPES.index(promotion)
+    mailbox = game.board.mailbox
+
+    candidates = []
+    for move in moves:
+        from_position = move & 63
+        if (
+            move >> 6 & 63 == to_position
+            and (mailbox[from_position] - 1) % 6 == piece_type
+            and (file is None or from_position % 8 == ord(file) - 97)
+            and (rank is None or from_position // 8 == int(rank) - 1)
+            and (
+                PROMOTION_TYPES[move >> 12 & 3] == promotion
+                if move >> 14 == MOVE_PROMOTION
+                else promotion is None
+            )
+        ):
+            candidates.append(move)
+    if len(candidates) != 1:
+        problem = "Ambiguous" if candidates else "Illegal"
+        raise ValueError(f"{problem} move {san} in {game.board.to_fen()}")
+    return candidates[0]
+
+
+def replay_game(game, headers, sans):
+    """
+    Replay a game on the board of a ChessGame, in place.
+
+    The board is set up from the FEN tag, or the starting position, and is left at the
+    position after each move when the generator resumes, e.g. to read Board.hash.
+
+    :return: generator of (ply, packed move), starting with (0, None) for the start
+    """
+    game.board.set_fen(headers.get("FEN", STARTING_FEN))
+    yield 0, None
+    for ply, san in enumerate(sans, 1):
+        move = parse_san(game, san)
+        game.board.make_move(move)
+        yield ply, move
+
+
+def iter_positions(lines, game=None, skip_invalid=False):
+    """
+    Stream the positions of the games of PGN lines, replayed on one reused board.
+
+    The yielded board is the board of the game, updated in place: copy what must
+    outlive the next iteration, e.g. Board.hash, Board.snapshot() or Board.to_fen().
+
+    :param game: ChessGame to replay the games on, a new one by default
+    :param skip_invalid: skip the rest of a game at an illegal move instead of raising
+    :return: generator of (game number from 0, ply, board)
+    """
+    if game is None:
+        from back_end.game import ChessGame
+
+        game = ChessGame()
+    for game_number, (headers, sans) in enumerate(iter_games(lines)):
+        try:
+            for ply, _ in replay_game(game, headers, sans):
+                yield game_number, ply, game.board
+        except ValueError as error:
+            if not skip_invalid:
+                raise ValueError(f"Game {game_number}: {error}") from None
+
+
+def iter_position_keys(lines, game=None, skip_invalid=False):
+    """
+    Stream the Zobrist keys of the positions of the games of PGN lines.
+
+    :return: generator of (game number from 0, ply, Board.hash)
+    """
+    for game_number, ply, board in iter_positions(lines, game, skip_invalid):
+        yield game_number, ply, board.hash
+
+
+def iter_game_offsets(path):
+    """
+    Scan a PGN file for the byte offset of each game: its first tag line, the first
+    line starting with "[" after a line that is not a tag.
+    """
+    with open(path, "rb") as file:
+        offset, in_tags = 0, False
+        for line in file:
+            is_tag = line.lstrip().startswith(b"[")
+            if is_tag and not in_tags:
+                yield offset
+            in_tags = is_tag
+            offset += len(line)
+
+
+def iter_shards(path, games_per_shard):
+    """Group the games of a PGN file into (start, end) byte ranges, end None for EOF."""
+    offsets = iter_game_offsets(path)
+    start = next(offsets, None)
+    if start is None:
+        return
+    for count, offset in enumerate(offsets, 1):
+        if count % games_per_shard == 0:
+            yield start, offset
+            start = offset
+    yield start, None
+
+
+def read_shard(path, start, end):
+    """
+    Read the lines of a byte range of a PGN file, see iter_shards.
+
+    :return: generator of (byte offset, line)
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for line in file:
+            if end is not None and offset >= end:
+                break
+            yield offset, line.decode("utf-8", errors="replace")
+            offset += len(line)
+
+
+def index_shard(path, start, end, game=None, skip_invalid=False):
+    """
+    Replay the games of a byte range of a PGN file.
+
+    :return: (game offsets, plies, keys) arrays with one row per position, the games
+        are identified by the byte offset of their first tag line
+    """
+    game_offsets = []
+
+    def lines():
+        in_tags = False
+        for offset, line in read_shard(path, start, end):
+            is_tag = line.lstrip().startswith("[")
+            if is_tag and not in_tags:
+                game_offsets.append(offset)
+            in_tags = is_tag
+            yield line
+
+    # iter_games has read the first tag line of a game by the time it yields it
+    rows = [
+        (game_offsets[game_number], ply, key)
+        for game_number, ply, key in iter_position_keys(lines(), game, skip_invalid)
+    ]
+    offsets, plies, keys = zip(*rows) if rows else ([], [], [])
+    return (
+        np.array(offsets, dtype=np.uint64),
+        np.array(plies, dtype=np.uint16),
+        np.array(keys, dtype=np.uint64),
+    )
+
+
+def index_pgn(path, processes=1, games_per_shard=256, skip_invalid=False):
+    """
+    Replay all the games of a PGN file and stream the keys of their positions.
+
+    The file is split into shards of games_per_shard games at the game offsets, and the
+    shards are replayed by a pool of processes. Only a few shards per process are in
+    flight at a time, so the memory stays flat whatever the size of the file.
+
+    :return: generator of the (game offsets, plies, keys) of each shard, in file order,
+        see index_shard
+    """
+    shards = iter_shards(path, games_per_shard)
+    if processes <= 1:
+        from back_end.game import ChessGame
+
+        game = ChessGame()
+        for start, end in shards:
+            yield index_shard(path, start, end, game, skip_invalid)
+        return
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker) as executor:
+        pending = deque()
+        for start, end in shards:
+            pending.append(
+                executor.submit(_index_shard, path, start, end, skip_invalid)
+            )
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+_worker_game = None  # ChessGame of a worker process, reused across its shards
+
+
+def _init_worker():
+    global _worker_game
+    from back_end.game import ChessGame
+
+    _worker_game = ChessGame()
+
+
+def _index_shard(path, start, end, skip_invalid):
+    return index_shard(path, start, end, _worker_game, skip_invalid)
@@ -0,0 +1,146 @@
+import json
+import time
+
+from back_end.board import Board
+from back_end.cache import MoveCache
+from back_end.game import ChessGame
+from back_end.moves import Slider, Knight, King, Pawn
+from back_end.transposition import TranspositionTable
+
+# (owner, method name, label) of the methods timed by default
+DEFAULT_TARGETS = [
+    (cls, name, f"{cls.__name__}.{name}")
+    for cls in [Slider, Knight, King, Pawn]
+    for name in ["get_valid_bitboard", "write_moves"]
+]
+DEFAULT_TARGETS += [
+    (ChessGame, name, f"ChessGame.{name}")
+    for name in [
+        "best_move",
+        "get_valid_moves",
+        "generate_legal_moves",
+        "is_in_check",
+        "get_attacked_bitboards",
+        "get_attack_maps",
+        "get_attacked_pawn_bitboard",
+    ]
+]
+DEFAULT_TARGETS += [
+    (Board, "make_move", "Board.make_move"),
+    (Board, "unmake_move", "Board.unmake_move"),
+]
+# Cache lookups also count their hits, a lookup hits when it does not return None
+CACHE_TARGETS = [
+    (MoveCache, "get", "MoveCache.get"),
+    (MoveCache, "put", "MoveCache.put"),
+    (TranspositionTable, "probe", "TranspositionTable.probe"),
+    (TranspositionTable, "store", "TranspositionTable.store"),
+]
+CACHE_LOOKUPS = {"MoveCache.get", "TranspositionTable.probe"}
+
+
+class Profiler:
+    def __init__(self, targets=None):
+        """
+        Count the calls and the time spent in methods, by wrapping them while enabled.
+
+        Nothing is wrapped while the profiler is disabled, so it costs nothing then.
+        Nested calls of timed methods are included in the time of the outer ones.
+
+        :param targets: (owner, method name, label) of the methods to time, the move
+            generators, ChessGame methods, make/unmake and the caches by default
+        """
+        self.targets = DEFAULT_TARGETS + CACHE_TARGETS if targets is None else targets
+        self.stats = {}  # label -> [calls, seconds, hits]
+        self.originals = []
+        self.started = None
+        self.elapsed = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, name, label in self.targets:
+            self.originals.append((owner, name, owner.__dict__.get(name)))
+            setattr(owner, name, self.wrap(getattr(owner, name), label))
+        self.started = time.perf_counter()
+
+    def disable(self):
+        """Restore the original methods, the stats are kept."""
+        for owner, name, original in reversed(self.originals):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self.originals = []
+        if self.started is not None:
+            self.elapsed += time.perf_counter() - self.started
+            self.started = None
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats[:] = [0, 0.0, 0]
+        self.elapsed = 0.0
+        if self.enabled:
+            self.started = time.perf_counter()
+
+    def wrap(self, method, label):
+        stats = self.stats.setdefault(label, [0, 0.0, 0])
+        lookup = label in CACHE_LOOKUPS
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+            if lookup and result is not None:
+                stats[2] += 1
+            return result
+
+        timed.__wrapped__ = method
+        return timed
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def to_dict(self):
+        """
+        Get the stats: the profiled time and, per label, the calls, the seconds and
+        the share of the profiled time, plus the hits and hit rate of cache lookups.
+        """
+        elapsed = self.elapsed
+        if self.started is not None:
+            elapsed += time.perf_counter() - self.started
+        methods = {}
+        for label, (calls, seconds, hits) in self.stats.items():
+            if not calls:
+                continue
+            methods[label] = {
+                "calls": calls,
+                "seconds": seconds,
+                "share": seconds / elapsed if elapsed else 0.0,
+            }
+            if label in CACHE_LOOKUPS:
+                methods[label].update(hits=hits, hit_rate=hits / calls)
+        return {"seconds": elapsed, "methods": methods}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def profile(targets=None):
+    """
+    Profile a block, e.g.
+
+        with profile() as profiler:
+            game.perft(3)
+        print(profiler.to_json(indent=2))
+    """
+    return Profiler(targets)
@@ -0,0 +1,499 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from back_end.evaluation import evaluate
+from back_end.moves import MoveBuffer, static_exchange_evaluation
+from back_end.transposition import EXACT, LOWER, UPPER, TranspositionTable
+from common.config import EMPTY, MOVE_EN_PASSANT, MOVE_PROMOTION, PIECE_CODE_COSTS
+
+MAX_PLY = 64
+INFINITY = 1 << 30
+MATE_SCORE = 1 << 24  # Beyond any material score, mate in n plies is MATE_SCORE - n
+
+# Move ordering: hash move, captures by MVV-LVA, killer moves, history, then the
+# captures that lose material
+HASH_MOVE_ORDER = 1 << 40
+CAPTURE_ORDER = 1 << 36
+KILLER_ORDER = 1 << 34
+LOSING_CAPTURE_ORDER = -(1 << 20)
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time or node budget is exhausted."""
+
+
+class Search:
+    def __init__(self, game, **kwargs):
+        """
+        Iterative-deepening alpha-beta search over the positions of a ChessGame.
+
+        The transposition table, killer moves and history heuristic are kept between
+        searches, so that consecutive searches of one game build on each other.
+
+        :param table_size_mb: size of the transposition table
+        :param transposition_table: use this TranspositionTable, e.g. a shared one
+        """
+        self.game = game
+        if game.move_buffer is None:
+            game.move_buffer = MoveBuffer(MAX_PLY + 1)
+        self.transposition_table = kwargs.get("transposition_table")
+        if self.transposition_table is None:
+            self.transposition_table = TranspositionTable(
+                kwargs.get("table_size_mb", 16)
+            )
+        self.root_best_move = 0
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(64)]
+        self.nodes = 0
+        self.deadline = None
+        self.max_nodes = None
+        self.stopped = False
+        self.root_moves = None  # Restricts the root to these moves when set
+        self.executor = None  # Process pool of the parallel searches
+        self.workers = 0
+        self.futures = []  # Root move searches of the running parallel search
+        self.worker_stop_flag = None  # Shared flag that stop sets for the workers
+        self.stop_flag = None  # That flag, in the Search of a worker process
+
+    def stop(self):
+        """Ask a running search to return its best move as soon as possible."""
+        self.stopped = True
+        if self.worker_stop_flag is not None:
+            self.worker_stop_flag.value = 1
+        for future in self.futures:
+            future.cancel()
+
+    def best_move(
+        self,
+        time_ms=None,
+        max_nodes=None,
+        max_depth=MAX_PLY,
+        callback=None,
+        workers=1,
+        root_moves=None,
+    ):
+        """
+        Search the best move of the side to move within a time and/or node budget.
+
+        :param time_ms: time budget in milliseconds, None for no limit
+        :param max_nodes: node budget, None for no limit
+        :param max_depth: deepest iteration to search
+        :param callback: called with the info dict after each completed iteration
+        :param workers: number of processes to split the root moves across
+        :param root_moves: only search these root moves, all legal moves by default
+        :return: (best packed move or None, info dict with depth, score, nodes, time, pv)
+        """
+        if workers > 1:
+            return self.best_move_parallel(
+                workers, time_ms, max_nodes, max_depth, callback, root_moves
+            )
+        start = time.perf_counter()
+        self.deadline = None if time_ms is None else start + time_ms / 1000
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.stopped = False
+        board = self.game.board
+        history_length = len(board.history)
+
+        moves = self.game.generate_legal_moves()
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        self.root_moves = moves
+        self.transposition_table.new_search()
+        info = {"depth": 0, "score": 0, "nodes": 0, "time": 0.0, "pv": []}
+        info["iterations"] = []  # (depth, score, best move) of each iteration
+        if not moves:
+            return None, info
+        best_move = moves[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.search(depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                # Unwind the moves the interrupted search left on the board
+                while len(board.history) > history_length:
+                    board.unmake_move()
+                break
+            best_move = self.root_best_move
+            info.update(
+                depth=depth,
+                score=score,
+                nodes=self.nodes,
+                time=time.perf_counter() - start,
+                pv=self.get_principal_variation(depth),
+            )
+            info["iterations"].append((depth, score, best_move))
+            if callback is not None:
+                callback(info)
+            # A restricted root is a share of a parallel search, which compares the
+            # shares at the same depth, so it does not stop early
+            if root_moves is None and (
+                abs(score) > MATE_SCORE - MAX_PLY or len(moves) == 1
+            ):
+                break
+            # The next iteration takes longer than all the previous ones, do not start
+            # it once more than half of the budget is spent
+            now = time.perf_counter()
+            if self.deadline is not None and now - start > self.deadline - now:
+                break
+
+        self.root_moves = None
+        info["nodes"] = self.nodes
+        info["time"] = time.perf_counter() - start
+        return best_move, info
+
+    def best_move_parallel(
+        self, workers, time_ms, max_nodes, max_depth, callback, root_moves=None
+    ):
+        """
+        Split the root moves across worker processes, each searching its share of the
+        moves of a board snapshot, and merge their results.
+
+        The results are compared at the deepest iteration all the workers completed.
+        """
+        start = time.perf_counter()
+        self.stopped = False
+        moves = self.game.generate_legal_moves()
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        moves = self.order_moves(moves, 0, 0)
+        # At least two moves per worker, see the early exits of best_move
+        workers = min(workers, len(moves) // 2)
+        if workers <= 1:
+            return self.best_move(
+                time_ms, max_nodes, max_depth, callback, root_moves=root_moves
+            )
+
+        if self.executor is None or self.workers != workers:
+            self.close()
+            # The workers and later searches of this process share one table
+            if self.transposition_table.name is None:
+                self.transposition_table = self.transposition_table.to_shared()
+            table = self.transposition_table
+            self.worker_stop_flag = multiprocessing.RawValue("b", 0)
+            self.executor = ProcessPoolExecutor(
+                workers,
+                initializer=_init_worker,
+                initargs=(table.name, table.size_mb, self.worker_stop_flag),
+            )
+            self.workers = workers
+        self.worker_stop_flag.value = 0
+        self.transposition_table.new_search()
+        snapshot = self.game.board.snapshot()
+        worker_nodes = None if max_nodes is None else max_nodes // workers
+        self.futures = [
+            self.executor.submit(
+                _search_root_moves,
+                snapshot,
+                moves[i::workers],
+                time_ms,
+                worker_nodes,
+                max_depth,
+                self.transposition_table.generation,
+            )
+            for i in range(workers)
+        ]
+        # Stopped before they started, the cancelled shares are left out
+        wait(self.futures)
+        results = [
+            (i, *future.result())
+            for i, future in enumerate(self.futures)
+            if not future.cancelled()
+        ]
+        self.futures = []
+        if not results:
+            info = {"depth": 0, "score": 0, "nodes": 0, "time": 0.0, "pv": []}
+            return moves[0], {**info, "workers": []}
+
+        depth = min(info["depth"] for _, _, info in results)
+        best_move, best_score, best_info = moves[0], -INFINITY, results[0][2]
+        for _, move, info in results:
+            if move is None:
+                continue
+            if depth:
+                _, score, move = info["iterations"][depth - 1]
+            else:
+                score = info["score"]
+            if score > best_score:
+                best_move, best_score, best_info = move, score, info
+        info = {
+            "depth": depth,
+            "score": best_score if depth else 0,
+            "nodes": sum(info["nodes"] for _, _, info in results),
+            "time": time.perf_counter() - start,
+            "pv": best_info["pv"] if best_info["pv"][:1] == [best_move] else [],
+            "workers": [
+                {
+                    "moves": len(moves[i::workers]),
+                    "depth": info["depth"],
+                    "score": info["score"],
+                    "nodes": info["nodes"],
+                    "best_move": move,
+                }
+                for i, move, info in results
+            ],
+        }
+        if callback is not None:
+            callback(info)
+        return best_move, info
+
+    def close(self):
+        """
+        Shut down the worker processes of the parallel searches, and move the shared
+        transposition table back into private memory.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.workers = 0
+            self.worker_stop_flag = None
+        table = self.transposition_table
+        if table.name is not None and table.owner:
+            self.transposition_table = TranspositionTable(table.size_mb)
+            self.transposition_table.table[:] = table.table
+            self.transposition_table.generation = table.generation
+            table.close()
+
+    def check_limits(self):
+        if (
+            self.stopped
+            or (self.stop_flag is not None and self.stop_flag.value)
+            or (self.deadline is not None and time.perf_counter() > self.deadline)
+            or (self.max_nodes is not None and self.nodes >= self.max_nodes)
+        ):
+            raise SearchTimeout()
+
+    def search(self, depth, alpha, beta, ply):
+        """Negamax alpha-beta search, the score is from the side to move's point of view."""
+        board = self.game.board
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.check_limits()
+        if ply and (board.halfmove_clock >= 100 or board.is_repetition()):
+            return 0
+
+        key = board.hash
+        entry = self.transposition_table.probe(key)
+        hash_move = 0
+        if entry is not None:
+            entry_depth, score, bound, hash_move = entry
+            if ply and entry_depth >= depth:
+                score = score_from_table(score, ply)
+                if (
+                    bound == EXACT
+                    or (bound == LOWER and score >= beta)
+                    or (bound == UPPER and score <= alpha)
+                ):
+                    return score
+
+        in_check = self.game.is_in_check()
+        if in_check and ply < MAX_PLY:
+            depth += 1  # Check extension
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(alpha, beta, ply)
+
+        # The moves of each ply are generated into its row of the move buffer
+        move_buffer = self.game.move_buffer
+        moves = move_buffer.rows[ply]
+        if ply == 0 and self.root_moves is not None:
+            count = move_buffer.load(0, self.root_moves)
+        else:
+            count = self.game.generate_moves_into(moves)
+        if not count:
+            return -MATE_SCORE + ply if in_check else 0
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, moves[0]
+        self.sort_moves(ply, count, hash_move)
+        for i in range(count):
+            move = moves[i]
+            capture = self.is_capture(move)
+            board.make_move(move)
+            score = -self.search(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not capture:
+                    self.update_quiet_move(move, depth, ply)
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if ply == 0:
+            self.root_best_move = best_move
+        self.transposition_table.store(
+            key, depth, score_to_table(best_score, ply), bound, best_move
+        )
+        return best_score
+
+    def quiescence(self, alpha, beta, ply):
+        """Search the captures and promotions only, until the position is quiet."""
+        board = self.game.board
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.check_limits()
+
+        stand_pat = evaluate(board)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        move_buffer = self.game.move_buffer
+        moves, scores = move_buffer.rows[ply], move_buffer.score_rows[ply]
+        count = self.game.generate_moves_into(moves, captures_only=True)
+        self.sort_moves(ply, count, 0)
+        for i in range(count):
+            # The losing captures are ordered last, the only negative scores
+            if scores[i] < 0:
+                break
+            move = moves[i]
+            board.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def is_capture(self, move):
+        board = self.game.board
+        return board.mailbox[move >> 6 & 63] != EMPTY or move >> 14 == MOVE_EN_PASSANT
+
+    def is_losing_capture(self, move):
+        """
+        Check whether a capture or promotion loses material once the captures on its
+        square are resolved, see static_exchange_evaluation.
+        """
+        mailbox = self.game.board.mailbox
+        victim = PIECE_CODE_COSTS[mailbox[move >> 6 & 63]]
+        if PIECE_CODE_COSTS[mailbox[move & 63]] <= victim:
+            return False  # Even if the attacker is recaptured
+        return (
+            static_exchange_evaluation(self.game.board, move, self.game.bitboard_tables)
+            < 0
+        )
+
+    def order_moves(self, moves, hash_move, ply):
+        """Sort a list of moves, see move_order."""
+        return sorted(moves, key=self.move_order(hash_move, ply), reverse=True)
+
+    def sort_moves(self, ply, count, hash_move):
+        """
+        Score the first moves of the row of a ply in the move buffer, see move_order,
+        and sort them by score. The scores stay in the score row of the ply.
+        """
+        move_buffer = self.game.move_buffer
+        moves, scores = move_buffer.rows[ply], move_buffer.score_rows[ply]
+        order = self.move_order(hash_move, ply)
+        for i in range(count):
+            scores[i] = order(moves[i])
+        if count > 1:
+            move_buffer.sort(ply, count)
+
+    def move_order(self, hash_move, ply):
+        """
+        Get the sort key of the moves, highest first: hash move, captures by most
+        valuable victim / least valuable attacker (PIECE_CODE_COSTS), killer moves,
+        quiet moves by history, then the captures and promotions that lose material by
+        static exchange evaluation.
+        """
+        mailbox = self.game.board.mailbox
+        killers = self.killers[ply]
+
+        def order(move):
+            if move == hash_move:
+                return HASH_MOVE_ORDER
+            from_position = move & 63
+            to_position = move >> 6 & 63
+            victim = PIECE_CODE_COSTS[mailbox[to_position]]
+            if victim or move >> 14 == MOVE_EN_PASSANT:
+                attacker = min(PIECE_CODE_COSTS[mailbox[from_position]], 10)
+                if self.is_losing_capture(move):
+                    return LOSING_CAPTURE_ORDER + 100 * victim - attacker
+                return CAPTURE_ORDER + 100 * max(victim, 1) - attacker
+            # Quiet promotions are searched by the quiescence too, unless they lose
+            if move >> 14 == MOVE_PROMOTION and self.is_losing_capture(move):
+                return LOSING_CAPTURE_ORDER
+            if move == killers[0] or move == killers[1]:
+                return KILLER_ORDER
+            return self.history[from_position][to_position]
+
+        return order
+
+    def update_quiet_move(self, move, depth, ply):
+        """Remember a quiet move that caused a beta cutoff."""
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+        history = self.history[move & 63]
+        history[move >> 6 & 63] = min(
+            history[move >> 6 & 63] + depth * depth, KILLER_ORDER - 1
+        )
+
+    def get_principal_variation(self, depth):
+        """Follow the hash moves from the current position."""
+        board = self.game.board
+        pv = []
+        while len(pv) < depth:
+            entry = self.transposition_table.probe(board.hash)
+            if entry is None or entry[3] not in self.game.generate_legal_moves():
+                break
+            pv.append(entry[3])
+            board.make_move(entry[3])
+        for _ in pv:
+            board.unmake_move()
+        return pv
+
+
+_worker_search = None  # Search of a worker process, kept between its tasks
+
+
+def _init_worker(table_name, table_size_mb, stop_flag=None):
+    global _worker_search
+    from back_end.game import ChessGame
+
+    table = TranspositionTable(table_size_mb, name=table_name)
+    _worker_search = Search(ChessGame(), transposition_table=table)
+    # Shared with the Search that splits the root moves, see Search.stop
+    _worker_search.stop_flag = stop_flag
+
+
+def _search_root_moves(snapshot, root_moves, time_ms, max_nodes, max_depth, generation):
+    """Search some of the root moves of a board snapshot in a worker process."""
+    from back_end.board import Board
+
+    _worker_search.game.board = Board(snapshot=snapshot)
+    _worker_search.transposition_table.generation = generation - 1
+    return _worker_search.best_move(
+        time_ms=time_ms,
+        max_nodes=max_nodes,
+        max_depth=max_depth,
+        root_moves=root_moves,
+    )
+
+
+def score_to_table(score, ply):
+    """Store mate scores relative to the position instead of the root."""
+    if score > MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score < -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score > MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score < -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
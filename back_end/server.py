@@ -0,0 +1,384 @@
+"""
+Asyncio HTTP service hosting concurrent ChessGame sessions, e.g.
+
+    python -m back_end.server --port 8000
+
+    POST   /sessions              {"fen": ..., "time_ms": 300000, "increment_ms": 2000}
+    GET    /sessions/<id>
+    POST   /sessions/<id>/move    {"move": "e2e4", "reply": true}
+    POST   /sessions/<id>/go      {"time_ms": 500}
+    DELETE /sessions/<id>
+    GET    /stats
+
+Moves are in UCI notation. The sessions share the lookup tables of the process and a
+transposition table in shared memory. The searches run in a process pool of a fixed
+size; beyond max_pending queued searches the server answers 503 instead of queueing.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from back_end.game import ChessGame
+from back_end.search import MAX_PLY, _init_worker, _search_root_moves
+from back_end.tablebase import INSUFFICIENT_MATERIAL, material_signature
+from back_end.transposition import TranspositionTable
+from back_end.utils import move_to_uci, popcount
+from common.config import KING
+
+MAX_BODY_BYTES = 1 << 16
+REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    def __init__(self, fen=None, time_ms=None, increment_ms=0):
+        """
+        A game and its clocks.
+
+        :param time_ms: time of each side, None for no time control
+        :param increment_ms: time added to a side after each of its moves
+        """
+        self.game = ChessGame(**({} if fen is None else {"fen": fen}))
+        bitboards = self.game.board.bitboards
+        if any(popcount(bitboards[color * 6 + KING]) != 1 for color in [0, 1]):
+            raise ValueError("The position must have one king per side")
+        self.lock = asyncio.Lock()  # One move or search at a time
+        self.clocks = None if time_ms is None else [time_ms, time_ms]
+        self.increment_ms = increment_ms
+        self.turn_started = time.monotonic()
+        self.result = None
+        self.update_result()
+
+    def search_time_ms(self, time_ms=None):
+        """Budget of a search: the requested time, within the clock of the side to move."""
+        if self.clocks is None:
+            return time_ms or 1000
+        remaining = self.clocks[self.game.board.turn] - self.elapsed_ms()
+        budget = remaining / 30 + self.increment_ms * 0.8
+        if time_ms is not None:
+            budget = min(budget, time_ms)
+        return max(min(budget, remaining - 50), 1)
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.turn_started) * 1000
+
+    def play(self, move):
+        """Play a legal packed move, charging its time to the clock of the mover."""
+        board = self.game.board
+        if self.clocks is not None:
+            self.clocks[board.turn] -= self.elapsed_ms()
+            if self.clocks[board.turn] < 0:
+                self.result = "1-0" if board.turn else "0-1"
+                raise HTTPError(409, "Time is up")
+            self.clocks[board.turn] += self.increment_ms
+        board.make_move(move)
+        self.turn_started = time.monotonic()
+        self.update_result()
+
+    def update_result(self):
+        """
+        Set the result when the side to move is mated, or the game is drawn by the
+        fifty-move rule, threefold repetition or insufficient material.
+        """
+        board = self.game.board
+        if not self.game.generate_legal_moves():
+            if self.game.is_in_check():
+                self.result = "0-1" if board.turn == 0 else "1-0"
+            else:
+                self.result = "1/2-1/2"
+        elif (
+            board.halfmove_clock >= 100
+            or board.is_repetition(3)
+            or material_signature(board)[0] in INSUFFICIENT_MATERIAL
+        ):
+            self.result = "1/2-1/2"
+
+    def state(self):
+        legal_moves = [] if self.result else self.game.generate_legal_moves()
+        return {
+            "fen": self.game.board.to_fen(),
+            "legal_moves": [move_to_uci(move) for move in legal_moves],
+            "clocks": None if self.clocks is None else [round(c) for c in self.clocks],
+            "result": self.result,
+        }
+
+
+class GameServer:
+    def __init__(self, search_workers=2, max_pending=8, max_sessions=1000, **kwargs):
+        """
+        :param search_workers: processes running the searches
+        :param max_pending: searches running or queued beyond which requests get a 503
+        :param max_sessions: sessions beyond which new sessions get a 503
+        :param table_size_mb: size of the transposition table shared by the workers
+        """
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.pending = 0
+        self.transposition_table = TranspositionTable(
+            kwargs.get("table_size_mb", 64), shared=True
+        )
+        self.executor = ProcessPoolExecutor(
+            search_workers,
+            initializer=_init_worker,
+            initargs=(self.transposition_table.name, self.transposition_table.size_mb),
+        )
+        self.server = None
+        self.connections = {}  # Writer -> handler task of each open connection
+        self.counters = {"requests": 0, "searches": 0, "rejected": 0}
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in self.connections:
+                writer.close()
+            await asyncio.gather(*self.connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+        self.executor.shutdown()
+        self.transposition_table.close()
+
+    async def handle_connection(self, reader, writer):
+        """Serve the requests of a keep-alive connection one after the other."""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as error:
+                    # The rest of the stream cannot be parsed, answer and hang up
+                    await write_response(writer, error.status, {"error": str(error)})
+                    break
+                if request is None:
+                    break
+                method, path, body = request
+                self.counters["requests"] += 1
+                try:
+                    status, response = await self.route(method, path, body)
+                except HTTPError as error:
+                    status, response = error.status, {"error": str(error)}
+                await write_response(writer, status, response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def route(self, method, path, body):
+        parts = path.strip("/").split("/")
+        if parts == ["stats"] and method == "GET":
+            return 200, self.stats()
+        if parts[0] != "sessions" or len(parts) > 3:
+            raise HTTPError(404, f"Unknown path {path}")
+        if len(parts) == 1:
+            if method != "POST":
+                raise HTTPError(405, f"{method} {path}")
+            return 201, self.create_session(body)
+
+        session = self.sessions.get(parts[1])
+        if session is None:
+            raise HTTPError(404, f"Unknown session {parts[1]}")
+        action = parts[2] if len(parts) == 3 else None
+        if action is None and method == "GET":
+            return 200, session.state()
+        if action is None and method == "DELETE":
+            del self.sessions[parts[1]]
+            return 200, {}
+        if action == "move" and method == "POST":
+            return 200, await self.move(session, body)
+        if action == "go" and method == "POST":
+            time_ms = body_value(body, "time_ms", int)
+            async with session.lock:
+                return 200, await self.search(session, time_ms)
+        raise HTTPError(405, f"{method} {path}")
+
+    def create_session(self, body):
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Too many sessions")
+        try:
+            session = Session(
+                body_value(body, "fen", str),
+                body_value(body, "time_ms", int),
+                body_value(body, "increment_ms", int) or 0,
+            )
+        except ValueError as error:
+            raise HTTPError(400, str(error)) from None
+        session_id = uuid.uuid4().hex
+        # Registered once its state could be answered
+        response = {"session": session_id, **session.state()}
+        self.sessions[session_id] = session
+        return response
+
+    async def move(self, session, body):
+        """Play the move of the body, then the reply of the engine if asked for."""
+        uci = body_value(body, "move", str)
+        time_ms = body_value(body, "time_ms", int)
+        async with session.lock:
+            if session.result:
+                raise HTTPError(409, f"The game is over: {session.result}")
+            moves = {
+                move_to_uci(move): move for move in session.game.generate_legal_moves()
+            }
+            if uci not in moves:
+                raise HTTPError(400, f"Illegal move {uci}")
+            session.play(moves[uci])
+            if body.get("reply") and not session.result:
+                return await self.search(session, time_ms)
+            return session.state()
+
+    async def search(self, session, time_ms=None):
+        """Search and play the engine move in the process pool, see Search.best_move."""
+        if session.result:
+            raise HTTPError(409, f"The game is over: {session.result}")
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise HTTPError(503, "Too many searches in progress, retry later")
+        self.pending += 1
+        self.transposition_table.new_search()
+        try:
+            move, info = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                _search_root_moves,
+                session.game.board.snapshot(),
+                None,
+                session.search_time_ms(time_ms),
+                None,
+                MAX_PLY,
+                self.transposition_table.generation,
+            )
+        finally:
+            self.pending -= 1
+        self.counters["searches"] += 1
+        if move is None:
+            raise HTTPError(409, "The side to move has no legal move")
+        session.play(move)
+        state = session.state()
+        state.update(
+            engine_move=move_to_uci(move),
+            depth=info["depth"],
+            score=info["score"],
+            nodes=info["nodes"],
+        )
+        return state
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "pending_searches": self.pending,
+            **self.counters,
+            "transposition_table": self.transposition_table.stats(),
+        }
+
+
+async def read_request(reader):
+    """
+    Read an HTTP/1.1 request with a JSON body.
+
+    :return: (method, path, body dict), None when the connection is closed
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Invalid request line") from None
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in [b"\r\n", b"\n", b""]:
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                content_length = int(value)
+            except ValueError:
+                raise HTTPError(400, "Invalid Content-Length") from None
+            if content_length < 0:
+                raise HTTPError(400, "Invalid Content-Length")
+    if content_length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = {}
+    if content_length:
+        try:
+            body = json.loads(await reader.readexactly(content_length))
+        except json.JSONDecodeError:
+            body = None
+    if not isinstance(body, dict):
+        body = {}
+    return method, path, body
+
+
+def body_value(body, name, value_type):
+    """
+    Get a field of a request body.
+
+    :param value_type: JSON type of the field, str or int
+    :return: the value, None when the field is missing or null
+    """
+    value = body.get(name)
+    # bool is an int in Python but not a number in JSON
+    if value is not None and (
+        not isinstance(value, value_type) or isinstance(value, bool)
+    ):
+        raise HTTPError(400, f"Invalid {name} {json.dumps(value)}")
+    return value
+
+
+async def write_response(writer, status, response):
+    """Write a JSON response with its status line and headers."""
+    payload = json.dumps(response).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+
+
+async def serve(host, port, **kwargs):
+    server = GameServer(**kwargs)
+    host, port = await server.start(host, port)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve ChessGame sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--search-workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(
+        serve(
+            args.host,
+            args.port,
+            search_workers=args.search_workers,
+            max_pending=args.max_pending,
+        )
+    )
@@ -0,0 +1,182 @@
+"""
+Endgame tables of positions with a few pieces, probed instead of searched.
+
+Each material signature, e.g. KQvK, has one file written by
+scripts/make_tablebases.py with save_arrays, memory-mapped on first use:
+
+    wdl: 2 bits per position, 4 positions per byte, ILLEGAL, LOSS, DRAW or WIN of
+        the side to move
+    dtm: one byte per position, plies to mate for a WIN or a LOSS
+
+Positions are indexed by the side to move and the squares of the pieces, see
+position_index. The side with more material is white, positions where black has it
+are mirrored vertically with the colors swapped.
+"""
+
+import os
+
+from common.config import PIECE_TYPES, QUEEN, ROOK, BISHOP, KNIGHT, PAWN, KING
+from back_end.moves import PAWN_ATTACKS
+from back_end.utils import bitboard_to_positions, open_arrays, popcount
+
+TABLEBASES_PATH = os.path.join(os.path.dirname(__file__), "lookup_tables", "tablebases")
+TABLEBASE_MAGIC = b"CHESSEGT"
+TABLEBASE_VERSION = 1
+ILLEGAL, LOSS, DRAW, WIN = range(4)  # Values of the wdl table
+MAX_DTM = 255
+# Piece types in the order of the signatures, e.g. KRPvK
+SIGNATURE_TYPES = [KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN]
+SIGNATURE_LETTERS = "KQRBNP"
+# Material no side can mate with
+INSUFFICIENT_MATERIAL = {"KvK", "KBvK", "KNvK"}
+
+
+def side_signature(board, color):
+    """Letters of the pieces of a color, e.g. KRP."""
+    return "".join(
+        letter * popcount(board.bitboards[color * len(PIECE_TYPES) + piece_type])
+        for piece_type, letter in zip(SIGNATURE_TYPES, SIGNATURE_LETTERS)
+    )
+
+
+def side_strength(side):
+    """Order of the sides of a signature, more pieces then stronger pieces first."""
+    return len(side), [-SIGNATURE_LETTERS.index(letter) for letter in side]
+
+
+def normalize_signature(white, black):
+    """
+    Join the sides of a signature, with the stronger side first.
+
+    :return: (signature e.g. "KQvK", whether the colors are swapped in the signature)
+    """
+    if side_strength(black) > side_strength(white):
+        return f"{black}v{white}", True
+    return f"{white}v{black}", False
+
+
+def material_signature(board):
+    """Get the material signature of a board, see normalize_signature."""
+    return normalize_signature(side_signature(board, 0), side_signature(board, 1))
+
+
+def signature_squares(board, flipped):
+    """
+    Get the squares of the pieces in the order of the signature: the king and the
+    pieces of the first side, then those of the second side.
+
+    :param flipped: mirror the squares vertically and swap the colors
+    """
+    squares = []
+    for color in [1, 0] if flipped else [0, 1]:
+        for piece_type in SIGNATURE_TYPES:
+            bitboard = board.bitboards[color * len(PIECE_TYPES) + piece_type]
+            squares += [
+                position ^ 56 if flipped else position
+                for position in bitboard_to_positions(bitboard)
+            ]
+    return squares
+
+
+def position_index(turn, squares):
+    """
+    Index of a position in the tables of its signature: turn * 64 ** n + the squares
+    as n base-64 digits. Works on numpy arrays too.
+    """
+    index = turn
+    for square in squares:
+        index = index * 64 + square
+    return index
+
+
+def table_path(signature, path=TABLEBASES_PATH):
+    return os.path.join(path, f"{signature}.bin")
+
+
+class TablebaseProbe:
+    def __init__(self, path=TABLEBASES_PATH):
+        """
+        Probe the endgame tables of a directory, see scripts/make_tablebases.py.
+
+        ChessGame accepts any object with a probe(board) method as its endgame_probe.
+        """
+        self.path = path
+        self.tables = {}  # Signature -> {"wdl", "dtm"}, None without a file
+        # Pieces of the largest table, positions with more are not looked up
+        names = os.listdir(path) if os.path.isdir(path) else []
+        self.max_pieces = max(
+            (len(name) - len("v.bin") for name in names if name.endswith(".bin")),
+            default=0,
+        )
+
+    def load(self, signature):
+        if signature not in self.tables:
+            path = table_path(signature, self.path)
+            self.tables[signature] = (
+                open_arrays(path, TABLEBASE_MAGIC, TABLEBASE_VERSION)
+                if os.path.exists(path)
+                else None
+            )
+        return self.tables[signature]
+
+    def probe(self, board):
+        """
+        Look up the outcome of a position with perfect play.
+
+        :return: (1, 0 or -1 for a win, draw or loss of the side to move, plies to
+            mate), None when no table covers the position
+        """
+        if board.castling_rights:
+            return None
+        # The tables have no en passant square, it only matters when a pawn of the
+        # side to move can capture on it
+        if board.en_passant is not None:
+            attackers = board.move_data["pawn"][PAWN_ATTACKS[board.turn ^ 1]][
+                board.en_passant
+            ]
+            if attackers & board.bitboards[board.turn * len(PIECE_TYPES) + PAWN]:
+                return None
+        signature, flipped = material_signature(board)
+        if signature in INSUFFICIENT_MATERIAL:
+            return 0, 0
+        if len(signature) - 1 > self.max_pieces:
+            return None
+        tables = self.load(signature)
+        if tables is None:
+            return None
+        index = position_index(board.turn ^ flipped, signature_squares(board, flipped))
+        value = int(tables["wdl"][index >> 2]) >> (index & 3) * 2 & 3
+        if value == ILLEGAL:
+            return None
+        return value - DRAW, int(tables["dtm"][index])
+
+
+def best_tablebase_move(game, probe):
+    """
+    Pick the move with the best outcome after it: the fastest win, else a draw, else
+    the slowest loss.
+
+    :param probe: object with a probe(board) method, e.g. a TablebaseProbe
+    :return: (packed move, (win/draw/loss, plies to mate)), None when a position after
+        a move is not covered
+    """
+    board = game.board
+    # The positions after the moves keep the material, a capture aside, so a position
+    # that is not covered has replies that are not either, e.g. any middlegame
+    if probe.probe(board) is None:
+        return None
+    best, best_order = None, None
+    for move in game.generate_legal_moves():
+        board.make_move(move)
+        if game.generate_legal_moves():
+            outcome = probe.probe(board)
+        else:
+            outcome = (-1, 0) if game.is_in_check() else (0, 0)
+        board.unmake_move()
+        if outcome is None:
+            return None
+        wdl, dtm = -outcome[0], outcome[1] + 1 if outcome[0] else 0
+        order = (wdl, -dtm if wdl > 0 else dtm)
+        if best_order is None or order > best_order:
+            best, best_order = (move, (wdl, dtm)), order
+    return best
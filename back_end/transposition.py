@@ -0,0 +1,131 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Bounds of the stored scores
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# An entry is two uint64 words: check = key ^ data and data, packed as
+# score + 2**31 | move << 32 | depth << 48 | bound << 56 | generation << 58.
+# A reader only accepts data with check ^ data == key, so an entry torn by two
+# processes writing at once reads as a miss instead of as another position's data.
+ENTRY_BYTES = 16
+SCORE_OFFSET = 1 << 31
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, shared=False, name=None):
+        """
+        Fixed-size transposition table of (key, depth, score, bound, move) entries in
+        a numpy array, optionally in shared memory so that processes can share it.
+
+        :param size_mb: size of the table, rounded down to a power of two of entries
+        :param shared: create the table in a new shared memory block
+        :param name: attach to the shared memory block of another process instead
+        """
+        entries = 1 << max(int(size_mb * (1 << 20) // ENTRY_BYTES).bit_length() - 1, 0)
+        self.mask = entries - 1
+        self.shared_memory = None
+        self.owner = name is None
+        if name is None and not shared:
+            self.table = np.zeros(2 * entries, dtype=np.uint64)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(
+                name=name, create=name is None, size=entries * ENTRY_BYTES
+            )
+            self.table = np.ndarray(
+                2 * entries, dtype=np.uint64, buffer=self.shared_memory.buf
+            )
+            if name is None:
+                self.table[:] = 0
+        self.size_mb = size_mb
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def name(self):
+        """Name of the shared memory block, None for a private table."""
+        return None if self.shared_memory is None else self.shared_memory.name
+
+    def __len__(self):
+        return self.mask + 1
+
+    def new_search(self):
+        """Age the entries, those of older searches are replaced first."""
+        self.generation = (self.generation + 1) & 63
+
+    def probe(self, key):
+        """
+        Look up a position.
+
+        :return: (depth, score, bound, move) or None
+        """
+        self.probes += 1
+        index = 2 * (key & self.mask)
+        data = int(self.table[index + 1])
+        if int(self.table[index]) ^ data != key or not data:
+            return None
+        self.hits += 1
+        return (
+            data >> 48 & 255,
+            (data & 0xFFFFFFFF) - SCORE_OFFSET,
+            data >> 56 & 3,
+            data >> 32 & 0xFFFF,
+        )
+
+    def store(self, key, depth, score, bound, move):
+        """
+        Store a position, keeping the deeper entry of the current search on collisions.
+        """
+        index = 2 * (key & self.mask)
+        old_data = int(self.table[index + 1])
+        if old_data and int(self.table[index]) ^ old_data != key:
+            if old_data >> 58 == self.generation and old_data >> 48 & 255 > depth:
+                return
+        data = (
+            (score + SCORE_OFFSET)
+            | move << 32
+            | max(depth, 0) << 48
+            | bound << 56
+            | self.generation << 58
+        )
+        self.table[index] = key ^ data
+        self.table[index + 1] = data
+        self.stores += 1
+
+    def to_shared(self):
+        """Copy a private table into a new shared memory block."""
+        table = TranspositionTable(self.size_mb, shared=True)
+        table.table[:] = self.table
+        table.generation = self.generation
+        return table
+
+    def clear(self):
+        self.table[:] = 0
+
+    def stats(self):
+        """Get the fill rate and the hit rate of this process."""
+        filled = int(np.count_nonzero(self.table[1::2]))
+        return {
+            "entries": len(self),
+            "filled": filled,
+            "fill_rate": filled / len(self),
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+        }
+
+    def close(self):
+        """Detach from the shared memory, the owner also frees it."""
+        if self.shared_memory is None:
+            return
+        self.table = None
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+        self.shared_memory = None
@@ -0,0 +1,299 @@
+"""
+UCI protocol front end of the engine, for chess GUIs and tournament runners, e.g.
+
+    python main.py uci
+    cutechess-cli -engine cmd=python arg=main.py arg=uci dir=<repo> ...
+
+Commands are read from stdin while the search runs on a background thread, so that
+stop and ponderhit are answered within milliseconds. The game and its Search are kept
+between the moves: the transposition table, killer moves and history of the previous
+searches, and of the pondering, order the moves of the next ones.
+"""
+
+import sys
+import threading
+import time
+
+from back_end.fen import STARTING_FEN
+from back_end.game import ChessGame
+from back_end.search import MATE_SCORE, MAX_PLY, Search
+from back_end.utils import move_to_uci
+
+ENGINE_NAME = "gcp-chess"
+ENGINE_AUTHOR = "VitaminB16"
+DEFAULT_HASH_MB = 64
+MAX_HASH_MB = 4096
+# Share of the remaining clock spent on a move without movestogo
+MOVES_TO_GO = 30
+# Kept on the clock for the communication with the GUI
+MOVE_OVERHEAD_MS = 50
+GO_INTEGER_PARAMETERS = {
+    "wtime",
+    "btime",
+    "winc",
+    "binc",
+    "movestogo",
+    "depth",
+    "nodes",
+    "mate",
+    "movetime",
+}
+
+
+def search_time_ms(params, turn):
+    """
+    Budget of a search from the parameters of a go command.
+
+    :return: milliseconds, None for no time limit
+    """
+    if "movetime" in params:
+        return max(params["movetime"] - MOVE_OVERHEAD_MS, 1)
+    remaining = params.get("btime" if turn else "wtime")
+    if remaining is None:
+        return None
+    increment = params.get("binc" if turn else "winc", 0)
+    budget = remaining / params.get("movestogo", MOVES_TO_GO) + increment * 0.8
+    return max(min(budget, remaining - MOVE_OVERHEAD_MS), 1)
+
+
+def parse_go(tokens):
+    """
+    Parse the parameters of a go command, e.g. "wtime 1000 btime 1000 ponder".
+
+    :return: dict of the integer parameters, with True for infinite and ponder
+    """
+    params = {}
+    for i, token in enumerate(tokens):
+        if token in GO_INTEGER_PARAMETERS and i + 1 < len(tokens):
+            try:
+                params[token] = int(tokens[i + 1])
+            except ValueError:
+                pass  # Left out, the search still has to send a best move
+        elif token in ["infinite", "ponder"]:
+            params[token] = True
+    return params
+
+
+def format_score(score):
+    """UCI score of a search score, in centipawns or in moves to mate."""
+    if abs(score) > MATE_SCORE - MAX_PLY:
+        plies = MATE_SCORE - abs(score)
+        return f"mate {(plies + 1) // 2 if score > 0 else -((plies + 1) // 2)}"
+    return f"cp {score}"
+
+
+class UCIEngine:
+    def __init__(self, output=None, **kwargs):
+        """
+        Answer the UCI commands of a GUI, see handle.
+
+        :param output: called with each line sent to the GUI, printed by default
+        :param table_size_mb: size of the transposition table
+        """
+        self.output = output or (lambda line: print(line, flush=True))
+        self.output_lock = threading.Lock()  # The search thread writes too
+        self.table_size_mb = kwargs.get("table_size_mb", DEFAULT_HASH_MB)
+        self.game = ChessGame()
+        self.game.search = Search(self.game, table_size_mb=self.table_size_mb)
+        self.position = (STARTING_FEN, [])  # FEN and UCI moves of the game
+
+        self.thread = None
+        # Set when the best move may be sent: right away, or after stop or ponderhit
+        # in the infinite and ponder modes
+        self.release = threading.Event()
+        self.stop_requested = False
+        self.deadline = None  # Applied to the search after each iteration
+        self.go_params = {}
+
+    def send(self, line):
+        with self.output_lock:
+            self.output(line)
+
+    def run(self, lines=sys.stdin):
+        """Handle the commands of lines until quit or the end of the input."""
+        for line in lines:
+            if not self.handle(line):
+                break
+        self.stop()
+
+    def handle(self, line):
+        """
+        Handle one command, unknown commands are ignored as the protocol asks.
+
+        :return: False after quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(
+                f"option name Hash type spin default {DEFAULT_HASH_MB} "
+                f"min 1 max {MAX_HASH_MB}"
+            )
+            self.send("option name Ponder type check default true")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(args)
+        elif command == "ucinewgame":
+            self.stop()
+            self.game.search.transposition_table.clear()
+            self.game.search = Search(
+                self.game, transposition_table=self.game.search.transposition_table
+            )
+        elif command == "position":
+            self.stop()
+            self.set_position(args)
+        elif command == "go":
+            self.stop()
+            self.go(parse_go(args))
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            return False
+        return True
+
+    def set_option(self, args):
+        """Handle "setoption name <name> value <value>", only Hash changes anything."""
+        if "name" not in args:
+            return
+        name_end = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1 : name_end]).lower()
+        value = " ".join(args[name_end + 1 :])
+        if name == "hash":
+            try:
+                table_size_mb = int(value)
+            except ValueError:
+                self.send(f"info string invalid Hash value {value}")
+                return
+            self.stop()
+            self.table_size_mb = min(max(table_size_mb, 1), MAX_HASH_MB)
+            self.game.search.transposition_table.close()
+            self.game.search = Search(self.game, table_size_mb=self.table_size_mb)
+
+    def set_position(self, args):
+        """
+        Handle "position startpos|fen <fen> [moves <uci moves>]". When the game only
+        gained moves since the last position, just those are played.
+        """
+        moves_start = args.index("moves") if "moves" in args else len(args)
+        if args[:1] == ["fen"]:
+            fen = " ".join(args[1:moves_start])
+        else:
+            fen = STARTING_FEN
+        moves = args[moves_start + 1 :]
+        previous_fen, previous_moves = self.position
+        if fen == previous_fen and moves[: len(previous_moves)] == previous_moves:
+            new_moves = moves[len(previous_moves) :]
+        else:
+            try:
+                self.game.board.set_fen(fen)
+            except ValueError as error:
+                self.send(f"info string invalid fen {fen}: {error}")
+                # set_fen stops half way, search the starting position until the next
+                # position command, which is set up from scratch
+                self.game.board.set_fen(STARTING_FEN)
+                self.position = (None, [])
+                return
+            new_moves = moves
+        self.position = (fen, moves)
+        for uci in new_moves:
+            legal_moves = {
+                move_to_uci(move): move for move in self.game.generate_legal_moves()
+            }
+            if uci not in legal_moves:
+                self.send(f"info string illegal move {uci}")
+                self.position = (None, [])  # Set up the next position from scratch
+                return
+            self.game.board.make_move(legal_moves[uci])
+
+    def go(self, params):
+        """Start a search on the background thread, see parse_go."""
+        self.go_params = params
+        self.stop_requested = False
+        self.release.clear()
+        if not (params.get("ponder") or params.get("infinite")):
+            self.release.set()
+        time_ms = None
+        if not params.get("ponder"):
+            time_ms = search_time_ms(params, self.game.board.turn)
+        self.deadline = (
+            None if time_ms is None else time.perf_counter() + time_ms / 1000
+        )
+        max_depth = params.get("depth", MAX_PLY)
+        if "mate" in params:
+            max_depth = min(max_depth, 2 * params["mate"] - 1)
+        self.thread = threading.Thread(
+            target=self.search,
+            args=(time_ms, params.get("nodes"), max_depth),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def search(self, time_ms, max_nodes, max_depth):
+        """Search and send the best move, on the background thread."""
+        move, info = self.game.best_move(
+            time_ms=time_ms,
+            max_nodes=max_nodes,
+            max_depth=max_depth,
+            callback=self.send_info,
+        )
+        # The protocol forbids the best move of a ponder or infinite search before
+        # ponderhit or stop
+        self.release.wait()
+        if move is None:
+            self.send("bestmove 0000")
+            return
+        pv = info.get("pv", [])
+        if len(pv) > 1 and pv[0] == move:
+            self.send(f"bestmove {move_to_uci(move)} ponder {move_to_uci(pv[1])}")
+        else:
+            self.send(f"bestmove {move_to_uci(move)}")
+
+    def send_info(self, info):
+        """Report an iteration, and apply the limits changed since the search started."""
+        search = self.game.search
+        if self.stop_requested:
+            search.stop()
+        search.deadline = self.deadline
+        elapsed_ms = max(int(info["time"] * 1000), 1)
+        pv = " ".join(move_to_uci(move) for move in info["pv"])
+        self.send(
+            f"info depth {info['depth']} score {format_score(info['score'])} "
+            f"nodes {info['nodes']} nps {info['nodes'] * 1000 // elapsed_ms} "
+            f"time {elapsed_ms} pv {pv}"
+        )
+
+    def ponderhit(self):
+        """The opponent played the ponder move: go on searching on the clock."""
+        if self.thread is None or not self.go_params.get("ponder"):
+            return
+        self.go_params = {**self.go_params, "ponder": False}
+        time_ms = search_time_ms(self.go_params, self.game.board.turn)
+        if time_ms is not None:
+            self.deadline = time.perf_counter() + time_ms / 1000
+            self.game.search.deadline = self.deadline
+        if not self.go_params.get("infinite"):
+            self.release.set()
+
+    def stop(self):
+        """Stop the running search, if any, and wait for its best move to be sent."""
+        if self.thread is None:
+            return
+        self.stop_requested = True
+        self.release.set()
+        while self.thread.is_alive():
+            # Repeated in case the search had not set up its limits yet
+            self.game.search.stop()
+            self.thread.join(0.001)
+        self.thread = None
+
+
+if __name__ == "__main__":
+    UCIEngine().run()
@@ -1,5 +1,12 @@
+import functools
+import json
+import os
+import struct
+
 import numpy as np
 
+from common.config import BITBOARD_MASK, MOVE_PROMOTION
+
 
 def square_to_position(square: str):
     """
@@ -13,6 +20,14 @@ def square_to_position(square: str):
     return position
 
 
+def position_to_square(position):
+    """
+    Convert a position to a square, e.g. 28 -> "e4".
+    """
+    row, col = divmod(position, 8)
+    return f"{chr(col + 97)}{row + 1}"
+
+
 def rankfile_to_position(rankfile: tuple):
     rank, file = rankfile
     return rank * 8 + file
@@ -28,61 +43,301 @@ def ensure_position(position):
     return position
 
 
+def encode_move(from_position, to_position, promotion=0, flag=0):
+    """
+    Pack a move into an int, e.g. (12, 28) -> 1804.
+
+    :param promotion: index of the promotion piece in PROMOTION_TYPES
+    :param flag: MOVE_NORMAL, MOVE_PROMOTION, MOVE_EN_PASSANT or MOVE_CASTLING
+    """
+    return from_position | to_position << 6 | promotion << 12 | flag << 14
+
+
+def decode_move(move):
+    """Unpack a move into (from, to, promotion, flag), e.g. 1804 -> (12, 28, 0, 0)."""
+    return move & 63, move >> 6 & 63, move >> 12 & 3, move >> 14
+
+
+def move_to_uci(move):
+    """Convert a packed move to UCI notation, e.g. 1804 -> "e2e4"."""
+    from_position, to_position, promotion, flag = decode_move(move)
+    uci = position_to_square(from_position) + position_to_square(to_position)
+    if flag == MOVE_PROMOTION:
+        uci += "nbrq"[promotion]
+    return uci
+
+
+# Single file holding all the lookup tables, written by scripts/make_move_masks.py
+LOOKUP_TABLES_PATH = os.path.join(
+    os.path.dirname(__file__), "lookup_tables", "TABLES.bin"
+)
+LOOKUP_TABLES_MAGIC = b"CHESSTBL"
+LOOKUP_TABLES_VERSION = 1
+# Expected (dtype, shape) of each table, None for lengths that depend on the magics
+LOOKUP_TABLES_FORMAT = {
+    "pawn/white": ("|b1", (64, 64)),
+    "pawn/black": ("|b1", (64, 64)),
+    "pawn/white_attack": ("|b1", (64, 64)),
+    "pawn/black_attack": ("|b1", (64, 64)),
+    "rook": ("|b1", (2, 64, 64)),
+    "bishop": ("|b1", (2, 64, 64)),
+    "knight": ("|b1", (64, 64)),
+    "queen": ("|b1", (4, 64, 64)),
+    "king": ("|b1", (64, 64)),
+    "magic/rook": ("<u8", (64, 4)),
+    "magic/rook_attacks": ("<u8", (None,)),
+    "magic/bishop": ("<u8", (64, 4)),
+    "magic/bishop_attacks": ("<u8", (None,)),
+}
+# Arrays start on cache line boundaries
+LOOKUP_TABLES_ALIGNMENT = 64
+
+
+def save_arrays(path, arrays, magic, version):
+    """
+    Write arrays into one file: the magic bytes, the version and the length of the
+    JSON header as uint32, the header of {name: [dtype, shape, offset]}, then the arrays.
+
+    :param arrays: {name: array}
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header, offset = {}, 0
+    for name, array in arrays.items():
+        header[name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // LOOKUP_TABLES_ALIGNMENT) * LOOKUP_TABLES_ALIGNMENT
+    header = json.dumps(header).encode()
+    prefix_length = len(magic) + 8 + len(header)
+    padding = -prefix_length % LOOKUP_TABLES_ALIGNMENT
+    with open(path, "wb") as file:
+        file.write(magic)
+        file.write(struct.pack("<II", version, len(header) + padding))
+        file.write(header + b" " * padding)
+        for array in arrays.values():
+            file.write(array.tobytes())
+            file.write(b"\0" * (-array.nbytes % LOOKUP_TABLES_ALIGNMENT))
+
+
+def open_arrays(path, magic, version):
+    """
+    Memory-map a file written by save_arrays and check its magic bytes and version.
+    The arrays are read-only views of the mapping, paged in on first access.
+
+    :return: {name: array}
+    """
+    with open(path, "rb") as file:
+        prefix = file.read(len(magic) + 8)
+        if prefix[: len(magic)] != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file.")
+        stored_version, header_length = struct.unpack("<II", prefix[-8:])
+        if stored_version != version:
+            raise ValueError(
+                f"{path} has version {stored_version}, expected {version}."
+            )
+        header = json.loads(file.read(header_length))
+    data_offset = len(prefix) + header_length
+    if not any(np.prod(shape) for _, shape, _ in header.values()):
+        mapping = np.zeros(0, dtype=np.uint8)  # An empty mapping is not allowed
+    else:
+        mapping = np.memmap(path, dtype=np.uint8, mode="r", offset=data_offset)
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=mapping, offset=offset)
+        for name, (dtype, shape, offset) in header.items()
+    }
+
+
+def save_lookup_tables(tables, path=LOOKUP_TABLES_PATH):
+    """
+    Write the lookup tables into one file, see save_arrays.
+
+    :param tables: {name: array} with the names of LOOKUP_TABLES_FORMAT
+    """
+    arrays = {name: tables[name] for name in LOOKUP_TABLES_FORMAT}
+    save_arrays(path, arrays, LOOKUP_TABLES_MAGIC, LOOKUP_TABLES_VERSION)
+
+
+def open_lookup_tables(path=LOOKUP_TABLES_PATH):
+    """
+    Memory-map the tables file and check its version and the dtype and shape of the
+    tables, see open_arrays.
+
+    :return: {name: array}
+    """
+    try:
+        tables = open_arrays(path, LOOKUP_TABLES_MAGIC, LOOKUP_TABLES_VERSION)
+    except ValueError as error:
+        raise ValueError(
+            f"{error} Run python -m scripts.make_move_masks to regenerate it."
+        ) from None
+
+    for name, (dtype, shape) in LOOKUP_TABLES_FORMAT.items():
+        if name not in tables:
+            raise ValueError(f"{path} is missing the table {name}.")
+        table = tables[name]
+        if (
+            table.dtype.str != dtype
+            or table.ndim != len(shape)
+            or any(
+                expected not in [None, size]
+                for expected, size in zip(shape, table.shape)
+            )
+        ):
+            raise ValueError(
+                f"Table {name} of {path} is {table.dtype.str} {table.shape}, "
+                f"expected {dtype} {shape}."
+            )
+    return {name: tables[name] for name in LOOKUP_TABLES_FORMAT}
+
+
+@functools.cache
 def load_chess_move_tables():
-    import numpy as np
+    """
+    Load the move tables, mapped once per process and shared by all the games.
+
+    :return: {piece_type: table}, with the pawn and magic tables in nested dicts
+    """
+    move_tables = {}
+    for name, table in open_lookup_tables().items():
+        group, _, key = name.rpartition("/")
+        if group:
+            move_tables.setdefault(group, {})[key] = table
+        else:
+            move_tables[key] = table
+    return move_tables
+
+
+def pack_bitboards(table):
+    """Pack the last axis of a boolean table into bitboards, e.g. (64, 64) -> [int] * 64."""
+    packed = np.packbits(table, axis=-1, bitorder="little").view("<u8")
+    return packed[..., 0].tolist()
+
+
+@functools.cache
+def load_bitboard_tables():
+    """
+    Convert the move tables into per-square bitboards, once per process.
+
+    Sliders get one magic table per direction pair: the (mask, magic, shift, offset)
+    of each square and the flat list of attack sets, see lookup_slider_attacks.
+    """
+    move_tables = load_chess_move_tables()
+    magic = move_tables["magic"]
+    rook = (
+        [tuple(entry) for entry in magic["rook"].tolist()],
+        magic["rook_attacks"].tolist(),
+    )
+    bishop = (
+        [tuple(entry) for entry in magic["bishop"].tolist()],
+        magic["bishop_attacks"].tolist(),
+    )
 
     return {
         "pawn": {
-            "white": np.load("back_end/lookup_tables/WHITE_PAWN_MOVES.npy"),
-            "black": np.load("back_end/lookup_tables/BLACK_PAWN_MOVES.npy"),
-            "white_attack": np.load("back_end/lookup_tables/WHITE_PAWN_ATTACKS.npy"),
-            "black_attack": np.load("back_end/lookup_tables/BLACK_PAWN_ATTACKS.npy"),
+            name: pack_bitboards(table) for name, table in move_tables["pawn"].items()
         },
-        "rook": np.load("back_end/lookup_tables/ROOK_MOVES.npy"),
-        "bishop": np.load("back_end/lookup_tables/BISHOP_MOVES.npy"),
-        "knight": np.load("back_end/lookup_tables/KNIGHT_MOVES.npy"),
-        "queen": np.load("back_end/lookup_tables/QUEEN_MOVES.npy"),
-        "king": np.load("back_end/lookup_tables/KING_MOVES.npy"),
+        "rook": [rook],
+        "bishop": [bishop],
+        "knight": pack_bitboards(move_tables["knight"]),
+        "queen": [rook, bishop],
+        "king": pack_bitboards(move_tables["king"]),
     }
 
 
-def binary_array_to_int(arr):
-    """Convert a binary array to an integer, e.g. [1, 0, 1] -> 5."""
-    return int("".join(str(int(b)) for b in arr), 2)
+@functools.cache
+def load_attack_arrays():
+    """
+    Convert the move tables into uint64 arrays that can be gathered for many squares
+    at once, once per process.
+    """
+    move_tables = load_chess_move_tables()
+    magic = move_tables["magic"]
+
+    def packed(table):
+        return np.packbits(table, axis=-1, bitorder="little").view("<u8")[:, 0]
 
+    return {
+        "pawn": np.stack(
+            [
+                packed(move_tables["pawn"]["white_attack"]),
+                packed(move_tables["pawn"]["black_attack"]),
+            ]
+        ),
+        "knight": packed(move_tables["knight"]),
+        "king": packed(move_tables["king"]),
+        "rook": (magic["rook"].T.copy(), magic["rook_attacks"]),
+        "bishop": (magic["bishop"].T.copy(), magic["bishop_attacks"]),
+    }
 
-def int_to_binary_array(num, length):
-    """Convert an integer to a binary array, e.g. 5 -> [1, 0, 1]."""
-    return np.array([bool(int(x)) for x in f"{num:0{length}b}"])
 
+def gather_slider_attacks(magic_array, positions, occupied):
+    """Look up the attacks of sliders on an array of positions for the occupied squares."""
+    (masks, magics, shifts, offsets), attacks = magic_array
+    index = (np.uint64(occupied) & masks[positions]) * magics[positions]
+    index >>= shifts[positions]
+    return attacks[offsets[positions] + index]
 
-def reverse_binary_array(arr):
-    """Reverse a binary array, e.g. [1, 1, 0] -> [0, 1, 1]"""
-    return arr[::-1]
 
+def lookup_slider_attacks(magic_table, position, occupied):
+    """Look up the attacks of a slider on a position for the occupied squares."""
+    entries, attacks = magic_table
+    mask, magic, shift, offset = entries[position]
+    return attacks[offset + (((occupied & mask) * magic & BITBOARD_MASK) >> shift)]
 
-def reverse_binary_array_int(num, length):
-    """Reverse an integer's binary representation, e.g. 6 -> [1, 1, 0] -> [0, 1, 1] -> 3"""
-    if num < 0:
-        num = 0
-    return binary_array_to_int(reverse_binary_array(int_to_binary_array(num, length)))
 
+@functools.cache
+def load_between_bitboards():
+    """
+    Get the squares strictly between each pair of positions on a line, once per process.
 
-def compute_line_attacks(o, s):
-    """Compute the line attacks for a slider piece s and occupied squares o.
-    E.g. (o=[1,1,1,0,0,1,0,1], s=[0,0,0,0,0,1,0,0]) -> [0,0,1,1,1,0,1,1]
+    :return: between[from_position][to_position], 0 when they are not on a line
     """
-    o_reverse = o[::-1]
-    s_reverse = s[::-1]
-    o_int = binary_array_to_int(o)
-    s_int = binary_array_to_int(s)
-    o_reverse_int = binary_array_to_int(o_reverse)
-    s_reverse_int = binary_array_to_int(s_reverse)
-    o_2s = o_int - 2 * s_int
-    o_2s_reverse = reverse_binary_array_int(o_reverse_int - 2 * s_reverse_int, len(o))
-    line_attacks = o_2s ^ o_2s_reverse
-    line_attacks = int_to_binary_array(line_attacks, len(o))
-    return line_attacks
+    tables = load_bitboard_tables()
+    between = [[0] * 64 for _ in range(64)]
+    for magic_table in tables["rook"] + tables["bishop"]:
+        for position in range(64):
+            for other in bitboard_to_positions(
+                lookup_slider_attacks(magic_table, position, 0)
+            ):
+                between[position][other] = lookup_slider_attacks(
+                    magic_table, position, 1 << other
+                ) & lookup_slider_attacks(magic_table, other, 1 << position)
+    return between
+
+
+def array_to_bitboard(arr):
+    """Convert a 64-element boolean array to a bitboard, e.g. [1, 0, 1, 0, ...] -> 5."""
+    return pack_bitboards(np.asarray(arr, dtype=bool))
+
+
+def bitboard_to_array(bitboard):
+    """Convert a bitboard to a 64-element boolean array, e.g. 5 -> [1, 0, 1, 0, ...]."""
+    bitboard = np.array([bitboard & BITBOARD_MASK], dtype="<u8")
+    return np.unpackbits(bitboard.view(np.uint8), bitorder="little").astype(bool)
+
+
+def bitboard_to_positions(bitboard):
+    """Get the positions of the set bits of a bitboard, e.g. 5 -> [0, 2]."""
+    positions = []
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        positions.append(lowest_bit.bit_length() - 1)
+        bitboard ^= lowest_bit
+    return positions
+
+
+def popcount(bitboard):
+    """Count the set bits of a bitboard, e.g. 5 -> 2."""
+    return bin(bitboard).count("1")
+
+
+# Set bits of each byte value
+BYTE_POPCOUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)
+
+
+def popcount_array(bitboards):
+    """Count the set bits of each bitboard of a uint64 array, e.g. [5, 7] -> [2, 3]."""
+    bitboards = np.ascontiguousarray(bitboards, dtype="<u8")
+    counts = BYTE_POPCOUNTS[bitboards.view(np.uint8)]
+    return counts.reshape(*bitboards.shape, 8).sum(axis=-1)
 
 
 if __name__ == "__main__":
@@ -90,6 +345,10 @@ if __name__ == "__main__":
         square_to_position("A1") == 0,
         square_to_position("E4") == 28,
         rankfile_to_position((5, 5)) == 45,
+        bitboard_to_positions(array_to_bitboard(bitboard_to_array(5))) == [0, 2],
+        decode_move(encode_move(12, 28)) == (12, 28, 0, 0),
+        move_to_uci(encode_move(12, 28)) == "e2e4",
+        popcount_array(np.array([5, 2**64 - 1], dtype=np.uint64)).tolist() == [2, 64],
     ]
     if all(tests):
         print("Success!")
@@ -21,4 +21,90 @@ PIECE_SYMBOLS = {
     "black_bishop": "♝",
     "black_queen": "♛",
     "black_king": "♚",
-}
\ No newline at end of file
+}
+
+PIECE_COSTS = {
+    "pawn": 1,
+    "knight": 3,
+    "bishop": 3,
+    "rook": 5,
+    "queen": 9,
+    "king": 10000,
+}
+
+COLORS = ["white", "black"]
+PIECE_TYPES = ["pawn", "knight", "bishop", "rook", "queen", "king"]
+# Colors and piece types are small ints internally, indexes of COLORS and PIECE_TYPES
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+# Map both the names and the ints to the ints, e.g. COLOR_INDEX["black"] == COLOR_INDEX[1]
+COLOR_INDEX = {
+    **{color: i for i, color in enumerate(COLORS)},
+    WHITE: WHITE,
+    BLACK: BLACK,
+}
+PIECE_TYPE_INDEX = {
+    **{piece_type: i for i, piece_type in enumerate(PIECE_TYPES)},
+    **{i: i for i in range(len(PIECE_TYPES))},
+}
+# Index of each (color, piece_type) bitboard in Board.bitboards
+BITBOARD_INDEX = {
+    (color, piece_type): i * len(PIECE_TYPES) + j
+    for i, color in enumerate(COLORS)
+    for j, piece_type in enumerate(PIECE_TYPES)
+}
+# Codes of the Board.board mailbox: 0 for an empty square, else the bitboard index + 1
+EMPTY = 0
+PIECE_CODE_COSTS = [0] + [PIECE_COSTS[piece_type] for piece_type in PIECE_TYPES] * 2
+PIECE_CODE_SYMBOLS = ["."] + [
+    PIECE_SYMBOLS[f"{color}_{piece_type}"]
+    for color in COLORS
+    for piece_type in PIECE_TYPES
+]
+
+# Bitboard constants, bit n set <=> square n (A1 = 0, H8 = 63) is set
+BITBOARD_MASK = 0xFFFFFFFFFFFFFFFF
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+
+# Castling right bit -> (color, king position, rook position)
+CASTLING_RIGHTS = [
+    (WHITE, 4, 7),
+    (WHITE, 4, 0),
+    (BLACK, 60, 63),
+    (BLACK, 60, 56),
+]
+# Castling rights kept by a move from or to each position
+CASTLING_RIGHTS_KEPT = [
+    15
+    & ~sum(
+        1 << bit
+        for bit, (_, king_position, rook_position) in enumerate(CASTLING_RIGHTS)
+        if position in [king_position, rook_position]
+    )
+    for position in range(64)
+]
+
+CASTLING_SYMBOLS = "KQkq"  # FEN symbol of each castling right bit
+
+FEN_SYMBOLS = {
+    "P": ("white", "pawn"),
+    "N": ("white", "knight"),
+    "B": ("white", "bishop"),
+    "R": ("white", "rook"),
+    "Q": ("white", "queen"),
+    "K": ("white", "king"),
+    "p": ("black", "pawn"),
+    "n": ("black", "knight"),
+    "b": ("black", "bishop"),
+    "r": ("black", "rook"),
+    "q": ("black", "queen"),
+    "k": ("black", "king"),
+}
+
+# Moves are packed as from | to << 6 | promotion << 12 | flag << 14
+MOVE_NORMAL = 0
+MOVE_PROMOTION = 1
+MOVE_EN_PASSANT = 2
+MOVE_CASTLING = 3
+PROMOTION_TYPES = [KNIGHT, BISHOP, ROOK, QUEEN]
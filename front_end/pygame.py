@@ -0,0 +1,345 @@
+"""
+Pygame front end: play against the engine, or benchmark the rendering headless, e.g.
+
+    python -m front_end.pygame --player white --engine-time-ms 1000
+    python -m front_end.pygame --headless --benchmark 2000
+
+Only the squares that changed since the last frame are redrawn. The legal moves of a
+selected piece are computed by a thread and the engine searches in a process, both
+on copies of the position, so that the event loop never waits for them.
+"""
+
+import argparse
+import collections
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pygame
+
+from back_end.game import ChessGame
+from back_end.search import MAX_PLY, _init_worker, _search_root_moves
+from back_end.transposition import TranspositionTable
+from front_end.utils import (
+    pixel_to_position,
+    position_to_rect,
+    render_piece_sprites,
+    render_square_tiles,
+)
+
+# Events posted by the background work
+HIGHLIGHTS_READY = pygame.event.custom_type()
+ENGINE_MOVE = pygame.event.custom_type()
+# Frames averaged by the frame time overlay
+FRAME_TIME_WINDOW = 60
+
+
+class ChessApp:
+    def __init__(self, game=None, **kwargs):
+        """
+        :param game: ChessGame to display, the starting position by default
+        :param player_color: side of the player, the engine plays the other one, None
+            to play both sides
+        :param square_size: size of a square in pixels
+        :param engine_time_ms: search time of the engine moves
+        :param show_frame_time: draw the frame time overlay
+        :param full_redraw: redraw every square on every frame, to compare with the
+            dirty rectangles
+        """
+        self.game = ChessGame() if game is None else game
+        self.player_color = kwargs.get("player_color", 0)
+        self.square_size = kwargs.get("square_size", 80)
+        self.engine_time_ms = kwargs.get("engine_time_ms", 1000)
+        self.show_frame_time = kwargs.get("show_frame_time", True)
+        self.full_redraw = kwargs.get("full_redraw", False)
+        self.flipped = self.player_color == 1
+
+        pygame.init()
+        size = 8 * self.square_size
+        self.screen = pygame.display.set_mode((size, size))
+        pygame.display.set_caption("Chess")
+        # Rendered once, blitted on every redraw of a square
+        self.tiles = render_square_tiles(self.square_size)
+        self.sprites = render_piece_sprites(self.square_size)
+        self.overlay_font = pygame.font.Font(None, 20)
+        self.overlay_rect = pygame.Rect(0, 0, 0, 0)
+
+        self.drawn = [None] * 64  # State of each square on the screen
+        self.selected = None
+        self.highlights = 0  # Bitboard of the legal targets of the selected piece
+        self.last_move = None
+        self.frame_times = collections.deque(maxlen=FRAME_TIME_WINDOW)
+        self.running = False
+
+        # Legal moves are computed on a copy of the position by one thread
+        self.highlight_executor = ThreadPoolExecutor(1)
+        self.highlight_game = ChessGame()
+        self.highlight_request = 0
+        # The engine searches in a process, so that it does not hold the GIL
+        self.engine_executor = None
+        self.engine_future = None
+        self.transposition_table = None
+
+    def square_state(self, position):
+        """Everything that the pixels of a square depend on."""
+        if position == self.selected:
+            tint = "selected"
+        elif self.highlights >> position & 1:
+            tint = "highlight"
+        elif self.last_move is not None and position in [
+            self.last_move & 63,
+            self.last_move >> 6 & 63,
+        ]:
+            tint = "last_move"
+        else:
+            tint = None
+        return self.game.board.mailbox[position], tint
+
+    def draw_square(self, position, state):
+        code, tint = state
+        rect = position_to_rect(position, self.square_size, self.flipped)
+        is_light = (position // 8 + position % 8) % 2 == 1
+        self.screen.blit(self.tiles[is_light, tint], rect)
+        if code:
+            self.screen.blit(self.sprites[code], rect)
+        return rect
+
+    def render(self):
+        """
+        Redraw the squares whose state changed and the overlay.
+
+        :return: the dirty rectangles
+        """
+        dirty = []
+        for position in range(64):
+            state = self.square_state(position)
+            if self.full_redraw or state != self.drawn[position]:
+                dirty.append(self.draw_square(position, state))
+                self.drawn[position] = state
+        if self.show_frame_time:
+            dirty += self.draw_overlay()
+        return dirty
+
+    def draw_overlay(self):
+        """Draw the mean frame time over the squares it covers, redrawn first."""
+        dirty = []
+        for position in range(64):
+            rect = position_to_rect(position, self.square_size, self.flipped)
+            if rect.colliderect(self.overlay_rect) and self.drawn[position] is not None:
+                dirty.append(self.draw_square(position, self.drawn[position]))
+        frame_time = (
+            sum(self.frame_times) / len(self.frame_times) if self.frame_times else 0.0
+        )
+        text = self.overlay_font.render(
+            f"{frame_time * 1000:.2f} ms/frame", True, (255, 255, 255), (0, 0, 0)
+        )
+        self.overlay_rect = self.screen.blit(text, (2, 2))
+        return dirty + [self.overlay_rect]
+
+    def frame(self):
+        start = time.perf_counter()
+        dirty = self.render()
+        if dirty:
+            pygame.display.update(dirty)
+        self.frame_times.append(time.perf_counter() - start)
+        return len(dirty)
+
+    def select(self, position):
+        """Select a piece and ask for its legal moves in the background."""
+        self.selected = position
+        self.highlights = 0
+        self.highlight_request += 1
+        future = self.highlight_executor.submit(
+            self.compute_highlights,
+            self.game.board.snapshot(),
+            position,
+            self.highlight_request,
+        )
+        future.add_done_callback(post_result(HIGHLIGHTS_READY))
+
+    def compute_highlights(self, snapshot, position, request):
+        """Get the legal targets of a piece, in the highlight thread."""
+        game = self.highlight_game
+        game.board.set_snapshot(snapshot)
+        valid_moves = game.get_valid_moves(position)
+        legal_targets = 0
+        for move in game.generate_legal_moves():
+            if move & 63 == position:
+                legal_targets |= 1 << (move >> 6 & 63)
+        highlights = 0
+        for target in valid_moves.nonzero()[0].tolist():
+            highlights |= legal_targets & 1 << target
+        return {"request": request, "highlights": highlights}
+
+    def click(self, position):
+        board = self.game.board
+        if position is None or self.engine_future is not None:
+            return
+        if self.selected is not None and self.highlights >> position & 1:
+            # Pawn moves list the queen promotion first, see Pawn.write_moves
+            move = next(
+                move
+                for move in self.game.generate_legal_moves()
+                if move & 63 == self.selected and move >> 6 & 63 == position
+            )
+            self.play(move)
+            return
+        code = board.mailbox[position]
+        if code and (code - 1) // 6 == board.turn and board.turn != self.engine_color:
+            self.select(position)
+        else:
+            self.selected, self.highlights = None, 0
+
+    @property
+    def engine_color(self):
+        return None if self.player_color is None else self.player_color ^ 1
+
+    def play(self, move):
+        self.game.board.make_move(move)
+        self.last_move = move
+        self.selected, self.highlights = None, 0
+        self.highlight_request += 1  # Drop the highlights still in flight
+        if self.game.board.turn == self.engine_color:
+            self.start_engine()
+
+    def start_engine(self):
+        """Search the engine move in the engine process."""
+        if not self.game.generate_legal_moves():
+            return
+        if self.engine_executor is None:
+            self.transposition_table = TranspositionTable(64, shared=True)
+            self.engine_executor = ProcessPoolExecutor(
+                1,
+                initializer=_init_worker,
+                initargs=(
+                    self.transposition_table.name,
+                    self.transposition_table.size_mb,
+                ),
+            )
+        self.transposition_table.new_search()
+        self.engine_future = self.engine_executor.submit(
+            _search_root_moves,
+            self.game.board.snapshot(),
+            None,
+            self.engine_time_ms,
+            None,
+            MAX_PLY,
+            self.transposition_table.generation,
+        )
+        self.engine_future.add_done_callback(post_result(ENGINE_MOVE))
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            self.running = False
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.click(pixel_to_position(*event.pos, self.square_size, self.flipped))
+        elif event.type == HIGHLIGHTS_READY:
+            result = event.result
+            if result["request"] == self.highlight_request:
+                self.highlights = result["highlights"]
+        elif event.type == ENGINE_MOVE:
+            self.engine_future = None
+            move, _ = event.result
+            if move is not None:
+                self.play(move)
+        elif event.type == pygame.WINDOWEXPOSED:
+            self.drawn = [None] * 64
+
+    def run(self):
+        """Run the event loop until the window is closed."""
+        self.running = True
+        if self.game.board.turn == self.engine_color:
+            self.start_engine()
+        try:
+            while self.running:
+                self.frame()
+                # Sleep until an event, waking up to refresh the overlay
+                events = [pygame.event.wait(250 if self.show_frame_time else 0)]
+                events += pygame.event.get()
+                for event in events:
+                    self.handle_event(event)
+        finally:
+            self.close()
+
+    def benchmark(self, frames, seed=0):
+        """
+        Render frames with a random legal move or selection between them.
+
+        :return: frames per second
+        """
+        rng = random.Random(seed)
+        start_snapshot = self.game.board.snapshot()
+        start = time.perf_counter()
+        for _ in range(frames):
+            moves = self.game.generate_legal_moves()
+            if not moves or len(self.game.board.history) >= 200:
+                self.game.board.set_snapshot(start_snapshot)
+                moves = self.game.generate_legal_moves()
+            move = rng.choice(moves)
+            if rng.random() < 0.5:
+                # Highlight the targets of the piece in place of the background thread
+                self.selected = move & 63
+                self.highlights = 0
+                for other in moves:
+                    if other & 63 == self.selected:
+                        self.highlights |= 1 << (other >> 6 & 63)
+            else:
+                self.game.board.make_move(move)
+                self.last_move = move
+                self.selected, self.highlights = None, 0
+            self.frame()
+            pygame.event.pump()
+        return frames / (time.perf_counter() - start)
+
+    def close(self):
+        self.highlight_executor.shutdown(cancel_futures=True)
+        if self.engine_executor is not None:
+            self.engine_executor.shutdown(cancel_futures=True)
+            self.transposition_table.close()
+            self.engine_executor = None
+        pygame.quit()
+
+
+def post_result(event_type):
+    """Callback of a future that posts its result to the event loop."""
+
+    def callback(future):
+        if not future.cancelled() and pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(event_type, result=future.result()))
+
+    return callback
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play chess against the engine")
+    parser.add_argument("--fen", help="Starting position, the usual one by default")
+    parser.add_argument("--player", choices=["white", "black", "both"], default="white")
+    parser.add_argument("--engine-time-ms", type=int, default=1000)
+    parser.add_argument("--square-size", type=int, default=80)
+    parser.add_argument("--headless", action="store_true", help="No window (SDL dummy)")
+    parser.add_argument(
+        "--benchmark", type=int, help="Render this many frames and exit"
+    )
+    parser.add_argument("--full-redraw", action="store_true")
+    args = parser.parse_args()
+
+    if args.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    app = ChessApp(
+        ChessGame() if args.fen is None else ChessGame(fen=args.fen),
+        player_color={"white": 0, "black": 1, "both": None}[args.player],
+        square_size=args.square_size,
+        engine_time_ms=args.engine_time_ms,
+        full_redraw=args.full_redraw,
+    )
+    if args.benchmark:
+        fps = app.benchmark(args.benchmark)
+        mean_frame_time = sum(app.frame_times) / len(app.frame_times)
+        print(
+            f"{args.benchmark} frames, {fps:,.0f} frames/s, "
+            f"{mean_frame_time * 1000:.3f} ms rendering per frame"
+        )
+        app.close()
+    else:
+        app.run()
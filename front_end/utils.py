@@ -0,0 +1,98 @@
+import pygame
+
+from common.config import PIECE_CODE_SYMBOLS, PIECE_TYPES, WHITE
+from back_end.fen import FEN_CODE_SYMBOLS
+
+LIGHT_SQUARE = (240, 217, 181)
+DARK_SQUARE = (181, 136, 99)
+# Tints of the squares, blended into the light and dark colors
+SQUARE_TINTS = {
+    "last_move": (205, 210, 106),
+    "selected": (246, 246, 105),
+    "highlight": (106, 168, 79),
+}
+SQUARE_STATES = [None] + list(SQUARE_TINTS)
+# Fonts tried for the chess symbols, the FEN letters are drawn when none has them
+SYMBOL_FONTS = "dejavusans,segoeuisymbol,notosanssymbols2,freeserif,symbola"
+
+
+def position_to_rect(position, square_size, flipped=False):
+    """Get the screen rectangle of a position, A1 bottom left unless flipped."""
+    row, col = divmod(position, 8)
+    if flipped:
+        row, col = 7 - row, 7 - col
+    return pygame.Rect(
+        col * square_size, (7 - row) * square_size, square_size, square_size
+    )
+
+
+def pixel_to_position(x, y, square_size, flipped=False):
+    """Get the position under a pixel, None outside the board."""
+    col, row = x // square_size, 7 - y // square_size
+    if not (0 <= col < 8 and 0 <= row < 8):
+        return None
+    if flipped:
+        row, col = 7 - row, 7 - col
+    return row * 8 + col
+
+
+def blend(color, tint, alpha=0.5):
+    return tuple(round(c * (1 - alpha) + t * alpha) for c, t in zip(color, tint))
+
+
+def render_square_tiles(square_size):
+    """
+    Render the background of a square once per color and state.
+
+    :return: {(is_light, state): surface}, see SQUARE_STATES
+    """
+    tiles = {}
+    for is_light, color in [(True, LIGHT_SQUARE), (False, DARK_SQUARE)]:
+        for state in SQUARE_STATES:
+            tile = pygame.Surface((square_size, square_size))
+            tile.fill(color if state is None else blend(color, SQUARE_TINTS[state]))
+            tiles[is_light, state] = tile
+    return tiles
+
+
+def load_symbol_font(size):
+    """Get a font with the chess symbols, None when no installed font has them."""
+    font = pygame.font.SysFont(SYMBOL_FONTS, size)
+    if all(font.metrics(symbol)[0] is not None for symbol in PIECE_CODE_SYMBOLS[1:]):
+        return font
+    return None
+
+
+def render_piece_sprites(square_size):
+    """
+    Render the sprite of each piece code once, with the chess symbols of an installed
+    font, else with the FEN letters on discs.
+
+    :return: list of surfaces indexed by piece code, None for an empty square
+    """
+    font = load_symbol_font(int(square_size * 0.8))
+    letter_font = pygame.font.Font(None, int(square_size * 0.6))
+    sprites = [None]
+    for code in range(1, len(PIECE_CODE_SYMBOLS)):
+        color, piece_type = divmod(code - 1, len(PIECE_TYPES))
+        fill, ink = ((255, 255, 255), (0, 0, 0))
+        if color != WHITE:
+            fill, ink = ink, fill
+        sprite = pygame.Surface((square_size, square_size), pygame.SRCALPHA)
+        center = (square_size // 2, square_size // 2)
+        if font is not None:
+            # The filled symbols of the black pieces, outlined for the white pieces
+            filled = font.render(PIECE_CODE_SYMBOLS[code + 6 * (1 - color)], True, fill)
+            sprite.blit(filled, filled.get_rect(center=center))
+            if color == WHITE:
+                outline = font.render(PIECE_CODE_SYMBOLS[code], True, ink)
+                sprite.blit(outline, outline.get_rect(center=center))
+        else:
+            pygame.draw.circle(sprite, fill, center, square_size * 0.38)
+            pygame.draw.circle(sprite, ink, center, square_size * 0.38, 2)
+            letter = letter_font.render(FEN_CODE_SYMBOLS[code].upper(), True, ink)
+            sprite.blit(letter, letter.get_rect(center=center))
+        sprites.append(
+            sprite.convert_alpha() if pygame.display.get_surface() else sprite
+        )
+    return sprites
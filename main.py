@@ -1,8 +1,22 @@
 import os
+import sys
 from back_end.game import ChessGame
+from back_end.utils import square_to_position
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["uci"]:
+        # Speak UCI on stdin and stdout, e.g. for a GUI or a tournament runner
+        from back_end.uci import UCIEngine
+
+        UCIEngine().run()
+        sys.exit()
+
     os.system("cls" if os.name == "nt" else "clear")
-    game = ChessGame(player_color="white")
-    game.get_valid_moves(2 * 8 + 4)
-    
\ No newline at end of file
+    # After 1. e4 e5 the queen on D1 can move along the E2-H5 diagonal
+    game = ChessGame(
+        player_color="white",
+        fen="rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2",
+    )
+    valid_moves = game.get_valid_moves(square_to_position("d1"))
+    game.board.print_bool(valid_moves)
+    print(game.board)
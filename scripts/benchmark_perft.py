@@ -0,0 +1,94 @@
+"""
+This script runs perft on the reference positions of back_end/perft.py, checks the node counts and reports the nodes per second.
+With --phases it also reports where the time goes: the move generation of each Moves subclass, make/unmake and the check test.
+With --divide it prints the node count below each root move, to localize a move generation bug.
+
+Run it from the repository root, e.g. python -m scripts.benchmark_perft --phases
+"""
+
+import argparse
+import sys
+import time
+
+from back_end.board import Board
+from back_end.game import ChessGame
+from back_end.moves import Pawn, Knight, Slider, King
+from back_end.perft import REFERENCE_POSITIONS, DEFAULT_DEPTHS, run_reference_perft
+from back_end.profiling import profile
+
+# Move generation of each Moves subclass, make/unmake and the check test
+PHASE_TARGETS = [
+    (cls, "write_moves", cls.__name__) for cls in [Pawn, Knight, Slider, King]
+] + [
+    (Board, "make_move", "make_move"),
+    (Board, "unmake_move", "unmake_move"),
+    (ChessGame, "is_in_check", "is_in_check"),
+]
+
+
+def print_phases(stats):
+    print(f"\n{'phase':<16}{'calls':>12}{'time':>10}{'share':>8}")
+    methods = sorted(stats["methods"].items(), key=lambda x: -x[1]["seconds"])
+    for label, method in methods:
+        print(
+            f"{label:<16}{method['calls']:>12,}{method['seconds']:>9.2f}s"
+            f"{method['share']:>8.1%}"
+        )
+    print(
+        "Shares overlap: make/unmake and is_in_check also run inside the legality test."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("positions", nargs="*", default=list(DEFAULT_DEPTHS))
+    parser.add_argument("--depth", type=int, help="Override the default depths")
+    parser.add_argument("--divide", action="store_true")
+    parser.add_argument("--phases", action="store_true")
+    args = parser.parse_args()
+
+    unknown = set(args.positions) - set(REFERENCE_POSITIONS)
+    if unknown:
+        parser.error(
+            f"Unknown positions {sorted(unknown)}, use {list(REFERENCE_POSITIONS)}"
+        )
+
+    if args.divide:
+        for name in args.positions:
+            nodes, expected = run_reference_perft(name, args.depth, divide=True)
+            print(f"{name} ({REFERENCE_POSITIONS[name][0]})")
+            for move, count in sorted(nodes.items()):
+                print(f"{move}: {count}")
+            print(f"total: {sum(nodes.values())} expected: {expected}\n")
+        sys.exit(0)
+
+    failed = False
+    total_nodes, total_time = 0, 0.0
+    print(
+        f"{'position':<20}{'depth':>6}{'nodes':>12}{'expected':>12}{'time':>9}{'nodes/s':>11}"
+    )
+    for name in args.positions:
+        depth = DEFAULT_DEPTHS[name] if args.depth is None else args.depth
+        start = time.perf_counter()
+        nodes, expected = run_reference_perft(name, depth)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+        status = "" if expected in [None, nodes] else "  MISMATCH"
+        failed |= bool(status)
+        expected = "?" if expected is None else f"{expected:,}"
+        print(
+            f"{name:<20}{depth:>6}{nodes:>12,}{expected:>12}"
+            f"{elapsed:>8.2f}s{nodes / elapsed:>11,.0f}{status}"
+        )
+    print(
+        f"{'total':<26}{total_nodes:>12,}{'':>12}{total_time:>8.2f}s{total_nodes / total_time:>11,.0f}"
+    )
+
+    if args.phases:
+        with profile(PHASE_TARGETS) as profiler:
+            for name in args.positions:
+                run_reference_perft(name, args.depth)
+        print_phases(profiler.to_dict())
+
+    sys.exit(1 if failed else 0)
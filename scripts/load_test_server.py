@@ -0,0 +1,130 @@
+"""
+This script load tests the game server of back_end/server.py: concurrent clients each create a session and play random legal moves, asking for an engine reply after each.
+It reports the p50/p99 latency of the moves with and without an engine reply, and the requests rejected by the backpressure of the server.
+Without --port it starts a server in the process, on a free port.
+
+Run it from the repository root, e.g. python -m scripts.load_test_server --clients 32 --moves 10
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from back_end.server import GameServer
+
+
+async def request(reader, writer, method, path, body=None):
+    """Send a request on a keep-alive connection, return (status, JSON response)."""
+    payload = b"" if body is None else json.dumps(body).encode()
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in [b"\r\n", b""]:
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            content_length = int(value)
+    return status, json.loads(await reader.readexactly(content_length))
+
+
+async def play(host, port, moves, time_ms, latencies, rejected, rng):
+    """Play a game of up to moves moves against the engine."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        _, state = await request(reader, writer, "POST", "/sessions", {})
+        path = f"/sessions/{state['session']}"
+        for ply in range(moves):
+            if state["result"] or not state["legal_moves"]:
+                break
+            # Every other move without a reply times the event loop alone
+            reply = ply % 2 == 0
+            body = {
+                "move": rng.choice(state["legal_moves"]),
+                "reply": reply,
+                "time_ms": time_ms,
+            }
+            start = time.perf_counter()
+            status, response = await request(
+                reader, writer, "POST", f"{path}/move", body
+            )
+            latencies["reply" if reply else "move"].append(time.perf_counter() - start)
+            if status == 503:
+                # The move was played but the engine did not reply, let it search
+                rejected.append(path)
+                while status == 503:
+                    await asyncio.sleep(0.05)
+                    status, response = await request(
+                        reader, writer, "POST", f"{path}/go", {"time_ms": time_ms}
+                    )
+            if status != 200:
+                break
+            state = response
+        await request(reader, writer, "DELETE", path)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def print_latencies(latencies):
+    print(f"{'request':<10}{'count':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+    for label, values in latencies.items():
+        if not values:
+            continue
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        print(
+            f"{label:<10}{len(values):>8}{p50:>8.1f}ms{p99:>8.1f}ms"
+            f"{max(values) * 1000:>8.1f}ms"
+        )
+
+
+async def main(args):
+    server = None
+    host, port = args.host, args.port
+    if port is None:
+        server = GameServer(
+            search_workers=args.search_workers, max_pending=args.max_pending
+        )
+        host, port = await server.start(host, 0)
+    latencies = {"move": [], "reply": []}
+    rejected = []
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *[
+                play(host, port, args.moves, args.time_ms, latencies, rejected, rng)
+                for _ in range(args.clients)
+            ]
+        )
+    finally:
+        elapsed = time.perf_counter() - start
+        if server is not None:
+            await server.close()
+    print(
+        f"{args.clients} clients, {sum(map(len, latencies.values()))} moves "
+        f"in {elapsed:.2f}s, {len(rejected)} engine replies rejected with 503"
+    )
+    print_latencies(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port of a running server")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--moves", type=int, default=10)
+    parser.add_argument("--time-ms", type=int, default=50, help="Engine time per reply")
+    parser.add_argument("--search-workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,10 +1,17 @@
 """
-This script creates the move masks for the chess pieces at any of the 64 positions on the board and saves them as .npy files.
+This script creates the move masks for the chess pieces at any of the 64 positions on the board and saves them into the lookup tables file back_end/lookup_tables/TABLES.bin.
 The move masks are constant and can be loaded into memory at the start of the game as lookup tables instead of being calculated every time.
+It also searches the magic numbers of the rooks and bishops, so that their attacks for any occupancy are a mask, a multiply and an index away.
+
+Run it from the repository root: python -m scripts.make_move_masks
 """
 
+import random
+
 import numpy as np
 
+from back_end.utils import save_lookup_tables
+
 
 def print_board(board):
     board_array = board
@@ -31,7 +38,7 @@ def get_line_attacks_mask(position, direction):
         attack_mask[row, col] = True
         row += direction[0]
         col += direction[1]
-    
+
     # Negative direction
     row, col = divmod(position, 8)
     while row >= 0 and row < 8 and col >= 0 and col < 8:
@@ -80,35 +87,17 @@ def get_pawn_attacks_mask(position, color):
     row, col = divmod(position, 8)
     attack_mask = np.zeros(64, dtype=bool)
     if color == "white":
-        if row > 0:
-            if col > 0:
-                attack_mask[(row - 1) * 8 + col - 1] = True
-            if col < 7:
-                attack_mask[(row - 1) * 8 + col + 1] = True
-    else:
         if row < 7:
             if col > 0:
                 attack_mask[(row + 1) * 8 + col - 1] = True
             if col < 7:
                 attack_mask[(row + 1) * 8 + col + 1] = True
-    return attack_mask
-
-
-def get_pawn_attacks_mask(position, color):
-    row, col = divmod(position, 8)
-    attack_mask = np.zeros(64, dtype=bool)
-    if color == "white":
+    else:
         if row > 0:
             if col > 0:
                 attack_mask[(row - 1) * 8 + col - 1] = True
             if col < 7:
                 attack_mask[(row - 1) * 8 + col + 1] = True
-    else:
-        if row < 7:
-            if col > 0:
-                attack_mask[(row + 1) * 8 + col - 1] = True
-            if col < 7:
-                attack_mask[(row + 1) * 8 + col + 1] = True
     return attack_mask
 
 
@@ -116,19 +105,104 @@ def get_pawn_move_mask(position, color):
     row, col = divmod(position, 8)
     move_mask = np.zeros(64, dtype=bool)
     if color == "white":
-        if row > 0:
-            move_mask[(row - 1) * 8 + col] = True
-            if row == 6:
-                move_mask[(row - 2) * 8 + col] = True
-
-    else:
         if row < 7:
             move_mask[(row + 1) * 8 + col] = True
             if row == 1:
                 move_mask[(row + 2) * 8 + col] = True
+
+    else:
+        if row > 0:
+            move_mask[(row - 1) * 8 + col] = True
+            if row == 6:
+                move_mask[(row - 2) * 8 + col] = True
     return move_mask
 
 
+def get_slider_attacks(position, occupied, directions):
+    """Computes the attacked squares of a slider, each ray stops at its first blocker."""
+    attacks = 0
+    row, col = divmod(position, 8)
+    for direction in directions:
+        for sign in [1, -1]:
+            r, c = row + sign * direction[0], col + sign * direction[1]
+            while r >= 0 and r < 8 and c >= 0 and c < 8:
+                attacks |= 1 << (r * 8 + c)
+                if occupied >> (r * 8 + c) & 1:
+                    break
+                r += sign * direction[0]
+                c += sign * direction[1]
+    return attacks
+
+
+def get_relevant_occupancy_mask(position, directions):
+    """Computes the squares whose occupancy changes the slider attacks, i.e. the rays without their last square."""
+    mask = 0
+    row, col = divmod(position, 8)
+    for direction in directions:
+        for sign in [1, -1]:
+            dr, dc = sign * direction[0], sign * direction[1]
+            r, c = row + dr, col + dc
+            while r + dr >= 0 and r + dr < 8 and c + dc >= 0 and c + dc < 8:
+                mask |= 1 << (r * 8 + c)
+                r += dr
+                c += dc
+    return mask
+
+
+def get_occupancy_subsets(mask):
+    """Enumerates all the subsets of a mask (Carry-Rippler trick)."""
+    subsets = [0]
+    subset = (0 - mask) & mask
+    while subset:
+        subsets.append(subset)
+        subset = (subset - mask) & mask
+    return subsets
+
+
+def find_magic(position, directions, rng):
+    """
+    Finds a magic number that maps every relevant occupancy of a square to a unique attack set.
+
+    :return: (mask, magic, shift, attack table), attacks = table[((occupied & mask) * magic) >> shift]
+    """
+    mask = get_relevant_occupancy_mask(position, directions)
+    bits = bin(mask).count("1")
+    shift = 64 - bits
+    subsets = get_occupancy_subsets(mask)
+    occupancies = np.array(subsets, dtype=np.uint64)
+    attacks = np.array(
+        [get_slider_attacks(position, subset, directions) for subset in subsets],
+        dtype=np.uint64,
+    )
+    while True:
+        # Sparse candidates are far more likely to be magic
+        magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        if bin((mask * magic) & 0xFF00000000000000).count("1") < 6:
+            continue
+        index = (occupancies * np.uint64(magic)) >> np.uint64(shift)
+        table = np.zeros(1 << bits, dtype=np.uint64)
+        table[index] = attacks
+        if (table[index] == attacks).all():
+            return mask, magic, shift, table
+
+
+def get_magic_tables(directions, rng):
+    """
+    Finds the magic numbers of a slider for all 64 squares.
+
+    :return: (64, 4) array of (mask, magic, shift, offset) and the concatenated attack tables
+    """
+    magics = np.zeros((64, 4), dtype=np.uint64)
+    tables = []
+    offset = 0
+    for position in range(64):
+        mask, magic, shift, table = find_magic(position, directions, rng)
+        magics[position] = [mask, magic, shift, offset]
+        tables.append(table)
+        offset += len(table)
+    return magics, np.concatenate(tables)
+
+
 if __name__ == "__main__":
     import os
 
@@ -159,12 +233,23 @@ if __name__ == "__main__":
         BLACK_PAWN_ATTACKS[i] = get_pawn_attacks_mask(i, color="black")
     if not os.path.exists("back_end/lookup_tables"):
         os.makedirs("back_end/lookup_tables")
-    np.save("back_end/lookup_tables/ROOK_MOVES.npy", ROOK_MOVES)
-    np.save("back_end/lookup_tables/BISHOP_MOVES.npy", BISHOP_MOVES)
-    np.save("back_end/lookup_tables/QUEEN_MOVES.npy", QUEEN_MOVES)
-    np.save("back_end/lookup_tables/KNIGHT_MOVES.npy", KNIGHT_MOVES)
-    np.save("back_end/lookup_tables/KING_MOVES.npy", KING_MOVES)
-    np.save("back_end/lookup_tables/WHITE_PAWN_MOVES.npy", WHITE_PAWN_MOVES)
-    np.save("back_end/lookup_tables/WHITE_PAWN_ATTACKS.npy", WHITE_PAWN_ATTACKS)
-    np.save("back_end/lookup_tables/BLACK_PAWN_MOVES.npy", BLACK_PAWN_MOVES)
-    np.save("back_end/lookup_tables/BLACK_PAWN_ATTACKS.npy", BLACK_PAWN_ATTACKS)
+    rng = random.Random(0)
+    ROOK_MAGICS, ROOK_MAGIC_ATTACKS = get_magic_tables(rook_directions, rng)
+    BISHOP_MAGICS, BISHOP_MAGIC_ATTACKS = get_magic_tables(bishop_directions, rng)
+    save_lookup_tables(
+        {
+            "pawn/white": WHITE_PAWN_MOVES,
+            "pawn/black": BLACK_PAWN_MOVES,
+            "pawn/white_attack": WHITE_PAWN_ATTACKS,
+            "pawn/black_attack": BLACK_PAWN_ATTACKS,
+            "rook": ROOK_MOVES,
+            "bishop": BISHOP_MOVES,
+            "knight": KNIGHT_MOVES,
+            "queen": QUEEN_MOVES,
+            "king": KING_MOVES,
+            "magic/rook": ROOK_MAGICS,
+            "magic/rook_attacks": ROOK_MAGIC_ATTACKS,
+            "magic/bishop": BISHOP_MAGICS,
+            "magic/bishop_attacks": BISHOP_MAGIC_ATTACKS,
+        }
+    )
@@ -0,0 +1,37 @@
+"""
+This script builds the opening book back_end/lookup_tables/BOOK.bin from PGN files, see back_end/book.py.
+The moves of the first plies of each game are weighted by the result of the game, 2 for a win and 1 for a draw, and summed per position.
+
+Run it from the repository root, e.g. python -m scripts.make_opening_book games.pgn --max-ply 16
+"""
+
+import argparse
+import itertools
+import time
+
+from back_end.book import BOOK_PATH, OpeningBook, build_book, save_book
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("pgn_files", nargs="+")
+    parser.add_argument("--output", default=BOOK_PATH)
+    parser.add_argument("--max-ply", type=int, default=20)
+    parser.add_argument("--min-weight", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    files = [open(path, encoding="utf-8", errors="replace") for path in args.pgn_files]
+    try:
+        book = build_book(
+            itertools.chain.from_iterable(files), args.max_ply, args.min_weight
+        )
+    finally:
+        for file in files:
+            file.close()
+    save_book(book, args.output)
+
+    positions = len(set(book["keys"].tolist()))
+    print(
+        f"{len(OpeningBook(args.output))} moves of {positions} positions written to "
+        f"{args.output} in {time.perf_counter() - start:.2f}s"
+    )
@@ -0,0 +1,485 @@
+"""
+This script builds the endgame tables of back_end/tablebase.py, e.g. KQvK, KRvK and KPvK, into back_end/lookup_tables/tablebases.
+Every position of a signature is solved by retrograde analysis: the mates first, then the positions that win by moving into a loss in n - 1 plies or lose by moving into wins only, for n = 1, 2, ... until nothing changes.
+Each pass handles the position index space in chunks across processes with numpy, the tables in shared memory are updated between the passes.
+The tables reached by captures and promotions are built first, e.g. KQvK and KRvK for KPvK.
+
+Run it from the repository root, e.g. python -m scripts.make_tablebases KQvK KRvK KPvK --processes 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from back_end.tablebase import (
+    TABLEBASES_PATH,
+    TABLEBASE_MAGIC,
+    TABLEBASE_VERSION,
+    ILLEGAL,
+    LOSS,
+    DRAW,
+    WIN,
+    MAX_DTM,
+    SIGNATURE_TYPES,
+    SIGNATURE_LETTERS,
+    INSUFFICIENT_MATERIAL,
+    normalize_signature,
+    position_index,
+    table_path,
+)
+from back_end.utils import (
+    load_between_bitboards,
+    load_chess_move_tables,
+    open_arrays,
+    save_arrays,
+)
+from common.config import WHITE, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+LETTER_TYPES = dict(zip(SIGNATURE_LETTERS, SIGNATURE_TYPES))
+PROMOTION_TYPES = [QUEEN, ROOK, BISHOP, KNIGHT]
+SLIDER_TYPES = [BISHOP, ROOK, QUEEN]
+
+
+def parse_signature(signature):
+    """
+    Get the pieces of a signature in the order of its index, e.g. KQvK ->
+    [(WHITE, KING), (WHITE, QUEEN), (BLACK, KING)].
+    """
+    sides = signature.split("v")
+    if (
+        len(sides) != 2
+        or any(side[:1] != "K" or "K" in side[1:] for side in sides)
+        or any(letter not in LETTER_TYPES for letter in "".join(sides))
+        or normalize_signature(*sides)[0] != signature
+    ):
+        raise ValueError(f"Invalid signature {signature}, e.g. KQvK or KRvKP")
+    return [
+        (color, LETTER_TYPES[letter])
+        for color, side in enumerate(sides)
+        for letter in side
+    ]
+
+
+def canonical_pieces(pieces):
+    """
+    Get the signature of a list of pieces.
+
+    :return: (signature, whether the colors are swapped in it, order of the pieces in
+        the signature)
+    """
+    sides = [
+        sorted(
+            (i for i, (color, _) in enumerate(pieces) if color == side),
+            key=lambda i: SIGNATURE_TYPES.index(pieces[i][1]),
+        )
+        for side in [0, 1]
+    ]
+    letters = [
+        "".join(SIGNATURE_LETTERS[SIGNATURE_TYPES.index(pieces[i][1])] for i in side)
+        for side in sides
+    ]
+    signature, flipped = normalize_signature(*letters)
+    order = sides[1] + sides[0] if flipped else sides[0] + sides[1]
+    return signature, flipped, order
+
+
+def dependencies(signature):
+    """Signatures reached from a signature by a capture and/or a promotion."""
+    pieces = parse_signature(signature)
+    reached = set()
+    for moving, (color, piece_type) in enumerate(pieces):
+        promotions = PROMOTION_TYPES if piece_type == PAWN else []
+        captures = [
+            captured
+            for captured, (other, other_type) in enumerate(pieces)
+            if other != color and other_type != KING
+        ]
+        for promotion in [None] + promotions:
+            for captured in [None] + captures:
+                if promotion is None and captured is None:
+                    continue
+                after = list(pieces)
+                if promotion is not None:
+                    after[moving] = (color, promotion)
+                if captured is not None:
+                    del after[captured]
+                reached.add(canonical_pieces(after)[0])
+    return reached
+
+
+def load_unpacked(signature, path):
+    """Load a table written by this script, with its wdl unpacked to a byte per position."""
+    tables = open_arrays(
+        table_path(signature, path), TABLEBASE_MAGIC, TABLEBASE_VERSION
+    )
+    wdl = tables["wdl"][:, None] >> np.arange(0, 8, 2, dtype=np.uint8) & 3
+    return wdl.reshape(-1), tables["dtm"]
+
+
+def load_move_arrays():
+    """
+    Get the (64, 64) boolean reach of each piece type on an empty board, the pawn
+    attacks of each color and the squares between two squares as uint64.
+    """
+    move_tables = load_chess_move_tables()
+    not_self = ~np.eye(64, dtype=bool)
+    rook = move_tables["rook"].any(axis=0) & not_self
+    bishop = move_tables["bishop"].any(axis=0) & not_self
+    reach = {
+        KING: move_tables["king"].astype(bool),
+        KNIGHT: move_tables["knight"].astype(bool),
+        BISHOP: bishop,
+        ROOK: rook,
+        QUEEN: rook | bishop,
+    }
+    # Reachable squares of each piece type and square, padded with -1
+    targets = {}
+    for piece_type, table in reach.items():
+        width = table.sum(axis=1).max()
+        targets[piece_type] = np.full((64, width), -1, dtype=np.int64)
+        for position in range(64):
+            squares = np.flatnonzero(table[position])
+            targets[piece_type][position, : len(squares)] = squares
+    pawn_attacks = [
+        move_tables["pawn"]["white_attack"].astype(bool),
+        move_tables["pawn"]["black_attack"].astype(bool),
+    ]
+    between = np.array(load_between_bitboards(), dtype=np.uint64)
+    return reach, targets, pawn_attacks, between
+
+
+def bit_is_set(bitboards, squares):
+    return (bitboards >> squares.astype(np.uint64)) & np.uint64(1) != 0
+
+
+def occupancy(squares):
+    return np.bitwise_or.reduce(
+        np.uint64(1) << squares.astype(np.uint64), axis=1, dtype=np.uint64
+    )
+
+
+def attacks(piece, from_squares, to_squares, occupied):
+    """Check whether pieces of a (color, type) on squares attack other squares."""
+    color, piece_type = piece
+    if piece_type == PAWN:
+        return _worker["pawn_attacks"][color][from_squares, to_squares]
+    attacked = _worker["reach"][piece_type][from_squares, to_squares]
+    if piece_type in SLIDER_TYPES:
+        blockers = _worker["between"][from_squares, to_squares] & occupied
+        attacked &= blockers == 0
+    return attacked
+
+
+def is_attacked(pieces, squares, occupied, target, color):
+    """Check whether the piece in a column of squares is attacked by a color."""
+    attacked = np.zeros(len(squares), dtype=bool)
+    for column, piece in enumerate(pieces):
+        if piece[0] == color:
+            attacked |= attacks(piece, squares[:, column], squares[:, target], occupied)
+    return attacked
+
+
+def king_column(pieces, color):
+    return pieces.index((color, KING))
+
+
+def lookup(pieces, squares, turn):
+    """
+    Look up positions in the table of their signature.
+
+    :return: (state, dtm) arrays, see back_end/tablebase.py
+    """
+    signature, flipped, order = canonical_pieces(pieces)
+    if signature in INSUFFICIENT_MATERIAL:
+        # Only the legality of the move is left to check, the position is a draw
+        illegal = is_attacked(
+            pieces, squares, occupancy(squares), king_column(pieces, turn ^ 1), turn
+        )
+        state = np.where(illegal, ILLEGAL, DRAW).astype(np.uint8)
+        return state, np.zeros(len(squares), dtype=np.uint8)
+    squares = squares[:, order]
+    if flipped:
+        squares = squares ^ 56
+    index = position_index(turn ^ flipped, [squares[:, i] for i in range(len(order))])
+    state, dtm = _worker["tables"][signature]
+    return state[index], dtm[index]
+
+
+def generate_successors(squares, turn):
+    """
+    Generate the moves of the side to move of positions of the worker's signature.
+
+    :return: generator of (rows of the positions, state, dtm) of the positions after
+        a group of moves
+    """
+    pieces = _worker["pieces"]
+    occupied = occupancy(squares)
+    own = np.zeros(len(squares), dtype=np.uint64)
+    for column, (color, _) in enumerate(pieces):
+        if color == turn:
+            own |= np.uint64(1) << squares[:, column].astype(np.uint64)
+
+    for moving, (color, piece_type) in enumerate(pieces):
+        if color != turn:
+            continue
+        from_squares = squares[:, moving]
+        if piece_type == PAWN:
+            step = 8 if color == WHITE else -8
+            push = from_squares + step
+            targets = np.clip(
+                np.stack([push, push + step, push - 1, push + 1], axis=1), 0, 63
+            )
+            valid = np.zeros(targets.shape, dtype=bool)
+            valid[:, 0] = ~bit_is_set(occupied, push)
+            double_rank = 1 if color == WHITE else 6
+            valid[:, 1] = (
+                valid[:, 0]
+                & (from_squares // 8 == double_rank)
+                & ~bit_is_set(occupied, targets[:, 1])
+            )
+            for column in [2, 3]:
+                valid[:, column] = _worker["pawn_attacks"][color][
+                    from_squares, targets[:, column]
+                ] & bit_is_set(occupied & ~own, targets[:, column])
+        else:
+            targets = _worker["targets"][piece_type][from_squares]
+            valid = targets >= 0
+            targets = np.where(valid, targets, 0)
+            if piece_type in SLIDER_TYPES:
+                blockers = _worker["between"][from_squares[:, None], targets]
+                valid &= blockers & occupied[:, None] == 0
+        valid &= ~bit_is_set(own[:, None], targets)
+
+        rows, columns = np.nonzero(valid)
+        to_squares = targets[rows, columns]
+        after = squares[rows]
+        after[:, moving] = to_squares
+        captured = np.full(len(rows), -1)
+        for column, (other, other_type) in enumerate(pieces):
+            if other != turn and other_type != KING:
+                captured[squares[rows, column] == to_squares] = column
+        promoting = (
+            (to_squares < 8) | (to_squares >= 56)
+            if piece_type == PAWN
+            else np.zeros(len(rows), dtype=bool)
+        )
+
+        for column in [-1] + list(range(len(pieces))):
+            is_group = captured == column
+            if not is_group.any():
+                continue
+            for promotion in [None] + PROMOTION_TYPES:
+                group = is_group & (promoting if promotion else ~promoting)
+                if not group.any():
+                    continue
+                group_pieces = list(pieces)
+                if promotion is not None:
+                    group_pieces[moving] = (color, promotion)
+                group_squares = after[group]
+                if column >= 0:
+                    del group_pieces[column]
+                    group_squares = np.delete(group_squares, column, axis=1)
+                state, dtm = lookup(group_pieces, group_squares, turn ^ 1)
+                yield rows[group], state, dtm
+                if promotion is None and piece_type != PAWN:
+                    break
+
+
+def solve_chunk(start, end, ply):
+    """
+    Run a pass of the retrograde analysis over a range of indices of one side to move.
+
+    :param ply: -1 for the pass that marks the illegal positions, then 0 for the mates
+        and n for the positions won or lost in n plies
+    :return: (indices, states, dtms) of the positions that changed
+    """
+    pieces = _worker["pieces"]
+    piece_count = len(pieces)
+    state, dtm = _worker["tables"][_worker["signature"]]
+    turn = start // 64**piece_count
+    index = np.arange(start, end, dtype=np.int64)
+    index = index[state[start:end] == DRAW]
+    squares = index[:, None] // 64 ** np.arange(piece_count - 1, -1, -1) % 64
+    occupied = occupancy(squares)
+
+    if ply < 0:
+        illegal = is_attacked(
+            pieces, squares, occupied, king_column(pieces, turn ^ 1), turn
+        )
+        for i in range(piece_count):
+            for j in range(i + 1, piece_count):
+                illegal |= squares[:, i] == squares[:, j]
+            if pieces[i][1] == PAWN:
+                illegal |= (squares[:, i] < 8) | (squares[:, i] >= 56)
+        changed = np.flatnonzero(illegal)
+        return index[changed], np.full(len(changed), ILLEGAL, np.uint8), None
+
+    legal_moves = np.zeros(len(index), dtype=np.int64)
+    not_won = np.zeros(len(index), dtype=np.int64)  # Moves into no proven win
+    fastest_loss = np.full(len(index), MAX_DTM + 1, dtype=np.int64)
+    for rows, successor_state, successor_dtm in generate_successors(squares, turn):
+        legal = successor_state != ILLEGAL
+        legal_moves += np.bincount(rows[legal], minlength=len(index))
+        known = successor_dtm <= ply - 1
+        won = legal & (successor_state == WIN) & known
+        not_won += np.bincount(rows[legal & ~won], minlength=len(index))
+        lost = legal & (successor_state == LOSS) & known
+        np.minimum.at(fastest_loss, rows[lost], successor_dtm[lost])
+
+    wins = fastest_loss <= MAX_DTM
+    if ply == 0:
+        in_check = is_attacked(
+            pieces, squares, occupied, king_column(pieces, turn), turn ^ 1
+        )
+        losses = (legal_moves == 0) & in_check
+    else:
+        losses = (legal_moves > 0) & (not_won == 0) & ~wins
+    changed = np.flatnonzero(wins | losses)
+    states = np.where(wins[changed], WIN, LOSS).astype(np.uint8)
+    dtms = np.where(wins[changed], fastest_loss[changed] + 1, ply)
+    return index[changed], states, np.minimum(dtms, MAX_DTM).astype(np.uint8)
+
+
+_worker = {}  # Tables of a worker process, set by _init_worker
+
+
+def _init_worker(signature, path, state_name, dtm_name):
+    pieces = parse_signature(signature)
+    size = 2 * 64 ** len(pieces)
+    memories = [shared_memory.SharedMemory(name) for name in [state_name, dtm_name]]
+    tables = {
+        signature: tuple(
+            np.ndarray(size, dtype=np.uint8, buffer=memory.buf) for memory in memories
+        )
+    }
+    for dependency in dependencies(signature) - INSUFFICIENT_MATERIAL:
+        tables[dependency] = load_unpacked(dependency, path)
+    reach, targets, pawn_attacks, between = load_move_arrays()
+    _worker.update(
+        signature=signature,
+        pieces=pieces,
+        tables=tables,
+        memories=memories,
+        reach=reach,
+        targets=targets,
+        pawn_attacks=pawn_attacks,
+        between=between,
+    )
+
+
+def build_table(signature, path, processes, chunk_size):
+    """Solve all the positions of a signature and write its table."""
+    size = 2 * 64 ** len(parse_signature(signature))
+    # Longest mate of the tables reached by a capture or a promotion
+    longest_successor_mate = max(
+        [
+            int(load_unpacked(dependency, path)[1].max())
+            for dependency in dependencies(signature) - INSUFFICIENT_MATERIAL
+        ],
+        default=0,
+    )
+    memories = [shared_memory.SharedMemory(create=True, size=size) for _ in range(2)]
+    try:
+        state, dtm = [
+            np.ndarray(size, dtype=np.uint8, buffer=memory.buf) for memory in memories
+        ]
+        state[:] = DRAW
+        dtm[:] = 0
+        # Chunks do not straddle the two sides to move
+        half = size // 2
+        chunks = [
+            (start, min(start + chunk_size, side_start + half))
+            for side_start in [0, half]
+            for start in range(side_start, side_start + half, chunk_size)
+        ]
+        starts, ends = zip(*chunks)
+        with ProcessPoolExecutor(
+            processes,
+            initializer=_init_worker,
+            initargs=(signature, path, memories[0].name, memories[1].name),
+        ) as executor:
+            ply = -1
+            while True:
+                start = time.perf_counter()
+                # Every chunk reads the tables of the previous pass, then they change
+                results = list(
+                    executor.map(solve_chunk, starts, ends, [ply] * len(chunks))
+                )
+                changed = 0
+                for index, states, dtms in results:
+                    state[index] = states
+                    if dtms is not None:
+                        dtm[index] = dtms
+                    changed += len(index)
+                print(
+                    f"{signature} ply {ply:>3}: {changed:>10,} positions solved "
+                    f"in {time.perf_counter() - start:.2f}s"
+                )
+                if ply > longest_successor_mate + 1 and not changed:
+                    break
+                if ply >= MAX_DTM:
+                    raise ValueError(f"{signature} has mates beyond {MAX_DTM} plies")
+                ply += 1
+
+        wdl = state.reshape(-1, 4) << np.arange(0, 8, 2, dtype=np.uint8)
+        save_arrays(
+            table_path(signature, path),
+            {"wdl": np.bitwise_or.reduce(wdl, axis=1), "dtm": dtm},
+            TABLEBASE_MAGIC,
+            TABLEBASE_VERSION,
+        )
+        counts = np.bincount(state, minlength=4)
+        print(
+            f"{signature}: {counts[WIN]:,} wins, {counts[DRAW]:,} draws, "
+            f"{counts[LOSS]:,} losses, {counts[ILLEGAL]:,} illegal positions, "
+            f"longest mate {dtm.max()} plies"
+        )
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def build_order(signatures, path, force):
+    """Order the signatures to build after the tables they depend on."""
+    order = []
+
+    def visit(signature, requested):
+        if signature in order or signature in INSUFFICIENT_MATERIAL:
+            return
+        if not requested and not force and os.path.exists(table_path(signature, path)):
+            return
+        for dependency in sorted(dependencies(signature)):
+            visit(dependency, False)
+        order.append(signature)
+
+    for signature in signatures:
+        visit(signature, True)
+    return order
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("signatures", nargs="*", default=["KQvK", "KRvK", "KPvK"])
+    parser.add_argument("--output", default=TABLEBASES_PATH)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=1 << 16)
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild the tables depended on too"
+    )
+    args = parser.parse_args()
+
+    for signature in args.signatures:
+        try:
+            parse_signature(signature)
+        except ValueError as error:
+            parser.error(str(error))
+    os.makedirs(args.output, exist_ok=True)
+    for signature in build_order(args.signatures, args.output, args.force):
+        start = time.perf_counter()
+        build_table(signature, args.output, args.processes, args.chunk_size)
+        print(f"{signature} built in {time.perf_counter() - start:.2f}s\n")
@@ -0,0 +1,278 @@
+"""
+This script plays self-play games of ChessGame in parallel processes and records every searched ply as training and analysis data.
+Each record is a fixed-size binary row of RECORD_DTYPE: the board packed as one nibble per square, the side to move, the castling and en passant state, the chosen packed move, its search score and the final result of the game.
+Every worker appends the records of its finished games to its own shard file, and the main process appends one INDEX_DTYPE row per game to the index, so both are append-only and a run can be extended later.
+The files have no header, open_dataset maps them with np.memmap without copying.
+
+Run it from the repository root, e.g. python -m scripts.self_play --games 1000 --workers 4 --output self_play
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from back_end.fen import STARTING_FEN
+from back_end.tablebase import INSUFFICIENT_MATERIAL, material_signature
+from common.config import WHITE
+
+# One record per searched ply, 52 bytes with the int32 fields aligned
+RECORD_DTYPE = np.dtype(
+    [
+        ("board", np.uint8, 32),  # Piece codes, square 2i in the low nibble of byte i
+        ("turn", np.uint8),
+        ("castling_rights", np.uint8),
+        ("en_passant", np.int8),  # -1 for none
+        ("halfmove_clock", np.uint8),
+        ("ply", np.uint16),
+        ("move", np.uint16),  # Packed move, see encode_move
+        ("score", np.int32),  # Search score of the side to move
+        ("game", np.uint32),
+        ("result", np.int8),  # 1, 0 or -1 for a white win, draw or black win
+        ("padding", np.uint8, 3),
+    ]
+)
+# One row per game, in the order the games finished
+INDEX_DTYPE = np.dtype(
+    [
+        ("game", np.uint32),
+        ("shard", np.uint16),
+        ("termination", np.uint8),  # Index in TERMINATIONS
+        ("result", np.int8),
+        ("start", np.uint64),  # First record of the game in its shard
+        ("count", np.uint32),  # Number of records of the game
+        ("plies", np.uint32),  # Plies of the game, random opening plies included
+    ]
+)
+TERMINATIONS = [
+    "checkmate",
+    "stalemate",
+    "fifty_moves",
+    "repetition",
+    "insufficient_material",
+    "max_plies",
+]
+INDEX_NAME = "index.bin"
+SHARD_PATTERN = "shard-{:04d}.bin"
+SHARD_GLOB = "shard-*.bin"
+
+
+def pack_board(mailbox):
+    """Pack the 64 piece codes of a mailbox into 32 bytes, two squares per byte."""
+    codes = np.frombuffer(mailbox, dtype=np.uint8)
+    return codes[0::2] | codes[1::2] << 4
+
+
+def unpack_board(packed):
+    """
+    Unpack boards of pack_board into piece codes, see PIECE_CODE_SYMBOLS.
+
+    :param packed: (..., 32) uint8, e.g. the board column of the records
+    :return: (..., 64) uint8
+    """
+    codes = np.empty(packed.shape[:-1] + (64,), dtype=np.uint8)
+    codes[..., 0::2] = packed & 15
+    codes[..., 1::2] = packed >> 4
+    return codes
+
+
+def open_memmap(path, dtype):
+    """Map a file of fixed-size rows read-only, an empty array for an empty file."""
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    # A row cut short by an interrupted write is left out
+    rows = os.path.getsize(path) // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+
+def open_dataset(path):
+    """
+    Map the index and the shards of a self-play directory.
+
+    :return: (index, {shard number: records})
+    """
+    index = open_memmap(os.path.join(path, INDEX_NAME), INDEX_DTYPE)
+    shards = {}
+    for shard_path in sorted(glob.glob(os.path.join(path, SHARD_GLOB))):
+        shard = int(os.path.basename(shard_path).split("-")[1].split(".")[0])
+        shards[shard] = open_memmap(shard_path, RECORD_DTYPE)
+    return index, shards
+
+
+def game_records(dataset, row):
+    """Get the records of the game of an index row, a view of its shard."""
+    _, shards = dataset
+    start = int(row["start"])
+    return shards[int(row["shard"])][start : start + int(row["count"])]
+
+
+_worker = {}  # Game and shard file of a worker process, set by _init_worker
+
+
+def _init_worker(path, shard_counter, settings):
+    from back_end.game import ChessGame
+
+    with shard_counter.get_lock():
+        shard = shard_counter.value
+        shard_counter.value += 1
+    shard_path = os.path.join(path, SHARD_PATTERN.format(shard))
+    _worker.update(
+        game=ChessGame(),
+        shard=shard,
+        shard_file=open(shard_path, "ab"),
+        records=os.path.getsize(shard_path) // RECORD_DTYPE.itemsize,
+        **settings,
+    )
+
+
+def play_game(game_id, seed):
+    """
+    Play a game in a worker process and append its records to the shard.
+
+    :return: INDEX_DTYPE row as a tuple
+    """
+    game = _worker["game"]
+    board = game.board
+    board.set_fen(STARTING_FEN)
+    rng = random.Random(f"{seed}-{game_id}")
+    rows = []
+    termination = TERMINATIONS.index("max_plies")
+    result = 0
+    for ply in range(_worker["max_plies"]):
+        moves = game.generate_legal_moves()
+        if not moves:
+            if game.is_in_check():
+                termination = TERMINATIONS.index("checkmate")
+                result = -1 if board.turn == WHITE else 1
+            else:
+                termination = TERMINATIONS.index("stalemate")
+            break
+        if board.halfmove_clock >= 100:
+            termination = TERMINATIONS.index("fifty_moves")
+            break
+        if board.is_repetition(3):
+            termination = TERMINATIONS.index("repetition")
+            break
+        if material_signature(board)[0] in INSUFFICIENT_MATERIAL:
+            termination = TERMINATIONS.index("insufficient_material")
+            break
+
+        # Random opening plies so that the games differ, they are not recorded
+        if ply < _worker["random_plies"]:
+            board.make_move(rng.choice(moves))
+            continue
+        move, info = game.best_move(
+            max_nodes=_worker["max_nodes"], max_depth=_worker["max_depth"]
+        )
+        rows.append(
+            (
+                pack_board(board.mailbox),
+                board.turn,
+                board.castling_rights,
+                -1 if board.en_passant is None else board.en_passant,
+                min(board.halfmove_clock, 255),
+                ply,
+                move,
+                info["score"],
+            )
+        )
+        board.make_move(move)
+    else:
+        ply = _worker["max_plies"]
+
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    if rows:
+        columns = list(zip(*rows))
+        records["board"] = np.stack(columns[0])
+        for name, column in zip(RECORD_DTYPE.names[1:8], columns[1:]):
+            records[name] = column
+    records["result"] = result
+    records["game"] = game_id
+    # One write per game, the index only points at complete games
+    records.tofile(_worker["shard_file"])
+    _worker["shard_file"].flush()
+    start = _worker["records"]
+    _worker["records"] += len(records)
+    return game_id, _worker["shard"], termination, result, start, len(records), ply
+
+
+def self_play(path, games, workers, seed=0, **settings):
+    """
+    Play games in worker processes and append them to the dataset of a directory.
+
+    :param settings: max_nodes and max_depth of the searches, random_plies at the
+        start of each game, max_plies of a game
+    :return: the new index rows
+    """
+    os.makedirs(path, exist_ok=True)
+    index, shards = open_dataset(path)
+    first_game = int(index["game"].max()) + 1 if len(index) else 0
+    # New shards for the workers of this run, so that they never share a file
+    shard_counter = multiprocessing.Value("i", max(shards, default=-1) + 1)
+    settings = {
+        "max_nodes": 2000,
+        "max_depth": 8,
+        "random_plies": 8,
+        "max_plies": 300,
+        **settings,
+    }
+    rows = []
+    with open(os.path.join(path, INDEX_NAME), "ab") as index_file:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_worker,
+            initargs=(path, shard_counter, settings),
+        ) as executor:
+            game_ids = range(first_game, first_game + games)
+            for row in executor.map(
+                play_game,
+                game_ids,
+                [seed] * games,
+                chunksize=max(games // (8 * workers), 1),
+            ):
+                np.array([row], dtype=INDEX_DTYPE).tofile(index_file)
+                index_file.flush()
+                rows.append(row)
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="self_play")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-nodes", type=int, default=2000)
+    parser.add_argument("--max-depth", type=int, default=8)
+    parser.add_argument("--random-plies", type=int, default=8)
+    parser.add_argument("--max-plies", type=int, default=300)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = self_play(
+        args.output,
+        args.games,
+        args.workers,
+        args.seed,
+        max_nodes=args.max_nodes,
+        max_depth=args.max_depth,
+        random_plies=args.random_plies,
+        max_plies=args.max_plies,
+    )
+    elapsed = time.perf_counter() - start
+    records = int(rows["count"].sum())
+    print(
+        f"{len(rows)} games, {records} records in {elapsed:.1f}s "
+        f"({records / elapsed:,.0f} records/s)"
+    )
+    terminations = Counter(TERMINATIONS[t] for t in rows["termination"].tolist())
+    results = Counter(rows["result"].tolist())
+    print(f"Results: +{results[1]} ={results[0]} -{results[-1]}, {dict(terminations)}")
+    index, shards = open_dataset(args.output)
+    print(f"Dataset: {len(index)} games, {sum(map(len, shards.values()))} records")